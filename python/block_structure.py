@@ -36,6 +36,12 @@ class BlockStructure(object):
 
         maps from the solver block to the sumk block
         for *inequivalent* correlated shell ish
+
+    The integer index maps used to copy Green's functions between the
+    solver and the sumk structure (see index_maps) are cached; they are
+    reset whenever one of the above attributes is set or the structure
+    is changed by the methods of this class. If the dicts are modified
+    in place otherwise, call clear_index_maps.
     """
     def __init__(self,gf_struct_sumk=None,
                       gf_struct_solver=None,
@@ -50,6 +56,110 @@ class BlockStructure(object):
         self.solver_to_sumk_block = solver_to_sumk_block
         self.deg_shells = deg_shells
 
+    def __setattr__(self,name,value):
+        # the index maps are derived from the structures and mappings
+        if name in ["gf_struct_sumk", "gf_struct_solver", "solver_to_sumk",
+                    "sumk_to_solver", "solver_to_sumk_block"]:
+            self.clear_index_maps()
+        object.__setattr__(self,name,value)
+
+    def clear_index_maps(self):
+        """ Reset the cached index maps (see index_maps)."""
+        self.__dict__['_index_maps'] = {}
+
+    def index_maps(self,ish,icrsh=None):
+        """ Integer index maps between the solver and the sumk blocks.
+
+        The maps are derived from solver_to_sumk and cached.
+
+        Parameters
+        ----------
+        ish : int
+            inequivalent correlated shell index
+        icrsh : int
+            correlated shell whose gf_struct_sumk defines the positions
+            of the sumk indices; default: ish
+
+        Returns
+        -------
+        maps : list of tuple
+            (block, block_sumk, ind, ind_sumk), where ind and ind_sumk
+            are integer arrays of positions, such that the elements
+            ``G_solver[block].data[...,ind[i],ind[j]]`` correspond to
+            ``G_sumk[block_sumk].data[...,ind_sumk[i],ind_sumk[j]]``.
+            Elements of a solver block that belong to different sumk
+            blocks are not mapped.
+        """
+
+        if icrsh is None:
+            icrsh = ish
+        if '_index_maps' not in self.__dict__:
+            self.clear_index_maps()
+        key = (ish,icrsh)
+        if key in self._index_maps:
+            return self._index_maps[key]
+        pos_sumk = {}
+        for block,inner in self.gf_struct_sumk[icrsh]:
+            for i,ind in enumerate(inner):
+                pos_sumk[(block,ind)] = i
+        maps = []
+        for block,inner in self.gf_struct_solver[ish].iteritems():
+            # group the solver indices by the sumk block they map to
+            groups = {}
+            for i,ind in enumerate(inner):
+                block_sumk,ind_sumk = self.solver_to_sumk[ish][(block,ind)]
+                groups.setdefault(block_sumk,([],[]))
+                groups[block_sumk][0].append(i)
+                groups[block_sumk][1].append(pos_sumk[(block_sumk,ind_sumk)])
+            for block_sumk,(ind,ind_sumk) in groups.iteritems():
+                maps.append((block,block_sumk,np.array(ind),np.array(ind_sumk)))
+        self._index_maps[key] = maps
+        return maps
+
+    def copy_solver_to_sumk(self,G_solver,G_sumk,ish,icrsh=None):
+        """ Copy the elements of a solver BlockGf into a sumk BlockGf.
+
+        One fancy-indexing assignment of the data arrays is done per
+        block, using index_maps. Elements of G_sumk that are not in the
+        solver structure are left unchanged.
+
+        Parameters
+        ----------
+        G_solver : BlockGf
+            Gf with the gf_struct_solver structure of shell ish
+        G_sumk : BlockGf
+            Gf with the gf_struct_sumk structure of shell icrsh
+        ish : int
+            inequivalent correlated shell index
+        icrsh : int
+            correlated shell index; default: ish
+        """
+
+        for block,block_sumk,ind,ind_sumk in self.index_maps(ish,icrsh):
+            G_sumk[block_sumk].data[:,ind_sumk[:,np.newaxis],ind_sumk[np.newaxis,:]] = \
+                G_solver[block].data[:,ind[:,np.newaxis],ind[np.newaxis,:]]
+
+    def copy_sumk_to_solver(self,G_sumk,G_solver,ish,icrsh=None):
+        """ Copy the elements of a sumk BlockGf into a solver BlockGf.
+
+        This is the inverse of copy_solver_to_sumk.
+
+        Parameters
+        ----------
+        G_sumk : BlockGf
+            Gf with the gf_struct_sumk structure of shell icrsh
+        G_solver : BlockGf
+            Gf with the gf_struct_solver structure of shell ish
+        ish : int
+            inequivalent correlated shell index
+        icrsh : int
+            correlated shell index; default: ish
+        """
+
+        for block,block_sumk,ind,ind_sumk in self.index_maps(ish,icrsh):
+            G_solver[block].data[:,ind[:,np.newaxis],ind[np.newaxis,:]] = \
+                G_sumk[block_sumk].data[:,ind_sumk[:,np.newaxis],ind_sumk[np.newaxis,:]]
+
     @classmethod
     def full_structure(cls,gf_struct,corr_to_inequiv):
         """ Construct structure that maps to itself.
@@ -163,6 +273,7 @@ class BlockStructure(object):
             for k in gf_struct:
                 gf_struct[k]=range(len(gf_struct[k]))
             self.gf_struct_solver[ish]=gf_struct
+        self.clear_index_maps()
 
     def pick_gf_struct_sumk(self,new_gf_struct):
         """ Pick selected orbitals within blocks.
@@ -254,6 +365,7 @@ class BlockStructure(object):
             self.solver_to_sumk[ish]=so2su
             self.sumk_to_solver[ish]=su2so
             self.solver_to_sumk_block[ish]=so2su_block
+        self.clear_index_maps()
 
     def create_gf(self,ish=0,gf_function=GfImFreq,**kwargs):
         """ Create a zero BlockGf having the gf_struct_solver structure.
@@ -362,6 +474,7 @@ class BlockStructure(object):
                     self.sumk_to_solver[ish][frm]=(frm[0]+'_'+str(frm[1]),0)
                     self.solver_to_sumk[ish][(frm[0]+'_'+str(frm[1]),0)]=frm
                     self.solver_to_sumk_block[ish][frm[0]+'_'+str(frm[1])]=frm[0]
+        self.clear_index_maps()
 
     def __eq__(self,other):
         def compare(one,two):
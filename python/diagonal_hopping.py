@@ -0,0 +1,85 @@
+
+##########################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+##########################################################################
+
+import numpy
+
+
+class DiagonalHopping(object):
+    r"""
+    Hamiltonians H(k) which are diagonal in the Bloch basis, as for Wien2k, stored by their real eigenvalues only.
+
+    Indexing works like for the dense array hopping[ik, isp, i, j]; the requested matrices are built on the fly,
+    and numpy.asarray gives the dense array. The Hamiltonians are read-only; assigning to them requires the
+    dense array (see the diagonal_hopping option of SumkDFT).
+
+    Parameters
+    ----------
+    eps : numpy array or KLocalArray
+          eps[ik, isp, i] is the diagonal element H(k)[i, i] of spin isp.
+    """
+
+    def __init__(self, eps):
+        self.eps = eps
+
+    @property
+    def shape(self):
+        return tuple(self.eps.shape) + (self.eps.shape[-1],)
+
+    @property
+    def dtype(self):
+        return numpy.dtype(numpy.complex_)
+
+    @property
+    def ndim(self):
+        return 4
+
+    def __array__(self, dtype=None):
+        dense = self[:, :, :, :]
+        return dense if dtype is None else dense.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (4 - len(key))
+        eps = numpy.asarray(self.eps[key[0:2]])
+        n_max = eps.shape[-1]
+        dense = numpy.zeros(eps.shape + (n_max,), numpy.complex_)
+        dense[..., numpy.arange(n_max), numpy.arange(n_max)] = eps
+        return dense[(Ellipsis,) + key[2:4]]
+
+
+def diagonal_part(hopping):
+    r"""
+    Returns the real diagonal hopping[..., i, i] if hopping is a real diagonal matrix in its last two indices,
+    and None otherwise.
+    """
+    n_max = hopping.shape[-1]
+    if n_max > 1:
+        # the off-diagonal elements of the flattened matrices
+        flat = hopping.reshape(hopping.shape[:-2] + (n_max * n_max,))
+        off_diagonal = flat[..., 1:].reshape(hopping.shape[:-2] + (n_max - 1, n_max + 1))[..., 0:n_max]
+        if numpy.any(off_diagonal):
+            return None
+    diag = hopping[..., numpy.arange(n_max), numpy.arange(n_max)]
+    if numpy.any(diag.imag):
+        return None
+    return numpy.ascontiguousarray(diag.real)
@@ -0,0 +1,115 @@
+
+##########################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+##########################################################################
+
+import numpy
+from scipy.linalg import qr, lu_factor, lu_solve
+
+
+class DLRBasis(object):
+    r"""
+    Discrete Lehmann representation of fermionic Matsubara Green's functions on a given mesh.
+
+    A Green's function with spectral weight in :math:`[-\omega_{max}, \omega_{max}]` is represented as
+
+    .. math:: G(i\omega_n) = \sum_{l} \frac{g_l}{i\omega_n - \omega_l}
+
+    with a small set of real poles :math:`\omega_l`. The coefficients :math:`g_l` are fixed by the values
+    of G at the same number of Matsubara frequencies (the nodes), which are a subset of the mesh.
+    Poles and nodes are selected by pivoted QR decompositions of the kernel :math:`1/(i\omega_n - \omega)`.
+
+    Parameters
+    ----------
+    mesh : MeshImFreq
+           Fermionic Matsubara mesh, from which the nodes are taken.
+    omega_max : float
+                Largest absolute real frequency at which the Green's functions have spectral weight.
+    eps : float, optional
+          Relative accuracy of the representation.
+    n_panel : integer, optional
+              Number of Chebyshev points per panel of the real-frequency grid on which the poles are selected.
+    """
+
+    def __init__(self, mesh, omega_max, eps=1e-10, n_panel=24):
+
+        self.beta = mesh.beta
+        self.n_iw = len(mesh)
+        self.omega_max = omega_max
+        self.eps = eps
+        iw_mesh = numpy.array([x for x in mesh], numpy.complex_)
+
+        # candidate poles: Chebyshev points on panels refined dyadically towards omega = 0
+        n_levels = max(1, int(numpy.ceil(numpy.log2(self.beta * omega_max))) + 1)
+        edges = omega_max * numpy.concatenate(([0.0], 2.0**numpy.arange(-n_levels, 1)))
+        cheb = 0.5 * (1.0 - numpy.cos(numpy.pi * (numpy.arange(n_panel) + 0.5) / n_panel))
+        omega = numpy.concatenate([a + (b - a) * cheb for a, b in zip(edges[:-1], edges[1:])])
+        omega = numpy.concatenate((-omega[::-1], omega))
+
+        # candidate nodes: all mesh points, thinned out geometrically for very large meshes
+        n_half = self.n_iw // 2
+        n_cand = 2000
+        if n_half > n_cand:
+            pos = numpy.unique(numpy.round(numpy.logspace(0.0, numpy.log10(n_half), n_cand)).astype(int) - 1)
+        else:
+            pos = numpy.arange(n_half)
+        candidates = numpy.concatenate((n_half - 1 - pos[::-1], n_half + pos))
+
+        kernel = 1.0 / (iw_mesh[candidates, numpy.newaxis] - omega[numpy.newaxis, :])
+        r_mat, piv = qr(kernel, mode='r', pivoting=True)
+        diag = abs(numpy.diag(r_mat))
+        rank = numpy.sum(diag > eps * diag[0])
+        self.omega = numpy.sort(omega[piv[0:rank]])
+
+        # select the nodes on an orthonormal basis of the same space, which keeps the fit well conditioned
+        kernel = 1.0 / (iw_mesh[candidates, numpy.newaxis] - self.omega[numpy.newaxis, :])
+        q_mat = numpy.linalg.qr(kernel)[0]
+        r_mat, piv = qr(q_mat.transpose(), mode='r', pivoting=True)
+        self.iw_index = numpy.sort(candidates[piv[0:rank]])
+        self.iw = iw_mesh[self.iw_index]
+
+        # the kernel at the nodes is ill-conditioned, but a backward-stable solve keeps G accurate
+        self.lu_nodes = lu_factor(self.kernel(self.iw))
+        self.fermi = 0.5 * (1.0 - numpy.tanh(0.5 * self.beta * self.omega))
+
+    def __len__(self):
+        return len(self.omega)
+
+    def matches(self, mesh):
+        """True if the basis was constructed for mesh."""
+        return self.beta == mesh.beta and self.n_iw == len(mesh)
+
+    def kernel(self, iw):
+        r"""Returns the matrix :math:`1/(i\omega_n - \omega_l)` for the frequencies iw."""
+        return 1.0 / (numpy.asarray(iw)[:, numpy.newaxis] - self.omega[numpy.newaxis, :])
+
+    def fit(self, G_nodes, axis=-3):
+        """Coefficients g_l from the values of G at the nodes along axis."""
+        G_nodes = numpy.moveaxis(G_nodes, axis, 0)
+        coeff = lu_solve(self.lu_nodes, G_nodes.reshape(len(self), -1))
+        return numpy.moveaxis(coeff.reshape(G_nodes.shape), 0, axis)
+
+    def evaluate(self, coeff, iw, axis=-3):
+        """Values of G at the frequencies iw from the coefficients g_l along axis."""
+        return numpy.moveaxis(numpy.tensordot(self.kernel(iw), coeff, axes=(1, axis)), 0, axis)
+
+    def density(self, coeff, axis=-3):
+        r"""Density :math:`\frac{1}{\beta}\sum_n G(i\omega_n) e^{i\omega_n 0^+} = \sum_l g_l f(\omega_l)`."""
+        return numpy.tensordot(self.fermi, coeff, axes=(0, axis))
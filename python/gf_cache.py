@@ -0,0 +1,97 @@
+
+##########################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+##########################################################################
+
+import threading
+from collections import OrderedDict
+
+
+class LatticeGfCache(object):
+    r"""
+    Memory-bounded cache of lattice Green's functions with least-recently-used eviction.
+
+    The entries are dicts of numpy arrays (as returned by SumkDFT.lattice_gf_block), which are made
+    read-only when they are stored. The cache can be used by several threads.
+
+    Parameters
+    ----------
+    max_bytes : integer, optional
+                Largest total size of the cached arrays in bytes; 0 switches the cache off.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the entry for key and marks it as most recently used, or None if it is not cached."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Stores value under key, evicting the least recently used entries beyond max_bytes."""
+        n_bytes = sum(a.nbytes for a in value.values())
+        if n_bytes > self.max_bytes:
+            return
+        for a in value.values():
+            a.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.n_bytes -= old[1]
+            self._entries[key] = (value, n_bytes)
+            self.n_bytes += n_bytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """Sets the largest total size, evicting the least recently used entries beyond it."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self.n_bytes > self.max_bytes:
+            self.n_bytes -= self._entries.popitem(last=False)[1][1]
+
+    def discard(self, predicate):
+        """Removes all entries whose key fulfils predicate(key)."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.n_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
@@ -0,0 +1,117 @@
+
+##########################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+##########################################################################
+
+import numpy
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class KLocalArray(object):
+    r"""
+    The rows of the k-points ik_first, ..., ik_first + len(local) - 1 of an array whose first index is the k-point.
+
+    The array is indexed with the global k-indices, like the full array; the first index has to be an integer,
+    a slice or an integer array of k-points in the local range.
+
+    Parameters
+    ----------
+    local : numpy array
+            The rows of the local k-points.
+    ik_first : integer
+               Global index of the first local k-point.
+    n_k : integer
+          Total number of k-points.
+    """
+
+    def __init__(self, local, ik_first, n_k):
+        self.local = local
+        self.ik_first = ik_first
+        self.n_k = n_k
+
+    @property
+    def shape(self):
+        return (self.n_k,) + self.local.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.local.dtype
+
+    @property
+    def ndim(self):
+        return self.local.ndim
+
+    @property
+    def strides(self):
+        return self.local.strides
+
+    def _local_index(self, ik):
+        if isinstance(ik, slice):
+            start, stop, step = ik.indices(self.n_k)
+            ik = numpy.arange(start, stop, step)
+        ik_loc = numpy.asarray(ik) - self.ik_first
+        if numpy.any((ik_loc < 0) | (ik_loc >= self.local.shape[0])):
+            raise IndexError, "KLocalArray: k-point %s is not stored on this process." % (ik,)
+        return ik_loc
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.local[(self._local_index(key[0]),) + key[1:]]
+        return self.local[self._local_index(key)]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, tuple):
+            self.local[(self._local_index(key[0]),) + key[1:]] = value
+        else:
+            self.local[self._local_index(key)] = value
+
+
+def read_k_slab(hdf_file, subgrp, name, ik_first, ik_last):
+    r"""
+    Reads the rows ik_first, ..., ik_last of a dataset written by HDFArchive, without reading the rest.
+
+    Parameters
+    ----------
+    hdf_file : string
+               Name of the hdf5 file.
+    subgrp : string
+             Name of the subgroup containing the dataset.
+    name : string
+           Name of the dataset; its first index is the k-point.
+    ik_first, ik_last : integers
+                        First and last k-point to be read.
+
+    Returns
+    -------
+    local : numpy array
+            The rows ik_first, ..., ik_last of the dataset.
+    """
+    if h5py is None:
+        raise ImportError, "read_k_slab: h5py is needed for reading the k-points of a process."
+    with h5py.File(hdf_file, 'r') as f:
+        dataset = f[subgrp][name]
+        local = dataset[ik_first:ik_last + 1]
+        # complex arrays are stored by HDFArchive with the real and imaginary part in the last dimension
+        if '__complex__' in dataset.attrs:
+            local = local[..., 0] + 1j * local[..., 1]
+    return local
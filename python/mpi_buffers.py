@@ -0,0 +1,182 @@
+
+##########################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+##########################################################################
+
+"""
+Collective operations on contiguous numpy buffers.
+
+The functions use the buffer interface of the mpi4py communicator mpi.world where it is available,
+and fall back to the generic (pickling) functions of pytriqs.utility.mpi otherwise.
+"""
+
+import numpy
+import pytriqs.utility.mpi as mpi
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+
+
+def _has_buffer_interface():
+    return MPI is not None and hasattr(mpi.world, 'Gatherv') and hasattr(mpi.world, 'Allreduce')
+
+
+def all_reduce_sum(arrays):
+    """
+    Sums numpy arrays over all processes, in place.
+
+    The arrays are packed into one contiguous buffer per dtype, which is summed by a single
+    in-place Allreduce, and unpacked again. Views, like the data of Green's functions, are updated as well.
+
+    Parameters
+    ----------
+    arrays : list of numpy arrays
+             Arrays to be summed; they have to have the same shapes and dtypes, in the same order,
+             on all processes.
+    """
+    _all_reduce(arrays, 'sum')
+
+
+def all_reduce_max(arrays):
+    """
+    Element-wise maximum of real numpy arrays over all processes, in place; see all_reduce_sum.
+
+    Parameters
+    ----------
+    arrays : list of numpy arrays
+             Arrays to be reduced; they have to have the same shapes and dtypes, in the same order,
+             on all processes.
+    """
+    _all_reduce(arrays, 'max')
+
+
+def _all_reduce(arrays, op):
+    """Reduces numpy arrays over all processes in place with op ('sum' or 'max'), one Allreduce per dtype."""
+    if mpi.size == 1:
+        return
+    if not _has_buffer_interface():
+        reduce_op = (lambda x, y: x + y) if op == 'sum' else (lambda x, y: numpy.maximum(x, y))
+        for a in arrays:
+            a[...] = mpi.all_reduce(mpi.world, a, reduce_op)
+        return
+    groups = {}
+    for a in arrays:
+        groups.setdefault(a.dtype.str, []).append(a)
+    for dtype in sorted(groups.keys()):
+        buf = numpy.concatenate([a.ravel() for a in groups[dtype]])
+        mpi.world.Allreduce(MPI.IN_PLACE, buf, op=MPI.SUM if op == 'sum' else MPI.MAX)
+        offset = 0
+        for a in groups[dtype]:
+            a[...] = buf[offset:offset + a.size].reshape(a.shape)
+            offset += a.size
+
+
+def block_gf_arrays(block_gfs):
+    """Returns the data arrays of all blocks of a list of BlockGf, for all_reduce_sum."""
+    return [gf.data for G in block_gfs for bname, gf in G]
+
+
+def gather_arrays(local, root=0):
+    """
+    Gathers the 1d arrays of all processes into one array on the root process.
+
+    Parameters
+    ----------
+    local : numpy array
+            1d array of this process; the dtype has to be the same on all processes.
+    root : integer, optional
+           Rank of the receiving process.
+
+    Returns
+    -------
+    gathered : numpy array or None
+               Concatenation of the arrays in the order of the ranks on root, None on the other processes.
+    """
+    local = numpy.ascontiguousarray(local)
+    if mpi.size == 1:
+        return local
+    if not _has_buffer_interface():
+        parts = mpi.world.gather(local, root=root)
+        return numpy.concatenate(parts) if mpi.rank == root else None
+    counts = numpy.array(mpi.world.allgather(local.size))
+    if mpi.rank == root:
+        gathered = numpy.empty(counts.sum(), local.dtype)
+        displs = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        mpi.world.Gatherv(local, [gathered, counts, displs], root=root)
+        return gathered
+    mpi.world.Gatherv(local, None, root=root)
+    return None
+
+
+def _has_shared_memory():
+    return MPI is not None and hasattr(MPI, 'COMM_TYPE_SHARED') and hasattr(mpi.world, 'Split_type')
+
+
+def shared_bcast(arrays):
+    """
+    Broadcasts numpy arrays from the master node into memory shared by the processes of each node.
+
+    The arrays are stored once per node, in an MPI-3 shared memory window, and are read-only. Without
+    mpi4py or MPI-3, or on a single process, they are broadcast as usual and every process has its own copy.
+
+    Parameters
+    ----------
+    arrays : list of numpy arrays
+             Arrays to be broadcast; only used on the master node.
+
+    Returns
+    -------
+    shared : list of numpy arrays
+             The arrays on all processes.
+    window : MPI.Win or None
+             The shared memory window holding the arrays, None if the arrays are not shared. It has to be freed
+             (window.Free(), by all processes) only when the arrays are no longer used.
+    """
+    if mpi.size == 1:
+        return arrays, None
+    if not _has_shared_memory():
+        return mpi.bcast(arrays), None
+    layout = mpi.bcast([(a.shape, a.dtype.str) for a in arrays] if mpi.is_master_node() else None)
+    # aligned byte offsets of the arrays in the window
+    offsets, n_bytes = [], 0
+    for shape, dtype in layout:
+        offsets.append(n_bytes)
+        n_bytes += -(-int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize // 64) * 64
+    node = mpi.world.Split_type(MPI.COMM_TYPE_SHARED, key=mpi.rank)
+    # the first process of each node, with the master node first
+    leaders = mpi.world.Split(0 if node.rank == 0 else MPI.UNDEFINED, key=mpi.rank)
+    window = MPI.Win.Allocate_shared(max(n_bytes, 1) if node.rank == 0 else 0, 1, comm=node)
+    buf = window.Shared_query(0)[0]
+    shared = [numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=buf, offset=offset)
+              for (shape, dtype), offset in zip(layout, offsets)]
+    if mpi.is_master_node():
+        for s, a in zip(shared, arrays):
+            s[...] = a
+    if node.rank == 0:
+        for s in shared:
+            if s.size > 0:
+                leaders.Bcast(s, root=0)
+        leaders.Free()
+    node.Barrier()
+    node.Free()
+    for s in shared:
+        s.flags.writeable = False
+    return shared, window
@@ -22,6 +22,11 @@
 
 from types import *
 import numpy
+import os
+import time
+import hashlib
+import threading
+from multiprocessing.pool import ThreadPool
 import pytriqs.utility.dichotomy as dichotomy
 from pytriqs.gf import *
 import pytriqs.utility.mpi as mpi
@@ -29,11 +34,17 @@ from pytriqs.utility.comparison_tests import assert_arrays_are_close
 from pytriqs.archive import *
 from symmetry import *
 from block_structure import BlockStructure
+from dlr_basis import DLRBasis
+from gf_cache import LatticeGfCache
+from k_local_array import KLocalArray, read_k_slab
+from diagonal_hopping import DiagonalHopping, diagonal_part
+from mpi_buffers import gather_arrays, all_reduce_sum, all_reduce_max, shared_bcast
 from sets import Set
 from itertools import product
+from numpy.lib.stride_tricks import as_strided
 from warnings import warn
 from scipy import compress
-from scipy.optimize import minimize
+from scipy.optimize import minimize, brentq
 
 
 class SumkDFT(object):
@@ -42,7 +53,7 @@ class SumkDFT(object):
     def __init__(self, hdf_file, h_field=0.0, use_dft_blocks=False,
                  dft_data='dft_input', symmcorr_data='dft_symmcorr_input', parproj_data='dft_parproj_input',
                  symmpar_data='dft_symmpar_input', bands_data='dft_bands_input', transp_data='dft_transp_input',
-                 misc_data='dft_misc_input'):
+                 misc_data='dft_misc_input', distribute_k=False, shared_memory=False, diagonal_hopping=False):
         r"""
         Initialises the class from data previously stored into an hdf5 archive.
 
@@ -79,6 +90,17 @@ class SumkDFT(object):
                       Name of hdf5 subgroup in which DFT data necessary for transport calculations are stored.
         misc_data : string, optional
                     Name of hdf5 subgroup in which miscellaneous DFT data are stored.
+        distribute_k : boolean, optional
+                       If True, every process reads only the k-points it treats in the k-sums from the k-dependent
+                       datasets proj_mat, hopping and proj_mat_all (see :meth:`read_input_from_hdf
+                       <dft.sumk_dft.SumkDFT.read_input_from_hdf>`). Needs h5py.
+        shared_memory : boolean, optional
+                        If True, the large read-only datasets proj_mat, hopping, proj_mat_all and velocities_k are
+                        stored once per node, in memory shared by its processes. Needs mpi4py and MPI-3.
+        diagonal_hopping : boolean, optional
+                           If True, Hamiltonians which are real and diagonal in the Bloch basis (as from Wien2k) are
+                           stored by their diagonals only, as read-only :class:`DiagonalHopping
+                           <dft.diagonal_hopping.DiagonalHopping>`, which saves memory and time in the k-sums.
         """
 
         if not type(hdf_file) == StringType:
@@ -93,6 +115,13 @@ class SumkDFT(object):
             self.transp_data = transp_data
             self.misc_data = misc_data
             self.h_field = h_field
+            self.distribute_k = distribute_k
+            self.shared_memory = shared_memory
+            self.diagonal_hopping = diagonal_hopping
+            # shared memory windows of the datasets, see read_input_from_hdf
+            self.shared_windows = {}
+            # distributions of the k-points over the processes, see _k_plan
+            self.k_plans = {}
 
             # Read input from HDF:
             things_to_read = ['energy_unit', 'n_k', 'k_dep_projection', 'SP', 'SO', 'charge_below', 'density_required',
@@ -148,8 +177,35 @@ class SumkDFT(object):
             self.deg_shells = [[] for ish in range(self.n_inequiv_shells)]
 
             self.chemical_potential = 0.0  # initialise mu
+            self.dens_mu = None  # dN/dmu at the chemical potential, set by calc_mu
+            # lattice GFs of the k-blocks, see set_gf_cache; the version is
+            # increased whenever the self-energy or the double counting change
+            self.gf_cache = LatticeGfCache()
+            # Sigma upfolded with k-independent projectors, see _upfolded_sigma
+            self.sigma_upfolded = {}
+            self.sigma_version = 0
             self.init_dc()  # initialise the double counting
 
+            # memory (in bytes) used for the lattice GFs of a block of
+            # k-points in the batched k-sums
+            self.k_block_memory = 256 * 1024**2
+            # memory (in bytes) per process for the poles of the lattice GFs
+            # kept by calc_mu(spectral=True)
+            self.spectral_memory = 1024**3
+            # number of threads per process for the blocks of k-points in
+            # the k-sums (the BLAS threads should be reduced accordingly)
+            self.n_threads = 1
+            # checkpoints of the long k-sums, see set_checkpoint
+            self.checkpoint_interval = None
+            self.checkpoint_file = None
+            self.checkpoint_data = 'dft_checkpoint'
+            # compact Matsubara representation, see set_dlr
+            self.dlr_omega_max = None
+            self.dlr_eps = 1e-10
+            self.dlr_basis = None
+            # non-interacting sums from the eigenvalues of H(k), see set_noninteracting_eigen
+            self.noninteracting_eigen = False
+
             # Analyse the block structure and determine the smallest gf_struct
             # blocks and maps, if desired
             if use_dft_blocks:
@@ -159,16 +215,30 @@ class SumkDFT(object):
 # hdf5 FUNCTIONS
 ################
 
-    def read_input_from_hdf(self, subgrp, things_to_read):
+    def read_input_from_hdf(self, subgrp, things_to_read, shared_memory=None):
         r"""
         Reads data from the HDF file. Prints a warning if a requested dataset is not found.
 
+        The data are read on the master node and broadcast. With distribute_k, the k-dependent datasets proj_mat,
+        hopping and proj_mat_all are instead read by every process for its own k-points only, which are stored as
+        :class:`KLocalArray <dft.k_local_array.KLocalArray>`. The distribution of the k-points is then fixed by the
+        number of orbitals read before (see _k_plan).
+
+        With shared_memory, the (other) large datasets proj_mat, hopping, proj_mat_all and velocities_k are broadcast
+        into memory shared by the processes of a node, and are read-only.
+
+        With diagonal_hopping, Hamiltonians which are real and diagonal in the Bloch basis (as from Wien2k) are stored
+        by their diagonal only, as :class:`DiagonalHopping <dft.diagonal_hopping.DiagonalHopping>`.
+
         Parameters
         ----------
         subgrp : string
                  Name of hdf5 file subgroup from which the data are to be read.
         things_to_read : list of strings
                          List of datasets to be read from the hdf5 file.
+        shared_memory : boolean, optional
+                        Store proj_mat, hopping, proj_mat_all and velocities_k once per node; the default is
+                        the shared_memory option of the initialisation.
 
         Returns
         -------
@@ -182,9 +252,18 @@ class SumkDFT(object):
         value_read = True
         # initialise variables on all nodes to ensure mpi broadcast works at
         # the end
+        if shared_memory is None:
+            shared_memory = self.shared_memory
         for it in things_to_read:
             setattr(self, it, 0)
+            if it in self.shared_windows:
+                self.shared_windows.pop(it).Free()
         subgroup_present = 0
+        # datasets read by every process for its own k-points
+        k_local_read = [it for it in things_to_read if self.distribute_k and it in ['proj_mat', 'hopping', 'proj_mat_all']]
+        # datasets stored once per node
+        shared_read = [it for it in things_to_read if shared_memory and not it in k_local_read
+                       and it in ['proj_mat', 'hopping', 'proj_mat_all', 'velocities_k']]
 
         if mpi.is_master_node():
             with HDFArchive(self.hdf_file, 'r') as ar:
@@ -192,7 +271,9 @@ class SumkDFT(object):
                     subgroup_present = True
                     # first read the necessary things:
                     for it in things_to_read:
-                        if it in ar[subgrp]:
+                        if it in ar[subgrp] and it in k_local_read:
+                            pass
+                        elif it in ar[subgrp]:
                             setattr(self, it, ar[subgrp][it])
                         else:
                             mpi.report("Loading %s failed!" % it)
@@ -203,11 +284,59 @@ class SumkDFT(object):
                             "Loading failed: No %s subgroup in hdf5!" % subgrp)
                     subgroup_present = False
                     value_read = False
+        # Hamiltonians diagonal in the Bloch basis are broadcast as their diagonals
+        hopping_diagonal = False
+        if mpi.is_master_node() and self.diagonal_hopping and 'hopping' in things_to_read \
+                and not 'hopping' in k_local_read and isinstance(self.hopping, numpy.ndarray):
+            eps = diagonal_part(self.hopping)
+            if eps is not None:
+                self.hopping, hopping_diagonal = eps, True
+        hopping_diagonal = mpi.bcast(hopping_diagonal)
+
         # now do the broadcasting:
-        for it in things_to_read:
-            setattr(self, it, mpi.bcast(getattr(self, it)))
         subgroup_present = mpi.bcast(subgroup_present)
         value_read = mpi.bcast(value_read)
+        if not value_read:
+            shared_read = []
+        for it in things_to_read:
+            if not it in k_local_read + shared_read:
+                setattr(self, it, mpi.bcast(getattr(self, it)))
+        for it in shared_read:
+            if it == 'velocities_k':
+                # list over spins of lists over k of arrays, shared as one list of arrays
+                n_k_spin = mpi.bcast([len(v) for v in self.velocities_k] if mpi.is_master_node() else None)
+                arrays = [numpy.asarray(v) for vs in self.velocities_k for v in vs] if mpi.is_master_node() else None
+                arrays, window = shared_bcast(arrays)
+                offsets = numpy.concatenate(([0], numpy.cumsum(n_k_spin)))
+                self.velocities_k = [arrays[offsets[isp]:offsets[isp + 1]] for isp in range(len(n_k_spin))]
+            else:
+                arrays, window = shared_bcast([getattr(self, it)] if mpi.is_master_node() else None)
+                setattr(self, it, arrays[0])
+            if window is not None:
+                self.shared_windows[it] = window
+        if hopping_diagonal:
+            self.hopping = DiagonalHopping(self.hopping)
+
+        if k_local_read and value_read:
+            ik_local = self._k_plan()['ik_local']
+            ik_first = numpy.min(ik_local) if len(ik_local) > 0 else 0
+            ik_last = numpy.max(ik_local) if len(ik_local) > 0 else -1
+            for it in k_local_read:
+                local = read_k_slab(self.hdf_file, subgrp, it, ik_first, ik_last)
+                eps = diagonal_part(local) if it == 'hopping' and self.diagonal_hopping else None
+                if eps is not None:
+                    self.hopping = DiagonalHopping(KLocalArray(eps, ik_first, self.n_k))
+                else:
+                    setattr(self, it, KLocalArray(local, ik_first, self.n_k))
+
+        if 'proj_mat' in things_to_read:
+            self._store_k_independent_projectors()
+
+        # eigen-decompositions of H(k) have to be recalculated for new Hamiltonians
+        if ('hopping' in things_to_read) or ('n_orbitals' in things_to_read):
+            self.eigensystem = {}
+            if hasattr(self, 'gf_cache'):
+                self.gf_cache.clear()
 
         return subgroup_present, value_read
 
@@ -232,7 +361,14 @@ class SumkDFT(object):
                         "solver_to_sumk", "sumk_to_solver", "solver_to_sumk_block"]:
                     warn("It is not recommended to save '{}' individually. Save 'block_structure' instead.".format(it))
                 try:
-                    ar[subgrp][it] = getattr(self, it)
+                    value = getattr(self, it)
+                    # Hamiltonians stored by their diagonals are saved as dense arrays
+                    if isinstance(value, DiagonalHopping):
+                        value = numpy.asarray(value)
+                    # projectors stored once for all k-points are saved for every k-point
+                    elif isinstance(value, numpy.ndarray) and 0 in value.strides:
+                        value = numpy.ascontiguousarray(value)
+                    ar[subgrp][it] = value
                 except:
                     mpi.report("%s not found, and so not saved." % it)
 
@@ -437,10 +573,13 @@ class SumkDFT(object):
 
         return gf_rotated
 
-    def lattice_gf(self, ik, mu=None, iw_or_w="iw", beta=40, broadening=None, mesh=None, with_Sigma=True, with_dc=True):
+    def lattice_gf(self, ik, mu=None, iw_or_w="iw", beta=40, broadening=None, mesh=None, with_Sigma=True, with_dc=True, window=None):
         r"""
         Calculates the lattice Green function for a given k-point from the DFT Hamiltonian and the self energy. 
 
+        This is a thin wrapper around :meth:`lattice_gf_block <dft.sumk_dft.SumkDFT.lattice_gf_block>`,
+        which puts the result for a single k-point into a BlockGf.
+
         Parameters
         ----------
         ik : integer
@@ -467,6 +606,9 @@ class SumkDFT(object):
                      If with_Sigma=True but self.Sigmaimp_(w/iw) is not present, with_Sigma is reset to False.
         with_dc : boolean, optional
                   if True and with_Sigma=True, the dc correction is substracted from the self-energy before it is included into GF.
+        window : list of double, optional
+                 Only for real frequencies: (om_min, om_max). The GF is only calculated at the mesh points in this
+                 window, and returned on the corresponding part of the mesh. The self-energy is sliced accordingly.
 
         Returns
         -------
@@ -474,10 +616,113 @@ class SumkDFT(object):
                  Lattice Green's function.
 
         """
-        if mu is None:
-            mu = self.chemical_potential
         ntoi = self.spin_names_to_ind[self.SO]
         spn = self.spin_block_names[self.SO]
+        mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh(
+            iw_or_w, beta, broadening, mesh, with_Sigma)
+        full_mesh, om_index = mesh, None
+        if window is not None:
+            om_index, mesh = self._window_index(iw_or_w, mesh, window)
+
+        # Check if G_latt is present
+        set_up_G_latt = False                       # Assume not
+        if not hasattr(self, "G_latt_" + iw_or_w):
+            # Need to create G_latt_(i)w
+            set_up_G_latt = True
+        else:                                       # Check that existing GF is consistent
+            G_latt = getattr(self, "G_latt_" + iw_or_w)
+            GFsize = [gf.target_shape[0] for bname, gf in G_latt]
+            unchangedsize = all([self.n_orbitals[ik, ntoi[spn[isp]]] == GFsize[
+                                isp] for isp in range(self.n_spin_blocks[self.SO])])
+            if not unchangedsize:
+                set_up_G_latt = True
+            if len(G_latt.mesh) != len(mesh):
+                set_up_G_latt = True
+            if (iw_or_w == "iw") and (self.G_latt_iw.mesh.beta != beta):
+                set_up_G_latt = True  # additional check for ImFreq
+            if (iw_or_w == "w") and ((G_latt.mesh.omega_min != mesh.omega_min) or
+                                     (G_latt.mesh.omega_max != mesh.omega_max)):
+                set_up_G_latt = True  # e.g. another frequency window
+
+        # Set up G_latt
+        if set_up_G_latt:
+            block_structure = [
+                range(self.n_orbitals[ik, ntoi[sp]]) for sp in spn]
+            gf_struct = [(spn[isp], block_structure[isp])
+                         for isp in range(self.n_spin_blocks[self.SO])]
+            block_ind_list = [block for block, inner in gf_struct]
+            if iw_or_w == "iw":
+                glist = lambda: [GfImFreq(indices=inner, mesh=mesh)
+                                 for block, inner in gf_struct]
+            elif iw_or_w == "w":
+                glist = lambda: [GfReFreq(indices=inner, mesh=mesh)
+                                 for block, inner in gf_struct]
+            G_latt = BlockGf(name_list=block_ind_list,
+                             block_list=glist(), make_copies=False)
+            G_latt.zero()
+
+        G_latt_block = self._lattice_gf_data(numpy.array([ik]), mu=mu, iw_or_w=iw_or_w, mesh=full_mesh,
+                                             broadening=broadening, with_Sigma=with_Sigma, with_dc=with_dc,
+                                             iw_index=om_index)
+        for bname, gf in G_latt:
+            n_orb = self.n_orbitals[ik, ntoi[bname]]
+            gf.data[:, :, :] = G_latt_block[bname][0, :, 0:n_orb, 0:n_orb]
+        setattr(self, "G_latt_" + iw_or_w, G_latt)
+
+        return G_latt
+
+    def lattice_gf_block(self, ik_block, mu=None, iw_or_w="iw", beta=40, broadening=None, mesh=None, with_Sigma=True, with_dc=True, window=None):
+        r"""
+        Calculates the lattice Green's function for a whole block of k-points and all frequencies at once.
+
+        The Hamiltonian, the projectors and the self-energy are kept in stacked arrays and
+
+        .. math:: G(k, i\omega_n) = [(i\omega_n + \mu) \mathbb{1} - H(k) - P^{\dagger}(k) (\Sigma(i\omega_n) - \Sigma_{dc}) P(k)]^{-1}
+
+        is evaluated by a single batched matrix inversion. Since n_orbitals depends on k in general,
+        all matrices are padded to the largest number of orbitals in ik_block; the padded entries of the result are zero.
+
+        Parameters
+        ----------
+        ik_block : list of integers
+                   k-point indices.
+        mu, iw_or_w, beta, broadening, mesh, with_Sigma, with_dc, window :
+                   Same as for :meth:`lattice_gf <dft.sumk_dft.SumkDFT.lattice_gf>`.
+
+        Returns
+        -------
+        mesh : MeshImFreq or MeshReFreq
+               Frequency mesh of the lattice Green's function.
+        G_latt : dict of numpy arrays
+                 G_latt[bname][i, iom, :, :] is the lattice Green's function at k-point ik_block[i]
+                 and frequency index iom. The arrays are read-only if the cache (set_gf_cache) is used.
+
+        """
+        mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh(
+            iw_or_w, beta, broadening, mesh, with_Sigma)
+        full_mesh, om_index = mesh, None
+        if window is not None:
+            om_index, mesh = self._window_index(iw_or_w, mesh, window)
+        G_latt = self._lattice_gf_data(numpy.array(ik_block, dtype=int), mu=mu, iw_or_w=iw_or_w, mesh=full_mesh,
+                                       broadening=broadening, with_Sigma=with_Sigma, with_dc=with_dc,
+                                       iw_index=om_index)
+        return mesh, G_latt
+
+    def _window_index(self, iw_or_w, mesh, window):
+        """
+        Returns the indices of the points of a real-frequency mesh (or list of frequencies)
+        in window=(om_min, om_max), and the corresponding part of the mesh.
+        """
+        if iw_or_w != "w":
+            raise ValueError, "lattice_gf: a frequency window is only implemented for real frequencies."
+        om_mesh = numpy.array([x.real for x in mesh])
+        om_index = numpy.nonzero((om_mesh >= window[0]) & (om_mesh <= window[1]))[0]
+        if len(om_index) < 2:
+            raise ValueError, "lattice_gf: less than two mesh points in the window (%s, %s)." % (window[0], window[1])
+        return om_index, MeshReFreq(om_mesh[om_index[0]], om_mesh[om_index[-1]], len(om_index))
+
+    def _lattice_gf_mesh(self, iw_or_w, beta, broadening, mesh, with_Sigma):
+        """Determines mesh, beta and broadening of the lattice Green's function and whether Sigma is included."""
         if (iw_or_w != "iw") and (iw_or_w != "w"):
             raise ValueError, "lattice_gf: Implemented only for Re/Im frequency functions."
         if not hasattr(self, "Sigma_imp_" + iw_or_w):
@@ -491,9 +736,6 @@ class SumkDFT(object):
         # Are we including Sigma?
         if with_Sigma:
             Sigma_imp = getattr(self, "Sigma_imp_" + iw_or_w)
-            sigma_minus_dc = [s.copy() for s in Sigma_imp]
-            if with_dc:
-                sigma_minus_dc = self.add_dc(iw_or_w)
             if iw_or_w == "iw":
                 # override beta if Sigma_iw is present
                 beta = Sigma_imp[0].mesh.beta
@@ -513,63 +755,845 @@ class SumkDFT(object):
                     raise ValueError, "lattice_gf: Give the mesh=(om_min,om_max,n_points) for the lattice GfReFreq."
                 mesh = MeshReFreq(mesh[0], mesh[1], mesh[2])
 
-        # Check if G_latt is present
-        set_up_G_latt = False                       # Assume not
-        if not hasattr(self, "G_latt_" + iw_or_w):
-            # Need to create G_latt_(i)w
-            set_up_G_latt = True
-        else:                                       # Check that existing GF is consistent
-            G_latt = getattr(self, "G_latt_" + iw_or_w)
-            GFsize = [gf.target_shape[0] for bname, gf in G_latt]
-            unchangedsize = all([self.n_orbitals[ik, ntoi[spn[isp]]] == GFsize[
-                                isp] for isp in range(self.n_spin_blocks[self.SO])])
-            if not unchangedsize:
-                set_up_G_latt = True
-            if (iw_or_w == "iw") and (self.G_latt_iw.mesh.beta != beta):
-                set_up_G_latt = True  # additional check for ImFreq
+        return mesh, beta, broadening, with_Sigma
 
-        # Set up G_latt
-        if set_up_G_latt:
-            block_structure = [
-                range(self.n_orbitals[ik, ntoi[sp]]) for sp in spn]
-            gf_struct = [(spn[isp], block_structure[isp])
-                         for isp in range(self.n_spin_blocks[self.SO])]
-            block_ind_list = [block for block, inner in gf_struct]
-            if iw_or_w == "iw":
-                glist = lambda: [GfImFreq(indices=inner, mesh=mesh)
-                                 for block, inner in gf_struct]
-            elif iw_or_w == "w":
-                glist = lambda: [GfReFreq(indices=inner, mesh=mesh)
-                                 for block, inner in gf_struct]
-            G_latt = BlockGf(name_list=block_ind_list,
-                             block_list=glist(), make_copies=False)
-            G_latt.zero()
+    def _lattice_gf_data(self, ik_block, mu, iw_or_w, mesh, broadening, with_Sigma, with_dc, iw_index=None):
+        """
+        Batched kernel of lattice_gf_block; the mesh and the broadening have to be given explicitly.
+        If iw_index is given, only the mesh points iw_index are calculated (Matsubara or real frequencies).
+        The results are looked up in and stored into self.gf_cache, if it is switched on; they must not be modified.
+        """
+        if mu is None:
+            mu = self.chemical_potential
+        key = None
+        if self.gf_cache.max_bytes > 0:
+            mesh_key = tuple(getattr(mesh, a, None) for a in ('beta', 'omega_min', 'omega_max')) + (len(mesh),)
+            key = (self.sigma_version, mu, tuple(numpy.asarray(ik_block).tolist()), iw_or_w, mesh_key,
+                   broadening if iw_or_w == "w" else None, with_Sigma, with_dc, self.h_field,
+                   None if iw_index is None else tuple(iw_index.tolist()))
+            G_latt = self.gf_cache.get(key)
+            if G_latt is not None:
+                return G_latt
+
+        G_latt = self._inverse_lattice_gf_data(ik_block, mu, iw_or_w, mesh, broadening, with_Sigma, with_dc,
+                                               iw_index=iw_index)
+        for bname in G_latt:
+            isp = self.spin_names_to_ind[self.SO][bname]
+            n_max = G_latt[bname].shape[-1]
+            if self._diagonal_hopping() and not with_Sigma:
+                # G^{-1} is diagonal
+                diag = numpy.arange(n_max)
+                G_diag = 1.0 / G_latt[bname][:, :, diag, diag]
+                G_latt[bname][:, :, diag, diag] = G_diag
+            else:
+                G_latt[bname] = numpy.linalg.inv(G_latt[bname])
+            # set the padded orbitals to zero again
+            pad_k, pad_orb = numpy.nonzero(numpy.arange(n_max)[numpy.newaxis, :] >=
+                                           self.n_orbitals[ik_block, isp][:, numpy.newaxis])
+            G_latt[bname][pad_k, :, pad_orb, :] = 0.0
+            G_latt[bname][pad_k, :, :, pad_orb] = 0.0
+
+        if key is not None:
+            self.gf_cache.put(key, G_latt)
+        return G_latt
 
-        if iw_or_w == "iw":
-            G_latt << iOmega_n
-        elif iw_or_w == "w":
-            G_latt << Omega + 1j * broadening
-
-        idmat = [numpy.identity(
-            self.n_orbitals[ik, ntoi[sp]], numpy.complex_) for sp in spn]
-        M = copy.deepcopy(idmat)
-        for ibl in range(self.n_spin_blocks[self.SO]):
-            ind = ntoi[spn[ibl]]
-            n_orb = self.n_orbitals[ik, ind]
-            M[ibl] = self.hopping[ik, ind, 0:n_orb, 0:n_orb] - \
-                (idmat[ibl] * mu) - (idmat[ibl] * self.h_field * (1 - 2 * ibl))
-        G_latt -= M
+    def _inverse_lattice_gf_data(self, ik_block, mu, iw_or_w, mesh, broadening, with_Sigma, with_dc, iw_index=None):
+        """Inverse lattice GFs of a block of k-points; the padded orbitals are decoupled with unit diagonal."""
+        if mu is None:
+            mu = self.chemical_potential
+        ntoi = self.spin_names_to_ind[self.SO]
+        spn = self.spin_block_names[self.SO]
+
+        omega = numpy.array([x for x in mesh], numpy.complex_)
+        if iw_or_w == "w":
+            omega = omega.real + 1j * broadening
+        per_k_sigma = with_Sigma and not self._k_independent_projectors()
+        if per_k_sigma:
+            sigma_minus_dc = self._sigma_data(iw_or_w, with_dc)
+        if iw_index is not None:
+            omega = omega[iw_index]
+            if per_k_sigma:
+                sigma_minus_dc = [{bname: s[iw_index] for bname, s in sig.items()} for sig in sigma_minus_dc]
+
+        G_inv = {}
+        for ibl, bname in enumerate(spn):
+            isp = ntoi[bname]
+
+            # G^{-1} = (omega + mu + h_field) - H(k) - P^dagger Sigma P
+            if self._diagonal_hopping():
+                eps = self._hopping_diagonal_block(ik_block, isp)
+                n_k, n_max = eps.shape
+                diag = numpy.arange(n_max)
+                G_inv[bname] = numpy.zeros([n_k, len(omega), n_max, n_max], numpy.complex_)
+                G_inv[bname][:, :, diag, diag] = (omega + mu + self.h_field * (1 - 2 * ibl))[numpy.newaxis, :, numpy.newaxis] \
+                    - eps[:, numpy.newaxis, :]
+            else:
+                hopping = self._hopping_block(ik_block, isp)
+                n_k, n_max = hopping.shape[0], hopping.shape[-1]
+                diag = numpy.arange(n_max)
+                G_inv[bname] = numpy.empty([n_k, len(omega), n_max, n_max], numpy.complex_)
+                G_inv[bname][:, :, :, :] = -hopping[:, numpy.newaxis, :, :]
+                G_inv[bname][:, :, diag, diag] += (omega + mu + self.h_field * (1 - 2 * ibl))[numpy.newaxis, :, numpy.newaxis]
+            if with_Sigma and self._k_independent_projectors():
+                # the same projectors at all k-points: Sigma is upfolded once
+                upfolded = self._upfolded_sigma(iw_or_w, with_dc, bname)
+                if iw_index is not None:
+                    upfolded = upfolded[iw_index]
+                n_orb = upfolded.shape[-1]
+                G_inv[bname][:, :, 0:n_orb, 0:n_orb] -= upfolded[numpy.newaxis, :, :, :]
+            elif with_Sigma:
+                for icrsh in range(self.n_corr_shells):
+                    projmat = self._proj_mat_block(ik_block, isp, icrsh)[:, :, 0:n_max]
+                    upfolded = numpy.matmul(projmat.conjugate().transpose(0, 2, 1)[:, numpy.newaxis, :, :],
+                                            sigma_minus_dc[icrsh][bname][numpy.newaxis, :, :, :])
+                    G_inv[bname] -= numpy.matmul(upfolded, projmat[:, numpy.newaxis, :, :])
+
+            # decouple the padded orbitals
+            pad_k, pad_orb = numpy.nonzero(diag[numpy.newaxis, :] >= self.n_orbitals[ik_block, isp][:, numpy.newaxis])
+            G_inv[bname][pad_k, :, pad_orb, pad_orb] = 1.0
+
+        return G_inv
+
+    def _correlated_subspace_gf(self, ik_block, mu, iw_or_w, mesh, broadening, with_Sigma, with_dc, iw_index=None):
+        r"""
+        k-summed local Green's functions of all correlated shells, evaluated in the correlated subspace.
+
+        With the eigen-decomposition :math:`H(k) = U \epsilon U^{\dagger}` and the projectors Q(k) of all
+        correlated shells stacked on top of each other, the projected bare propagator is
+
+        .. math:: g_0(k, \omega) = \sum_{\nu} \frac{(QU)_{a\nu} (QU)^{*}_{b\nu}}{\omega + \mu - \epsilon_{\nu}(k)},
 
+        and :math:`Q G Q^{\dagger} = (1 - g_0 \Sigma)^{-1} g_0` with the block-diagonal self-energy :math:`\Sigma`.
+
+        If iw_index is given, only the mesh points iw_index are calculated.
+
+        Returns
+        -------
+        G_corr : dict of lists of numpy arrays
+                 G_corr[bname][icrsh][iom, :, :] is the k-sum over ik_block for correlated shell icrsh.
+        """
+        if mu is None:
+            mu = self.chemical_potential
+        ntoi = self.spin_names_to_ind[self.SO]
+        spn = self.spin_block_names[self.SO]
+
+        omega = numpy.array([x for x in mesh], numpy.complex_)
+        if iw_or_w == "w":
+            omega = omega.real + 1j * broadening
         if with_Sigma:
+            sigma_minus_dc = self._sigma_data(iw_or_w, with_dc)
+        if iw_index is not None:
+            omega = omega[iw_index]
+            if with_Sigma:
+                sigma_minus_dc = [{bname: s[iw_index] for bname, s in sig.items()} for sig in sigma_minus_dc]
+        dims = [self.corr_shells[icrsh]['dim'] for icrsh in range(self.n_corr_shells)]
+        offsets = numpy.cumsum([0] + dims)
+
+        G_corr = {}
+        for ibl, bname in enumerate(spn):
+            isp = ntoi[bname]
+            eps, evec = self._eigensystem_block(ik_block, isp)
+            eps = eps - self.h_field * (1 - 2 * ibl)
+            n_max = eps.shape[-1]
+            projmat = numpy.concatenate([self._proj_mat_block(ik_block, isp, icrsh)[:, :, 0:n_max]
+                                         for icrsh in range(self.n_corr_shells)], axis=1)
+            if self._diagonal_hopping():
+                # the eigenvectors are the (padded) unit vectors
+                proj_evec = projmat * evec[:, numpy.newaxis, numpy.arange(n_max), numpy.arange(n_max)].real
+            else:
+                proj_evec = numpy.matmul(projmat, evec)
+
+            # projected bare propagator g_0[ik, iom, a, b]
+            denom = 1.0 / (omega[numpy.newaxis, :, numpy.newaxis] + mu - eps[:, numpy.newaxis, :])
+            g_0 = numpy.matmul(proj_evec[:, numpy.newaxis, :, :] * denom[:, :, numpy.newaxis, :],
+                               proj_evec.conjugate().transpose(0, 2, 1)[:, numpy.newaxis, :, :])
+            if with_Sigma:
+                sigma = numpy.zeros([len(omega), offsets[-1], offsets[-1]], numpy.complex_)
+                for icrsh in range(self.n_corr_shells):
+                    sigma[:, offsets[icrsh]:offsets[icrsh + 1], offsets[icrsh]:offsets[icrsh + 1]] = \
+                        sigma_minus_dc[icrsh][bname]
+                one = numpy.identity(offsets[-1], numpy.complex_)
+                g_0 = numpy.linalg.solve(one - numpy.matmul(g_0, sigma[numpy.newaxis, :, :, :]), g_0)
+
+            g_sum = numpy.tensordot(self.bz_weights[ik_block], g_0, axes=(0, 0))
+            G_corr[bname] = [g_sum[:, offsets[icrsh]:offsets[icrsh + 1], offsets[icrsh]:offsets[icrsh + 1]]
+                             for icrsh in range(self.n_corr_shells)]
+
+        return G_corr
+
+    def _eigensystem_block(self, ik_block, isp):
+        r"""
+        Eigenvalues and eigenvectors of the Hamiltonians H(k) of a block of k-points.
+
+        The eigen-decompositions are calculated once per k-point and spin and cached in self.eigensystem; for
+        diagonal Hamiltonians (DiagonalHopping), the diagonals and unit vectors are returned directly. The results are padded to the largest number of orbitals in the block; padded eigenvalues are zero and
+        padded eigenvectors vanish, so that :math:`\sum_{\nu} |U_{i\nu}|^2` is 1 for physical states and 0 otherwise.
+
+        Returns
+        -------
+        eps : numpy array
+              eps[i, nu] is the eigenvalue nu of H(k) at k-point ik_block[i].
+        evec : numpy array
+               evec[i, :, nu] is the corresponding eigenvector.
+        """
+        if self._diagonal_hopping():
+            # the Hamiltonians are diagonal already
+            evec = self._identity_block(ik_block, isp)
+            physical = evec[:, numpy.arange(evec.shape[-1]), numpy.arange(evec.shape[-1])].real > 0.0
+            return numpy.where(physical, self._hopping_diagonal_block(ik_block, isp), 0.0), evec
+        if isp not in self.eigensystem:
+            self.eigensystem[isp] = {}
+        cache = self.eigensystem[isp]
+        n_max = numpy.max(self.n_orbitals[ik_block, isp])
+        eps = numpy.zeros([len(ik_block), n_max], numpy.float_)
+        evec = numpy.zeros([len(ik_block), n_max, n_max], numpy.complex_)
+        for i, ik in enumerate(ik_block):
+            if ik not in cache:
+                n_orb = self.n_orbitals[ik, isp]
+                cache[ik] = numpy.linalg.eigh(self.hopping[ik, isp, 0:n_orb, 0:n_orb])
+            n_orb = len(cache[ik][0])
+            eps[i, 0:n_orb] = cache[ik][0]
+            evec[i, 0:n_orb, 0:n_orb] = cache[ik][1]
+        return eps, evec
+
+    def _noninteracting_density(self, ik_block, bname, mu, beta):
+        r"""
+        Density matrices in the Bloch basis of the non-interacting system for a block of k-points,
+
+        .. math:: n(k) = U(k) f(\epsilon(k) - \mu) U^{\dagger}(k),
+
+        with the Fermi function f at inverse temperature beta. For beta=None, the T=0 limit is taken.
+        """
+        ibl = self.spin_block_names[self.SO].index(bname)
+        eps, evec = self._eigensystem_block(ik_block, self.spin_names_to_ind[self.SO][bname])
+        eps = eps - self.h_field * (1 - 2 * ibl) - mu
+        if beta is None:
+            occ = (eps < 0.0).astype(numpy.float_)
+        else:
+            occ = 0.5 * (1.0 - numpy.tanh(0.5 * beta * eps))
+        return numpy.matmul(evec * occ[:, numpy.newaxis, :], evec.conjugate().transpose(0, 2, 1))
+
+    def _sigma_data(self, iw_or_w, with_dc):
+        """Returns the self-energies (minus dc, if with_dc) as plain arrays sigma[icrsh][bname][iom, :, :]."""
+        if with_dc:
+            sigma = self.add_dc(iw_or_w)
+        else:
+            sigma = getattr(self, "Sigma_imp_" + iw_or_w)
+        return [{bname: gf.data for bname, gf in sigma[icrsh]} for icrsh in range(self.n_corr_shells)]
+
+    def _hopping_block(self, ik_block, isp):
+        """Returns the Hamiltonians H(k) of a block of k-points, padded to the largest number of orbitals in the block."""
+        n_max = numpy.max(self.n_orbitals[ik_block, isp])
+        return self.hopping[ik_block, isp, 0:n_max, 0:n_max]
+
+    def _diagonal_hopping(self):
+        """True if the Hamiltonians are stored by their diagonals, see read_input_from_hdf."""
+        return isinstance(self.hopping, DiagonalHopping)
+
+    def _hopping_diagonal_block(self, ik_block, isp):
+        """Returns the diagonals of the diagonal Hamiltonians of a block of k-points, padded like _hopping_block."""
+        n_max = numpy.max(self.n_orbitals[ik_block, isp])
+        return numpy.asarray(self.hopping.eps[ik_block, isp])[:, 0:n_max]
+
+    def _proj_mat_block(self, ik_block, isp, ish, shells='corr', ir=None):
+        """Returns the projectors P(k) of a block of k-points for shell ish, padded in the orbital index."""
+        if shells == 'corr':
+            dim = self.corr_shells[ish]['dim']
+            return self.proj_mat[ik_block, isp, ish, 0:dim, :]
+        elif shells == 'all':
+            if ir is None:
+                raise ValueError, "_proj_mat_block: provide ir if treating all shells."
+            dim = self.shells[ish]['dim']
+            return self.proj_mat_all[ik_block, isp, ish, ir, 0:dim, :]
+
+    def _downfold_shells(self, ik_block, bname, M_block, shells='corr'):
+        r"""
+        Batched kernel for the k-sums :math:`\sum_k w_k P(k) M(k) P^{\dagger}(k)` over a block of k-points,
+        for all correlated shells (shells='corr') or for all shells (shells='all', summed over the partial
+        projectors) at once.
+
+        M_block is a stack of matrices M[ik, :, :] or of Green's functions M[ik, iom, :, :] of the spin block bname,
+        padded to the largest number of orbitals in ik_block, with zeros in the padded rows and columns.
+
+        Returns
+        -------
+        sums : list of numpy arrays
+               sums[ish] is the k-sum for shell ish, of shape [dim, dim] or [n_om, dim, dim].
+        """
+        isp = self.spin_names_to_ind[self.SO][bname]
+        n_max = M_block.shape[-1]
+        weights = self.bz_weights[ik_block]
+        if shells == 'corr' and self._k_independent_projectors():
+            # the same projectors at all k-points: sum over k first and project once
+            M_sum = numpy.tensordot(weights, M_block, axes=(0, 0))
+            sums = []
             for icrsh in range(self.n_corr_shells):
-                for bname, gf in G_latt:
-                    gf -= self.upfold(ik, icrsh, bname,
-                                      sigma_minus_dc[icrsh][bname], gf)
+                projmat = self.proj_mat_k_independent[isp, icrsh, 0:self.corr_shells[icrsh]['dim'], 0:n_max]
+                index = self._projector_index(projmat)
+                if index is not None:
+                    sums.append(M_sum[..., index[:, numpy.newaxis], index[numpy.newaxis, :]])
+                else:
+                    sums.append(numpy.matmul(numpy.matmul(projmat, M_sum), projmat.conjugate().transpose()))
+            return sums
+        if shells == 'corr':
+            dims = [shell['dim'] for shell in self.corr_shells]
+            projmat = self.proj_mat[ik_block, isp, :, 0:max(dims), 0:n_max]
+        elif shells == 'all':
+            dims = [shell['dim'] for shell in self.shells]
+            projmat = self.proj_mat_all[ik_block, isp, :, :, 0:max(dims), 0:n_max]
+            # only the first n_parproj[ish] partial projectors of shell ish are used
+            n_shells, n_ir = projmat.shape[1:3]
+            used = numpy.arange(n_ir)[numpy.newaxis, :] < numpy.array(self.n_parproj)[:, numpy.newaxis]
+            projmat = projmat * used[numpy.newaxis, :, :, numpy.newaxis, numpy.newaxis]
+            projmat = projmat.reshape(len(ik_block), n_shells * n_ir, max(dims), n_max)
+        else:
+            raise ValueError, "_downfold_shells: shells has to be 'corr' or 'all'."
+        # projmat[ik, ish, :, :], with the shells broadcast against the frequencies of M
+        projmat_w = projmat * weights[:, numpy.newaxis, numpy.newaxis, numpy.newaxis]
+        projmat_dag = projmat.conjugate().swapaxes(-1, -2)
+        M_block = M_block[..., numpy.newaxis, :, :]
+        if M_block.ndim == 5:
+            projmat_w = projmat_w[:, numpy.newaxis]
+            projmat_dag = projmat_dag[:, numpy.newaxis]
+        sums = numpy.matmul(numpy.matmul(projmat_w, M_block), projmat_dag).sum(axis=0)
+        # shells first
+        sums = numpy.moveaxis(sums, -3, 0)
+        if shells == 'all':
+            sums = sums.reshape((n_shells, n_ir) + sums.shape[1:]).sum(axis=1)
+        return [sums[ish][..., 0:dim, 0:dim] for ish, dim in enumerate(dims)]
+
+    def _store_k_independent_projectors(self):
+        """
+        Stores the correlated projectors only once if they are the same at all k-points.
 
-        G_latt.invert()
-        setattr(self, "G_latt_" + iw_or_w, G_latt)
+        This is the case for Wannier90 and H(k) input (k_dep_projection = 0), if the number of orbitals is the same
+        at all k-points as well, such that no padded orbitals are coupled by the projectors. The projectors are then
+        kept in proj_mat_k_independent[isp, icrsh, :, :], and proj_mat becomes a view of them with stride 0 along the
+        k-points. The view stays writable, but an assignment to any k-point sets the projectors of all k-points.
+        """
+        self.proj_mat_k_independent = None
+        if isinstance(self.proj_mat, KLocalArray):
+            proj_mat = self.proj_mat.local
+        elif isinstance(self.proj_mat, numpy.ndarray):
+            proj_mat = self.proj_mat
+        else:
+            return
+        if getattr(self, 'k_dep_projection', 1) != 0 or numpy.any(self.n_orbitals != self.n_orbitals[0:1, :]):
+            return
+        # the projectors of the first k-point, compared with the (local) k-points of every process
+        first = mpi.bcast(numpy.array(proj_mat[0]) if mpi.is_master_node() and len(proj_mat) > 0 else None)
+        if first is None:
+            return
+        differs = numpy.array([int(numpy.any(proj_mat != first[numpy.newaxis]))])
+        all_reduce_max([differs])
+        if differs[0]:
+            return
+        self.proj_mat_k_independent = first
+        compact = as_strided(first, shape=proj_mat.shape, strides=(0,) + first.strides)
+        if isinstance(self.proj_mat, KLocalArray):
+            self.proj_mat.local = compact
+        else:
+            self.proj_mat = compact
+        if 'proj_mat' in self.shared_windows:
+            self.shared_windows.pop('proj_mat').Free()
 
-        return G_latt
+    def _k_independent_projectors(self):
+        """True if the correlated projectors are stored once for all k-points, see _store_k_independent_projectors."""
+        return getattr(self, 'proj_mat_k_independent', None) is not None
+
+    def _projector_index(self, projmat):
+        """
+        Returns the orbitals selected by the projector matrix projmat[m, i] if every row is a unit vector of the
+        Bloch basis, and None otherwise.
+        """
+        index = numpy.argmax(abs(projmat), axis=1)
+        selection = numpy.zeros(projmat.shape, projmat.dtype)
+        selection[numpy.arange(len(index)), index] = 1.0
+        if numpy.array_equal(projmat, selection):
+            return index
+        return None
+
+    def _upfolded_sigma(self, iw_or_w, with_dc, bname):
+        """
+        Sum of :math:`P^{\dagger} (\Sigma - \Sigma_{dc}) P` over the correlated shells for k-independent projectors,
+        sigma[iom, :, :] in the Bloch basis of spin block bname.
+
+        The result is kept in sigma_upfolded until the self energy or the double counting change (_sigma_changed),
+        or the projectors are modified.
+        """
+        isp = self.spin_names_to_ind[self.SO][bname]
+        key = (iw_or_w, with_dc, bname, hashlib.md5(self.proj_mat_k_independent).hexdigest())
+        if key in self.sigma_upfolded:
+            return self.sigma_upfolded[key]
+        sigma_minus_dc = self._sigma_data(iw_or_w, with_dc)
+        n_orb = self.n_orbitals[0, isp]
+        upfolded = None
+        for icrsh in range(self.n_corr_shells):
+            sigma = sigma_minus_dc[icrsh][bname]
+            if upfolded is None:
+                upfolded = numpy.zeros([sigma.shape[0], n_orb, n_orb], numpy.complex_)
+            projmat = self.proj_mat_k_independent[isp, icrsh, 0:self.corr_shells[icrsh]['dim'], 0:n_orb]
+            index = self._projector_index(projmat)
+            if index is not None:
+                upfolded[:, index[:, numpy.newaxis], index[numpy.newaxis, :]] += sigma
+            else:
+                upfolded += numpy.matmul(numpy.matmul(projmat.conjugate().transpose(), sigma), projmat)
+        self.sigma_upfolded[key] = upfolded
+        return upfolded
+
+    def _identity_block(self, ik_block, isp):
+        """Returns the unit matrices of a block of k-points, padded like _hopping_block."""
+        n_max = numpy.max(self.n_orbitals[ik_block, isp])
+        diag = (numpy.arange(n_max)[numpy.newaxis, :] < self.n_orbitals[ik_block, isp][:, numpy.newaxis])
+        identity = numpy.zeros([len(ik_block), n_max, n_max], numpy.complex_)
+        identity[:, numpy.arange(n_max), numpy.arange(n_max)] = diag
+        return identity
+
+    def _k_blocks(self, ik_list, n_om):
+        """Splits a list of k-point indices into blocks whose lattice GFs fit into self.k_block_memory bytes."""
+        n_max = numpy.max(self.n_orbitals)
+        # G^{-1}, G and one temporary of the same size, complex
+        k_size = 3 * 16 * n_om * n_max * n_max
+        n_block = max(1, int(self.k_block_memory // k_size))
+        return [ik_list[i:i + n_block] for i in range(0, len(ik_list), n_block)]
+
+    def _k_map(self, ik_list, n_om, work):
+        """
+        Returns the list of (ik_block, work(ik_block)) for the blocks of ik_list (see _k_blocks).
+
+        With self.n_threads > 1, the blocks are processed by a pool of threads, which is closed again on return.
+        work has to be thread-safe; the batched numpy operations release the GIL. The time spent on each block
+        (per frequency) is recorded for balance_k_points.
+        """
+        plan = self._k_plan()
+
+        def run(ik_block):
+            t_start = time.time()
+            result = work(ik_block)
+            # distribute the time within the block according to the model cost
+            cost = plan['model'][ik_block]
+            plan['timing'][ik_block] += (time.time() - t_start) / n_om * cost / cost.sum()
+            return ik_block, result
+
+        ik_blocks = self._k_blocks(ik_list, n_om)
+        if self.n_threads > 1 and len(ik_blocks) > 1:
+            pool = ThreadPool(min(self.n_threads, len(ik_blocks)))
+            try:
+                return pool.map(run, ik_blocks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        return [run(ik_block) for ik_block in ik_blocks]
+
+    def _k_sum(self, ik_list, n_om, work, arrays):
+        """
+        Accumulates the contributions of the blocks of ik_list into arrays.
+
+        work(ik_block, partial) adds the contribution of a block of k-points to partial, a list of arrays of the
+        same shapes as arrays. With threads, every thread accumulates into its own partial sums, which are added
+        to arrays at the end, so that only one MPI reduction of arrays is needed afterwards.
+        """
+        if self.n_threads <= 1:
+            self._k_map(ik_list, n_om, lambda ik_block: work(ik_block, arrays))
+            return
+        local = threading.local()
+        partials = []
+
+        def run(ik_block):
+            if not hasattr(local, 'partial'):
+                local.partial = [numpy.zeros_like(a) for a in arrays]
+                partials.append(local.partial)
+            work(ik_block, local.partial)
+
+        self._k_map(ik_list, n_om, run)
+        for partial in partials:
+            for a, p in zip(arrays, partial):
+                a += p
+
+    def _k_sum_checkpointed(self, name, key, ik_list, n_om, work, arrays):
+        """
+        _k_sum with checkpoints (see set_checkpoint); has to be called by all processes.
+
+        The k-points are processed in rounds of k-blocks. After a round, the sums of all processes and the finished
+        k-points are written to the group name of the checkpoint subgroup if checkpoint_interval seconds have passed,
+        together with key, a string identifying the parameters of the k-sum, to which the version of the self energy
+        and the double counting is added (see _sigma_fingerprint). The k-points of a checkpoint with the same key are
+        skipped, and its sums are added on the master node. As for _k_sum, arrays contain the contributions of this
+        process on return, which have to be summed over the processes by the caller.
+        """
+        if self.checkpoint_interval is None:
+            self._k_sum(ik_list, n_om, work, arrays)
+            return
+        key = repr((key, self._sigma_fingerprint()))
+        checkpoint_file = self._checkpoint_file()
+        ik_done = numpy.zeros(0, numpy.int_)
+        if mpi.is_master_node() and os.path.exists(checkpoint_file):
+            with HDFArchive(checkpoint_file, 'r') as ar:
+                if self.checkpoint_data in ar and name in ar[self.checkpoint_data]:
+                    checkpoint = ar[self.checkpoint_data][name]
+                    if checkpoint['key'] == key:
+                        ik_done = numpy.array(checkpoint['ik_done'], numpy.int_)
+                        for i, a in enumerate(arrays):
+                            a += checkpoint['arrays'][str(i)]
+        ik_done = mpi.bcast(ik_done)
+        if len(ik_done) > 0:
+            mpi.report("%s: resuming from the checkpoint with %s finished k-points." % (name, len(ik_done)))
+
+        ik_list = numpy.asarray(ik_list)[numpy.logical_not(numpy.in1d(ik_list, ik_done))]
+        ik_blocks = self._k_blocks(ik_list, n_om)
+        rounds = [numpy.concatenate(ik_blocks[i:i + self.n_threads]) for i in range(0, len(ik_blocks), self.n_threads)]
+        n_rounds = numpy.array([len(rounds)])
+        all_reduce_max([n_rounds])
+        n_rounds = n_rounds[0]
+        # the checkpoint of the master node contains the k-points of the previous runs
+        finished = [ik_done] if mpi.is_master_node() else []
+        t_last = time.time()
+        for iround in range(n_rounds):
+            if iround < len(rounds):
+                self._k_sum(rounds[iround], n_om, work, arrays)
+                finished.append(rounds[iround])
+            if iround < n_rounds - 1 and mpi.bcast(time.time() - t_last > self.checkpoint_interval):
+                self._write_checkpoint(checkpoint_file, name, key, arrays, finished)
+                t_last = time.time()
+
+        if mpi.is_master_node() and os.path.exists(checkpoint_file):
+            with HDFArchive(checkpoint_file, 'a') as ar:
+                if self.checkpoint_data in ar and name in ar[self.checkpoint_data]:
+                    del ar[self.checkpoint_data][name]
+                if self.checkpoint_data in ar and len(ar[self.checkpoint_data].keys()) == 0:
+                    del ar[self.checkpoint_data]
+                remove_file = (checkpoint_file != self.hdf_file) and len(ar.keys()) == 0
+            # a separate checkpoint file is removed with its last checkpoint
+            if remove_file:
+                os.remove(checkpoint_file)
+
+    def _write_checkpoint(self, checkpoint_file, name, key, arrays, finished):
+        """Writes the sums of arrays over all processes and the finished k-points to the checkpoint name."""
+        sums = [a.copy() for a in arrays]
+        all_reduce_sum(sums)
+        ik_done = gather_arrays(numpy.concatenate([numpy.zeros(0, numpy.int_)] + finished).astype(numpy.int_))
+        if mpi.is_master_node():
+            with HDFArchive(checkpoint_file, 'a') as ar:
+                if not self.checkpoint_data in ar:
+                    ar.create_group(self.checkpoint_data)
+                if name in ar[self.checkpoint_data]:
+                    del ar[self.checkpoint_data][name]
+                ar[self.checkpoint_data][name] = {'key': key, 'ik_done': ik_done,
+                                                  'arrays': {str(i): a for i, a in enumerate(sums)}}
+
+    def _checkpoint_file(self):
+        """Name of the hdf5 file of the checkpoints, see set_checkpoint."""
+        if self.checkpoint_file is not None:
+            return self.checkpoint_file
+        return os.path.splitext(self.hdf_file)[0] + '_checkpoint.h5'
+
+    def _sigma_fingerprint(self):
+        """
+        Version of the self energies and the double counting for the checkpoints.
+
+        Unlike sigma_version, which counts the changes within one run, this is a hash of their values, such that a
+        checkpoint is recognised by a new run with the same self energy.
+        """
+        md5 = hashlib.md5()
+        for name in ['Sigma_imp_iw', 'Sigma_imp_w']:
+            for Sigma in getattr(self, name, []):
+                for block, gf in Sigma:
+                    md5.update(block)
+                    md5.update(numpy.ascontiguousarray(gf.data))
+        for dc_imp in getattr(self, 'dc_imp', None) or []:
+            for block in sorted(dc_imp):
+                md5.update(block)
+                md5.update(numpy.ascontiguousarray(dc_imp[block]))
+        md5.update(numpy.array(getattr(self, 'dc_energ', None) or [], numpy.float_))
+        return md5.hexdigest()
+
+    def _k_plan(self):
+        """
+        Returns the distribution of k-points over the processes for the current Hamiltonian.
+
+        The plans are kept in self.k_plans, keyed by the number of k-points, the number of orbitals
+        and the number of processes.
+        """
+        key = (self.n_k, mpi.size, hashlib.md5(numpy.ascontiguousarray(self.n_orbitals)).hexdigest())
+        if key not in self.k_plans:
+            # inversions scale with the cube of the number of orbitals
+            model = (self.n_orbitals.astype(numpy.float_)**3).sum(axis=1)
+            self.k_plans[key] = {'model': model, 'timing': numpy.zeros(self.n_k), 'ik_local': self._k_partition(model)}
+        return self.k_plans[key]
+
+    def _k_partition(self, cost):
+        """Contiguous k-points of this process with about 1/mpi.size of the total cost, sorted by n_orbitals."""
+        # a k-point belongs to the process in whose share the middle of its cost lies
+        cost_mid = numpy.cumsum(cost) - 0.5 * cost
+        bounds = numpy.searchsorted(cost_mid, numpy.sum(cost) * numpy.arange(1, mpi.size) / float(mpi.size))
+        bounds = numpy.concatenate(([0], bounds, [self.n_k]))
+        ik_local = numpy.arange(bounds[mpi.rank], bounds[mpi.rank + 1])
+        # similar numbers of orbitals in a block keep the padding small
+        return ik_local[numpy.argsort(self.n_orbitals[ik_local].sum(axis=1), kind='mergesort')]
+
+    def _k_points_local(self):
+        r"""
+        Returns the k-points treated by this process in the k-sums.
+
+        The k-points are distributed by their estimated cost :math:`\propto n_{orbitals}^3`, or by the measured
+        times after balance_k_points. No communication is involved.
+        """
+        return self._k_plan()['ik_local']
+
+    def balance_k_points(self):
+        r"""
+        Redistributes the k-points over the processes by the times measured in the previous k-sums.
+
+        Initially, the k-points are distributed by their estimated cost :math:`\propto n_{orbitals}^3`. Calling this
+        method after a first k-sum (e.g. after calc_mu) distributes them by the measured times instead, which are
+        reset afterwards. This is an MPI collective and has to be called by all processes. It is not possible if
+        every process has read only its own k-points (distribute_k).
+
+        Returns
+        -------
+        balanced : boolean
+                   True if the k-points were redistributed, False if there were no times for all k-points.
+        """
+        if self.distribute_k:
+            raise ValueError, "balance_k_points: the k-points cannot be redistributed with distribute_k."
+        plan = self._k_plan()
+        timing = plan['timing'].copy()
+        all_reduce_sum([timing])
+        if not numpy.all(timing > 0.0):
+            return False
+        plan['ik_local'] = self._k_partition(timing)
+        plan['timing'][:] = 0.0
+        return True
+
+    def _bloch_density(self, ik_block, bname, G_latt_block, mesh, basis=None, n_orb=None):
+        """
+        Density matrices in the Bloch basis of a block of (padded) Matsubara lattice GFs.
+        If a DLRBasis is given, G_latt_block contains only the values at its nodes.
+        If n_orb is given, G_latt_block[ik, iom, 0, 0] are the traces of the GFs with n_orb[ik] orbitals.
+        """
+        if basis is not None:
+            return basis.density(basis.fit(G_latt_block))
+        if n_orb is not None:
+            first_moment = n_orb[:, numpy.newaxis, numpy.newaxis].astype(numpy.complex_)
+            return self._matsubara_density(G_latt_block, mesh, first_moment)
+        isp = self.spin_names_to_ind[self.SO][bname]
+        n_max = G_latt_block.shape[-1]
+        first_moment = numpy.zeros([len(ik_block), n_max, n_max], numpy.complex_)
+        for i, ik in enumerate(ik_block):
+            n_orb = self.n_orbitals[ik, isp]
+            first_moment[i, 0:n_orb, 0:n_orb] = numpy.identity(n_orb)
+        return self._matsubara_density(G_latt_block, mesh, first_moment)
+
+    def _matsubara_density(self, G_iw, mesh, first_moment, n_fit=32):
+        r"""
+        Density matrices from a stack of Matsubara Green's functions G_iw[..., iom, :, :].
+
+        The high-frequency tail
+
+        .. math:: G(i\omega_n) \simeq \frac{c_1}{i\omega_n} + \frac{c_2}{(i\omega_n)^2} + \frac{c_3}{(i\omega_n)^3}
+                  + \frac{c_4}{(i\omega_n)^4}
+
+        is subtracted before the frequency sum and added back analytically. :math:`c_1` is given by `first_moment`,
+        :math:`c_2` to :math:`c_4` are fitted by least squares to the highest (at most n_fit) positive frequencies of
+        the mesh and made Hermitian. The odd moment :math:`c_3` does not contribute to the sum.
+        """
+        iw = numpy.array([x for x in mesh], numpy.complex_)
+        beta = mesh.beta
+        # at most a quarter of the positive frequencies, and at least one point per fitted moment
+        n_fit = max(3, min(n_fit, len(iw) // 8))
+        iw_fit = iw[-n_fit:]
+        # (i w)^2 (G - c_1 / (i w)) = c_2 + c_3 / (i w) + c_4 / (i w)^2
+        tail = iw_fit[:, numpy.newaxis, numpy.newaxis]**2 * \
+            (G_iw[..., -n_fit:, :, :] - first_moment[..., numpy.newaxis, :, :] / iw_fit[:, numpy.newaxis, numpy.newaxis])
+        tail = numpy.rollaxis(tail, tail.ndim - 3)
+        A = numpy.array([numpy.ones(n_fit), 1.0 / iw_fit, 1.0 / iw_fit**2]).transpose()
+        moments = numpy.linalg.lstsq(A, tail.reshape(n_fit, -1), rcond=-1)[0].reshape((3,) + tail.shape[1:])
+        c_2, c_4 = [0.5 * (c + numpy.swapaxes(c, -1, -2).conjugate()) for c in [moments[0], moments[2]]]
+        G_rest = G_iw - first_moment[..., numpy.newaxis, :, :] / iw[:, numpy.newaxis, numpy.newaxis] \
+            - c_2[..., numpy.newaxis, :, :] / (iw**2)[:, numpy.newaxis, numpy.newaxis] \
+            - c_4[..., numpy.newaxis, :, :] / (iw**4)[:, numpy.newaxis, numpy.newaxis]
+        return G_rest.sum(axis=-3) / beta + 0.5 * first_moment - 0.25 * beta * c_2 + beta**3 / 48.0 * c_4
+
+    def _spectral_poles(self, ik_block, mesh, with_dc, iw_index=None):
+        r"""
+        Eigenvalues :math:`z_{\nu}(k, i\omega_n)` of the inverse lattice GFs at :math:`\mu = 0` for a block of k-points.
+
+        Since the chemical potential only shifts the diagonal, the trace of the lattice GF at any :math:`\mu` is
+
+        .. math:: Tr G(k, i\omega_n) = \sum_{\nu} \frac{1}{z_{\nu}(k, i\omega_n) + \mu}.
+
+        Padded orbitals get :math:`z = i`, which is never a pole, and have to be masked with the number of orbitals.
+        """
+        G_inv = self._inverse_lattice_gf_data(ik_block, 0.0, "iw", mesh, None, True, with_dc, iw_index=iw_index)
+        poles = {}
+        for bname in G_inv:
+            n_orb = self.n_orbitals[ik_block, self.spin_names_to_ind[self.SO][bname]]
+            poles[bname] = numpy.empty(G_inv[bname].shape[:-1], numpy.complex_)
+            poles[bname][:, :, :] = 1j
+            for n in numpy.unique(n_orb):
+                sel = (n_orb == n)
+                poles[bname][sel, :, 0:n] = numpy.linalg.eigvals(G_inv[bname][sel, :, 0:n, 0:n])
+        return poles
+
+    def _spectral_total_density(self, with_dc=True):
+        """
+        Returns a function total_density(mu, with_compressibility=False) with the same results as self.total_density,
+        evaluated from the poles of the lattice GFs, which are calculated once here.
+        Returns None if the poles do not fit into self.spectral_memory.
+        """
+        mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh("iw", 40, None, None, True)
+        basis = self._dlr_basis(mesh)
+        iw_index = None if basis is None else basis.iw_index
+        n_om = len(mesh) if basis is None else len(basis)
+        ik_local = self._k_points_local()
+        n_bytes = numpy.array([16 * len(ik_local) * n_om * self.hopping.shape[-1] * len(self.spin_block_names[self.SO])],
+                              numpy.float_)
+        all_reduce_max([n_bytes])
+        n_bytes = n_bytes[0]
+        if not with_Sigma:
+            # no poles needed without self-energy
+            return lambda mu, with_compressibility=False: self.total_density(
+                mu=mu, with_dc=with_dc, with_compressibility=with_compressibility)
+        if n_bytes > self.spectral_memory:
+            return None
+
+        spectrum = self._k_map(ik_local, n_om,
+                               lambda ik_block: self._spectral_poles(ik_block, mesh, with_dc, iw_index=iw_index))
+
+        def total_density(mu, with_compressibility=False):
+            dens = 0.0
+            dens_mu = 0.0
+            for ik_block, poles in spectrum:
+                for bname in poles:
+                    n_orb = self.n_orbitals[ik_block, self.spin_names_to_ind[self.SO][bname]]
+                    mask = numpy.arange(poles[bname].shape[-1])[numpy.newaxis, :] < n_orb[:, numpy.newaxis]
+                    G_diag = mask[:, numpy.newaxis, :] / (poles[bname] + mu)
+                    dens_k = self._bloch_density(ik_block, bname, G_diag.sum(axis=-1)[:, :, numpy.newaxis, numpy.newaxis],
+                                                 mesh, basis=basis, n_orb=n_orb)
+                    dens += numpy.dot(self.bz_weights[ik_block], dens_k[:, 0, 0])
+                    if with_compressibility:
+                        dens_mu += numpy.dot(self.bz_weights[ik_block],
+                                             self._matsubara_compressibility((G_diag**2).sum(axis=-1), mesh, n_orb,
+                                                                             basis=basis))
+            dens = numpy.array([dens, dens_mu], numpy.complex_)
+            all_reduce_sum([dens])
+            if with_compressibility:
+                return dens[0].real, dens[1].real
+            return dens[0].real
+
+        return total_density
+
+    def _matsubara_compressibility(self, G2_tr, mesh, n_orb, basis=None):
+        r"""
+        :math:`-\frac{1}{\beta} \sum_n Tr G^2(i\omega_n)` from G2_tr[..., iom] with n_orb orbitals.
+
+        The tail :math:`Tr G^2 \simeq n_{orb}/(i\omega_n)^2` is subtracted and its full sum,
+        :math:`n_{orb}\beta/4`, is added back analytically.
+        If a DLRBasis is given, G2_tr contains only the values at its nodes, and :math:`Tr G^2`,
+        which has the Lehmann representation of :math:`-dG/d\mu`, is summed in that basis.
+        """
+        if basis is not None:
+            return -basis.density(basis.fit(G2_tr, axis=-1), axis=-1)
+        iw = numpy.array([x for x in mesh], numpy.complex_)
+        beta = mesh.beta
+        G2_rest = G2_tr - n_orb[..., numpy.newaxis] / iw**2
+        return -G2_rest.sum(axis=-1) / beta + 0.25 * beta * n_orb
+
+    def set_dlr(self, omega_max, eps=1e-10):
+        r"""
+        Switches on the compact representation of Matsubara Green's functions.
+
+        The lattice GFs in total_density, density_matrix, extract_G_loc and calc_mu(spectral=True) are then
+        only evaluated at the few Matsubara frequencies of a discrete Lehmann representation (DLRBasis) of the
+        mesh, and densities and local GFs are reconstructed from its coefficients.
+
+        Parameters
+        ----------
+        omega_max : float
+                    Largest absolute real frequency with spectral weight of the lattice GF (measured from the
+                    chemical potential). If None, the full Matsubara meshes are used again.
+        eps : float, optional
+              Relative accuracy of the representation.
+        """
+        self.dlr_omega_max = omega_max
+        self.dlr_eps = eps
+        self.dlr_basis = None
+
+    def _dlr_basis(self, mesh):
+        """Returns the DLRBasis for the Matsubara mesh, or None if the compact representation is not used."""
+        if self.dlr_omega_max is None:
+            return None
+        if (self.dlr_basis is None or not self.dlr_basis.matches(mesh) or
+                self.dlr_basis.omega_max != self.dlr_omega_max or self.dlr_basis.eps != self.dlr_eps):
+            self.dlr_basis = DLRBasis(mesh, self.dlr_omega_max, self.dlr_eps)
+        return self.dlr_basis
+
+    def set_noninteracting_eigen(self, use_eigen=True):
+        r"""
+        Switches on the evaluation of the non-interacting sums from the eigen-decomposition of H(k).
+
+        total_density(with_Sigma=False) and density_matrix('using_gf') without self-energy then use the exact
+        Fermi function of the (cached) eigenvalues of H(k) instead of the Matsubara sum with the tail correction,
+        and extract_G_loc(with_Sigma=False) uses the method 'correlated_subspace' unless a method is given.
+        The results differ from the default ones by the truncation error of the Matsubara sum.
+
+        Parameters
+        ----------
+        use_eigen : boolean, optional
+                    If False, the Matsubara sums are used again.
+        """
+        self.noninteracting_eigen = use_eigen
+
+    def set_gf_cache(self, max_bytes):
+        r"""
+        Switches on the cache of lattice Green's functions.
+
+        The lattice GFs of the k-blocks calculated in total_density, density_matrix, extract_G_loc,
+        calc_density_correction and lattice_gf are kept, up to max_bytes per process, and reused by later
+        k-sums at the same chemical potential. Once calc_mu has converged, the following k-sums at the final
+        chemical potential thus cost (almost) nothing. The least recently used GFs are dropped first.
+
+        The cache is invalidated by put_Sigma, set_dc, calc_dc and init_dc; set_mu and calc_mu drop the GFs
+        at other chemical potentials. If the self-energy or the double counting are modified in place,
+        the cache has to be cleared with self.gf_cache.clear().
+
+        Parameters
+        ----------
+        max_bytes : integer
+                    Memory (in bytes) per process for the cached GFs; 0 switches the cache off.
+        """
+        self.gf_cache.resize(max_bytes)
+
+    def set_checkpoint(self, interval, subgrp='dft_checkpoint', checkpoint_file=None):
+        r"""
+        Switches on checkpoints for the long k-sums of partial_charges, dos_parproj_basis, spaghettis and
+        transport_distribution.
+
+        The partial sums and the list of finished k-points are written to a separate hdf5 file every interval seconds
+        (at the latest after the next k-block). If a calculation is interrupted, calling the same method with the same
+        parameters again resumes from the last checkpoint, also with a different number of processes. Checkpoints of
+        a different self energy or double counting are not used. The checkpoint is removed when the k-sum is
+        finished, and the file with its last checkpoint.
+
+        Parameters
+        ----------
+        interval : double
+                   Time in seconds between two checkpoints; None switches the checkpoints off.
+        subgrp : string, optional
+                 Name of the hdf5 subgroup in which the checkpoints are stored.
+        checkpoint_file : string, optional
+                          Name of the hdf5 file for the checkpoints; the default is the name of the hdf5 archive
+                          with the ending _checkpoint.h5 instead of .h5.
+        """
+        self.checkpoint_interval = interval
+        self.checkpoint_data = subgrp
+        self.checkpoint_file = checkpoint_file
+
+    def _sigma_changed(self):
+        """Invalidates the cached lattice GFs after a change of the self-energy or the double counting."""
+        self.sigma_version += 1
+        self.gf_cache.clear()
+        self.sigma_upfolded = {}
 
     def set_Sigma(self, Sigma_imp):
         self.put_Sigma(Sigma_imp)
@@ -611,15 +1635,7 @@ class SumkDFT(object):
         for icrsh in range(self.n_corr_shells):
             # ish is the index of the inequivalent shell corresponding to icrsh
             ish = self.corr_to_inequiv[icrsh]
-            for block, inner in self.gf_struct_solver[ish].iteritems():
-                for ind1 in inner:
-                    for ind2 in inner:
-                        block_sumk, ind1_sumk = self.solver_to_sumk[
-                            ish][(block, ind1)]
-                        block_sumk, ind2_sumk = self.solver_to_sumk[
-                            ish][(block, ind2)]
-                        SK_Sigma_imp[icrsh][block_sumk][
-                            ind1_sumk, ind2_sumk] << Sigma_imp[ish][block][ind1, ind2]
+            self.block_structure.copy_solver_to_sumk(Sigma_imp[ish], SK_Sigma_imp[icrsh], ish, icrsh)
 
         # rotation from local to global coordinate system:
         if self.use_rotations:
@@ -627,7 +1643,9 @@ class SumkDFT(object):
                 for bname, gf in SK_Sigma_imp[icrsh]:
                     gf << self.rotloc(icrsh, gf, direction='toGlobal')
 
-    def extract_G_loc(self, mu=None, iw_or_w='iw', with_Sigma=True, with_dc=True, broadening=None):
+        self._sigma_changed()
+
+    def extract_G_loc(self, mu=None, iw_or_w='iw', with_Sigma=True, with_dc=True, broadening=None, method=None):
         r"""
         Extracts the local downfolded Green function by the Brillouin-zone integration of the lattice Green's function.
 
@@ -643,6 +1661,19 @@ class SumkDFT(object):
                      Imaginary shift for the axis along which the real-axis GF is calculated.
                      If not provided, broadening will be set to double of the distance between mesh points in 'mesh'.
                      Only relevant for real-frequency GF.
+        method : string, optional
+
+                 - if 'full': the lattice Green's function is inverted in the full Bloch space at every k-point and
+                              frequency and then downfolded.
+                 - if 'correlated_subspace': H(k) is diagonalised once per k-point and only the projected bare propagator
+                              :math:`g_0 = P G_0 P^{\dagger}` of all correlated shells is formed. The local Green's function
+                              follows from :math:`[g_0^{-1} - \Sigma]^{-1}` in the correlated subspace (Woodbury identity),
+                              which reduces the cost per frequency from O(n_orbitals^3) to O(dim^3).
+                              Requires a Hermitian H(k).
+
+                 If not given, 'full' is used, or 'correlated_subspace' for with_Sigma=False if the non-interacting
+                 sums are evaluated from the eigen-decomposition of H(k) (see :meth:`set_noninteracting_eigen
+                 <dft.sumk_dft.SumkDFT.set_noninteracting_eigen>`).
 
         Returns
         -------
@@ -671,30 +1702,52 @@ class SumkDFT(object):
         for icrsh in range(self.n_corr_shells):
             G_loc[icrsh].zero()                          # initialize to zero
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-            if iw_or_w == 'iw':
-                G_latt = self.lattice_gf(
-                    ik=ik, mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma, with_dc=with_dc, beta=beta)
-            elif iw_or_w == 'w':
-                mesh_parameters = (G_loc[0].mesh.omega_min,G_loc[0].mesh.omega_max,len(G_loc[0].mesh))
-                G_latt = self.lattice_gf(
-                    ik=ik, mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma, with_dc=with_dc, broadening=broadening, mesh=mesh_parameters)
-            G_latt *= self.bz_weights[ik]
-
-            for icrsh in range(self.n_corr_shells):
-                # init temporary storage
-                tmp = G_loc[icrsh].copy()
-                for bname, gf in tmp:
-                    tmp[bname] << self.downfold(
-                        ik, icrsh, bname, G_latt[bname], gf)
-                G_loc[icrsh] += tmp
+        if iw_or_w == 'w':
+            if broadening is None:
+                broadening = 2.0 * ((G_loc[0].mesh.omega_max - G_loc[0].mesh.omega_min) / (len(G_loc[0].mesh) - 1))
+            if with_Sigma and broadening > 0 and mpi.is_master_node():
+                warn('extract_G_loc called with Sigma and broadening > 0 (broadening = {}). You might want to explicitly set the broadening to 0.'.format(broadening))
+
+        if method is None:
+            # non-interacting: no inversion needed, use the eigen-decomposition of H(k)
+            method = 'correlated_subspace' if (not with_Sigma and self.noninteracting_eigen) else 'full'
+        if method not in ('full', 'correlated_subspace'):
+            raise ValueError, "extract_G_loc: the method '%s' is not supported." % method
+
+        # with the compact representation, G_loc is only calculated at the nodes and reconstructed at the end
+        basis = self._dlr_basis(G_loc[0].mesh) if iw_or_w == "iw" else None
+        iw_index = None if basis is None else basis.iw_index
+        G_sum = [{bname: (gf.data if basis is None else gf.data[iw_index]) for bname, gf in G_loc[icrsh]}
+                 for icrsh in range(self.n_corr_shells)]
+
+        n_om = len(G_loc[0].mesh) if basis is None else len(basis)
+        keys = [(icrsh, bname) for icrsh in range(self.n_corr_shells) for bname in G_sum[icrsh]]
+
+        def add_block(ik_block, G_part):
+            if method == 'full':
+                G_latt = self._lattice_gf_data(ik_block, mu=mu, iw_or_w=iw_or_w, mesh=G_loc[0].mesh,
+                                               broadening=broadening, with_Sigma=with_Sigma, with_dc=with_dc,
+                                               iw_index=iw_index)
+                G_down = {bname: self._downfold_shells(ik_block, bname, G_latt[bname]) for bname in G_latt}
+                for i, (icrsh, bname) in enumerate(keys):
+                    G_part[i] += G_down[bname][icrsh]
+            elif method == 'correlated_subspace':
+                G_corr = self._correlated_subspace_gf(ik_block, mu=mu, iw_or_w=iw_or_w, mesh=G_loc[0].mesh,
+                                                      broadening=broadening, with_Sigma=with_Sigma, with_dc=with_dc,
+                                                      iw_index=iw_index)
+                for i, (icrsh, bname) in enumerate(keys):
+                    G_part[i] += G_corr[bname][icrsh]
+
+        self._k_sum(self._k_points_local(), n_om, add_block, [G_sum[icrsh][bname] for icrsh, bname in keys])
 
         # Collect data from mpi
-        for icrsh in range(self.n_corr_shells):
-            G_loc[icrsh] << mpi.all_reduce(
-                mpi.world, G_loc[icrsh], lambda x, y: x + y)
-        mpi.barrier()
+        all_reduce_sum([G_sum[icrsh][bname] for icrsh, bname in keys])
+
+        if basis is not None:
+            iw = numpy.array([x for x in G_loc[0].mesh], numpy.complex_)
+            for icrsh in range(self.n_corr_shells):
+                for bname, gf in G_loc[icrsh]:
+                    gf.data[:, :, :] = basis.evaluate(basis.fit(G_sum[icrsh][bname]), iw)
 
         # G_loc[:] is now the sum over k projected to the local orbitals.
         # here comes the symmetrisation, if needed:
@@ -710,15 +1763,8 @@ class SumkDFT(object):
 
         # transform to CTQMC blocks:
         for ish in range(self.n_inequiv_shells):
-            for block, inner in self.gf_struct_solver[ish].iteritems():
-                for ind1 in inner:
-                    for ind2 in inner:
-                        block_sumk, ind1_sumk = self.solver_to_sumk[
-                            ish][(block, ind1)]
-                        block_sumk, ind2_sumk = self.solver_to_sumk[
-                            ish][(block, ind2)]
-                        G_loc_inequiv[ish][block][ind1, ind2] << G_loc[
-                            self.inequiv_to_corr[ish]][block_sumk][ind1_sumk, ind2_sumk]
+            icrsh = self.inequiv_to_corr[ish]
+            self.block_structure.copy_sumk_to_solver(G_loc[icrsh], G_loc_inequiv[ish], ish, icrsh)
 
         # return only the inequivalent shells:
         return G_loc_inequiv
@@ -1263,7 +2309,9 @@ class SumkDFT(object):
                  - if 'using_gf': First get lattice gf (g_loc is not set up), then density matrix.
                                   It is useful for Hubbard I, and very quick.
                                   No assumption on the hopping structure is made (ie diagonal or not).
-                 - if 'using_point_integration': Only works for diagonal hopping matrix (true in wien2k).
+                                  Without self-energy, the Fermi function is evaluated directly with the
+                                  eigen-decomposition of H(k) if set_noninteracting_eigen was called.
+                 - if 'using_point_integration': T=0 occupations of the eigenstates of H(k) (without self-energy).
 
         beta : float, optional
                Inverse temperature.      
@@ -1279,57 +2327,47 @@ class SumkDFT(object):
                 dens_mat[icrsh][sp] = numpy.zeros(
                     [self.corr_shells[icrsh]['dim'], self.corr_shells[icrsh]['dim']], numpy.complex_)
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
+        keys = [(icrsh, sp) for icrsh in range(self.n_corr_shells) for sp in dens_mat[icrsh]]
+
+        if method == "using_gf":
+            mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh(
+                "iw", beta, None, None, True)
+            basis = self._dlr_basis(mesh)
+            iw_index = None if basis is None else basis.iw_index
+            n_om = len(mesh) if basis is None else len(basis)
+
+            def add_block(ik_block, dm_part):
+                if with_Sigma or not self.noninteracting_eigen:
+                    G_latt = self._lattice_gf_data(ik_block, mu=self.chemical_potential, iw_or_w="iw", mesh=mesh,
+                                                   broadening=broadening, with_Sigma=with_Sigma, with_dc=True,
+                                                   iw_index=iw_index)
+                    dm = {bname: self._bloch_density(ik_block, bname, G_latt[bname], mesh, basis=basis)
+                          for bname in G_latt}
+                else:
+                    dm = {bname: self._noninteracting_density(ik_block, bname, self.chemical_potential, mesh.beta)
+                          for bname in self.spin_block_names[self.SO]}
+                dm_down = {sp: self._downfold_shells(ik_block, sp, dm[sp]) for sp in dm}
+                for i, (icrsh, sp) in enumerate(keys):
+                    dm_part[i] += dm_down[sp][icrsh]
 
-            if method == "using_gf":
+            self._k_sum(self._k_points_local(), n_om, add_block, [dens_mat[icrsh][sp] for icrsh, sp in keys])
 
-                G_latt_iw = self.lattice_gf(
-                    ik=ik, mu=self.chemical_potential, iw_or_w="iw", beta=beta)
-                G_latt_iw *= self.bz_weights[ik]
-                dm = G_latt_iw.density()
-                MMat = [dm[sp] for sp in self.spin_block_names[self.SO]]
+        elif method == "using_point_integration":
+            # T=0 occupations of the eigenstates of H(k)
 
-            elif method == "using_point_integration":
+            def add_block(ik_block, dm_part):
+                dm_down = {sp: self._downfold_shells(ik_block, sp, self._noninteracting_density(ik_block, sp, 0.0, None))
+                           for sp in self.spin_block_names[self.SO]}
+                for i, (icrsh, sp) in enumerate(keys):
+                    dm_part[i] += dm_down[sp][icrsh]
 
-                ntoi = self.spin_names_to_ind[self.SO]
-                spn = self.spin_block_names[self.SO]
-                dims = {sp:self.n_orbitals[ik, ntoi[sp]] for sp in spn}
-                MMat = [numpy.zeros([dims[sp], dims[sp]], numpy.complex_) for sp in spn]
+            self._k_sum(self._k_points_local(), 1, add_block, [dens_mat[icrsh][sp] for icrsh, sp in keys])
 
-                for isp, sp in enumerate(spn):
-                    ind = ntoi[sp]
-                    for inu in range(self.n_orbitals[ik, ind]):
-                        # only works for diagonal hopping matrix (true in
-                        # wien2k)
-                        if (self.hopping[ik, ind, inu, inu] - self.h_field * (1 - 2 * isp)) < 0.0:
-                            MMat[isp][inu, inu] = 1.0
-                        else:
-                            MMat[isp][inu, inu] = 0.0
-
-            else:
-                raise ValueError, "density_matrix: the method '%s' is not supported." % method
-
-            for icrsh in range(self.n_corr_shells):
-                for isp, sp in enumerate(self.spin_block_names[self.corr_shells[icrsh]['SO']]):
-                    ind = self.spin_names_to_ind[
-                        self.corr_shells[icrsh]['SO']][sp]
-                    dim = self.corr_shells[icrsh]['dim']
-                    n_orb = self.n_orbitals[ik, ind]
-                    projmat = self.proj_mat[ik, ind, icrsh, 0:dim, 0:n_orb]
-                    if method == "using_gf":
-                        dens_mat[icrsh][sp] += numpy.dot(numpy.dot(projmat, MMat[isp]),
-                                                         projmat.transpose().conjugate())
-                    elif method == "using_point_integration":
-                        dens_mat[icrsh][sp] += self.bz_weights[ik] * numpy.dot(numpy.dot(projmat, MMat[isp]),
-                                                                               projmat.transpose().conjugate())
+        else:
+            raise ValueError, "density_matrix: the method '%s' is not supported." % method
 
         # get data from nodes:
-        for icrsh in range(self.n_corr_shells):
-            for sp in dens_mat[icrsh]:
-                dens_mat[icrsh][sp] = mpi.all_reduce(
-                    mpi.world, dens_mat[icrsh][sp], lambda x, y: x + y)
-        mpi.barrier()
+        all_reduce_sum([dens_mat[icrsh][sp] for icrsh, sp in keys])
 
         if self.symm_op != 0:
             dens_mat = self.symmcorr.symmetrize(dens_mat)
@@ -1391,17 +2429,18 @@ class SumkDFT(object):
                 for sp in self.spin_block_names[self.corr_shells[icrsh]['SO']]:
                     self.Hsumk[icrsh][sp] = numpy.zeros(
                         [dim, dim], numpy.complex_)
-                for isp, sp in enumerate(self.spin_block_names[self.corr_shells[icrsh]['SO']]):
-                    ind = self.spin_names_to_ind[
-                        self.corr_shells[icrsh]['SO']][sp]
-                    for ik in range(self.n_k):
-                        n_orb = self.n_orbitals[ik, ind]
-                        MMat = numpy.identity(n_orb, numpy.complex_)
-                        MMat = self.hopping[
-                            ik, ind, 0:n_orb, 0:n_orb] - (1 - 2 * isp) * self.h_field * MMat
-                        projmat = self.proj_mat[ik, ind, icrsh, 0:dim, 0:n_orb]
-                        self.Hsumk[icrsh][sp] += self.bz_weights[ik] * numpy.dot(numpy.dot(projmat, MMat),
-                                                                                 projmat.conjugate().transpose())
+            # with distribute_k, every process sums over its own k-points
+            ik_sum = self._k_points_local() if self.distribute_k else numpy.arange(self.n_k)
+            for isp, sp in enumerate(self.spin_block_names[self.SO]):
+                ind = self.spin_names_to_ind[self.SO][sp]
+                for ik_block in self._k_blocks(ik_sum, 1):
+                    MMat = self._hopping_block(ik_block, ind) - \
+                        (1 - 2 * isp) * self.h_field * self._identity_block(ik_block, ind)
+                    Hsumk_block = self._downfold_shells(ik_block, sp, MMat)
+                    for icrsh in range(self.n_corr_shells):
+                        self.Hsumk[icrsh][sp] += Hsumk_block[icrsh]
+            if self.distribute_k:
+                all_reduce_sum([self.Hsumk[icrsh][sp] for icrsh in range(self.n_corr_shells) for sp in self.Hsumk[icrsh]])
             # symmetrisation:
             if self.symm_op != 0:
                 self.Hsumk = self.symmcorr.symmetrize(self.Hsumk)
@@ -1440,6 +2479,7 @@ class SumkDFT(object):
             for sp in spn:
                 self.dc_imp[icrsh][sp] = numpy.zeros([dim, dim], numpy.float_)
         self.dc_energ = [0.0 for icrsh in range(self.n_corr_shells)]
+        self._sigma_changed()
 
     def set_dc(self, dc_imp, dc_energ):
         r"""
@@ -1456,6 +2496,7 @@ class SumkDFT(object):
 
         self.dc_imp = dc_imp
         self.dc_energ = dc_energ
+        self._sigma_changed()
 
     def calc_dc(self, dens_mat, orb=0, U_interact=None, J_hund=None, use_dc_formula=0, use_dc_value=None):
         r"""
@@ -1576,6 +2617,8 @@ class SumkDFT(object):
                     "DC for shell %(icrsh)i = %(use_dc_value)f" % locals())
                 mpi.report("DC energy = %s" % self.dc_energ[icrsh])
 
+        self._sigma_changed()
+
     def add_dc(self, iw_or_w="iw"):
         r"""
         Subtracts the double counting term from the impurity self energy.
@@ -1664,7 +2707,7 @@ class SumkDFT(object):
                 else:
                     gf_to_symm[key].from_L_G_R(v, ss, v.conjugate().transpose())
 
-    def total_density(self, mu=None, iw_or_w="iw", with_Sigma=True, with_dc=True, broadening=None):
+    def total_density(self, mu=None, iw_or_w="iw", with_Sigma=True, with_dc=True, broadening=None, with_compressibility=False):
         r"""
         Calculates the total charge within the energy window for a given chemical potential. 
         The chemical potential is either given by parameter `mu` or, if it is not specified,
@@ -1672,7 +2715,9 @@ class SumkDFT(object):
 
         The total charge is calculated from the trace of the GF in the Bloch basis.
         By default, a full interacting GF is used. To use the non-interacting GF, set
-        parameter `with_Sigma = False`.
+        parameter `with_Sigma = False`. On the imaginary axis, the non-interacting charge can be
+        obtained directly from the Fermi function of the (cached) eigenvalues of H(k) instead, see
+        :meth:`set_noninteracting_eigen <dft.sumk_dft.SumkDFT.set_noninteracting_eigen>`.
 
         The number of bands within the energy windows generally depends on `k`. The trace is
         therefore calculated separately for each `k`-point.
@@ -1703,28 +2748,77 @@ class SumkDFT(object):
                      Imaginary shift for the axis along which the real-axis GF is calculated.
                      If not provided, broadening will be set to double of the distance between mesh points in 'mesh'.
                      Only relevant for real-frequency GF.
+        with_compressibility : boolean, optional
+             If True, the derivative :math:`dn_{tot}/d\mu` is calculated in the same k-sum,
+
+             .. math:: \frac{dn_{tot}}{d\mu} = -\frac{1}{\beta} \sum_{k, n} w_k Tr G^2(k, i\omega_{n}),
+
+             with the contribution of the :math:`1/(i\omega_n)^2` tail beyond the mesh added analytically.
+             Only for imaginary frequencies.
 
         Returns
         -------
         dens : float
                Total charge :math:`n_{tot}`.
+        dens_mu : float
+                  :math:`dn_{tot}/d\mu`, only returned if with_compressibility is True.
 
         """
 
         if mu is None:
             mu = self.chemical_potential
-        dens = 0.0
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-            G_latt = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma, with_dc=with_dc, broadening=broadening)
-            dens += self.bz_weights[ik] * G_latt.total_density()
+        if with_compressibility and iw_or_w != "iw":
+            raise ValueError, "total_density: the compressibility is only implemented for imaginary frequencies."
+        # total charge and dN/dmu
+        dens = numpy.zeros(2, numpy.complex_)
+        if iw_or_w == "iw":
+            mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh(
+                iw_or_w, 40, broadening, None, with_Sigma)
+            basis = self._dlr_basis(mesh)
+            iw_index = None if basis is None else basis.iw_index
+            n_om = len(mesh) if basis is None else len(basis)
+
+            def add_block(ik_block, partial):
+                dens_part = partial[0]
+                if not with_Sigma and self.noninteracting_eigen:
+                    # non-interacting: Fermi function of the eigenvalues of H(k)
+                    for ibl, bname in enumerate(self.spin_block_names[self.SO]):
+                        eps, evec = self._eigensystem_block(ik_block, self.spin_names_to_ind[self.SO][bname])
+                        eps = eps - self.h_field * (1 - 2 * ibl) - mu
+                        # 1 for physical, 0 for padded states
+                        norm = (abs(evec)**2).sum(axis=1)
+                        occ = 0.5 * (1.0 - numpy.tanh(0.5 * mesh.beta * eps))
+                        dens_part[0] += numpy.dot(self.bz_weights[ik_block], (norm * occ).sum(axis=1))
+                        dens_part[1] += numpy.dot(self.bz_weights[ik_block],
+                                                  (norm * mesh.beta * occ * (1.0 - occ)).sum(axis=1))
+                    return
+                G_latt = self._lattice_gf_data(ik_block, mu=mu, iw_or_w=iw_or_w, mesh=mesh,
+                                               broadening=broadening, with_Sigma=with_Sigma, with_dc=with_dc,
+                                               iw_index=iw_index)
+                for bname in G_latt:
+                    dens_part[0] += numpy.dot(self.bz_weights[ik_block],
+                                              self._bloch_density(ik_block, bname, G_latt[bname], mesh,
+                                                                  basis=basis).trace(axis1=1, axis2=2))
+                    if with_compressibility:
+                        n_orb = self.n_orbitals[ik_block, self.spin_names_to_ind[self.SO][bname]]
+                        G2_tr = numpy.einsum('kwij,kwji->kw', G_latt[bname], G_latt[bname])
+                        dens_part[1] += numpy.dot(self.bz_weights[ik_block],
+                                                  self._matsubara_compressibility(G2_tr, mesh, n_orb, basis=basis))
+
+            self._k_sum(self._k_points_local(), n_om, add_block, [dens])
+        else:
+            for ik in self._k_points_local():
+                G_latt = self.lattice_gf(
+                    ik=ik, mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma, with_dc=with_dc, broadening=broadening)
+                dens[0] += self.bz_weights[ik] * G_latt.total_density()
         # collect data from mpi:
-        dens = mpi.all_reduce(mpi.world, dens, lambda x, y: x + y)
-        mpi.barrier()
+        all_reduce_sum([dens])
+        dens, dens_mu = dens
 
         if abs(dens.imag) > 1e-20:
             mpi.report("Warning: Imaginary part in density will be ignored ({})".format(str(abs(dens.imag))))
+        if with_compressibility:
+            return dens.real, dens_mu.real
         return dens.real
 
     def set_mu(self, mu):
@@ -1738,11 +2832,13 @@ class SumkDFT(object):
 
         """
         self.chemical_potential = mu
+        # cached lattice GFs at other chemical potentials are not needed anymore
+        self.gf_cache.discard(lambda key: key[1] != mu)
 
-    def calc_mu(self, precision=0.01, iw_or_w='iw', broadening=None, delta=0.5):
+    def calc_mu(self, precision=0.01, iw_or_w='iw', broadening=None, delta=0.5, spectral=False, method='dichotomy'):
         r"""
         Searches for the chemical potential that gives the DFT total charge.
-        A simple bisection method is used.
+        By default, a simple bisection method is used.
 
         Parameters
         ----------
@@ -1755,6 +2851,23 @@ class SumkDFT(object):
                      Imaginary shift for the axis along which the real-axis GF is calculated.
                      If not provided, broadening will be set to double of the distance between mesh points in 'mesh'.
                      Only relevant for real-frequency GF.
+        delta : float, optional
+                Initial step of the bisection.
+        spectral : boolean, optional
+                   If True, the matrices :math:`H(k) + P^{\dagger}\Sigma(i\omega_n)P` are diagonalised once
+                   for all k-points and frequencies, and the total charge at every trial chemical potential is
+                   evaluated as a sum over the poles. The search then costs about one lattice sum.
+                   Only for imaginary frequencies; if the poles do not fit into self.spectral_memory bytes
+                   per process, the usual lattice sums are used.
+        method : string, optional
+
+                 - if 'dichotomy': bisection with initial step delta.
+                 - if 'newton': Newton iteration with :math:`dN/d\mu` from total_density(with_compressibility=True),
+                                safeguarded by bisection as soon as the root is bracketed.
+                 - if 'brent': Brent's method on a bracket estimated from :math:`dN/d\mu`.
+
+                 'newton' and 'brent' start from self.chemical_potential and are only implemented for imaginary
+                 frequencies. :math:`dN/d\mu` at the last evaluated chemical potential is stored in self.dens_mu.
 
         Returns
         -------
@@ -1763,19 +2876,93 @@ class SumkDFT(object):
              within specified precision.
 
         """
-        F = lambda mu: self.total_density(
-            mu=mu, iw_or_w=iw_or_w, broadening=broadening).real
+        if method not in ('dichotomy', 'newton', 'brent'):
+            raise ValueError, "calc_mu: the method '%s' is not supported." % method
+        if method != 'dichotomy' and iw_or_w != 'iw':
+            raise ValueError, "calc_mu: the method '%s' is only implemented for imaginary frequencies." % method
+
+        F = None
+        if spectral:
+            if iw_or_w != 'iw':
+                raise ValueError, "calc_mu: spectral=True is only implemented for imaginary frequencies."
+            F = self._spectral_total_density()
+            if F is None:
+                mpi.report("calc_mu: poles of the lattice GF are not kept, using the lattice sums.")
+        if F is None:
+            F = lambda mu, with_compressibility=False: self.total_density(
+                mu=mu, iw_or_w=iw_or_w, broadening=broadening, with_compressibility=with_compressibility)
         density = self.density_required - self.charge_below
 
-        self.chemical_potential = dichotomy.dichotomy(function=F,
-                                                      x_init=self.chemical_potential, y_value=density,
-                                                      precision_on_y=precision, delta_x=delta, max_loops=100,
-                                                      x_name="Chemical Potential", y_name="Total Density",
-                                                      verbosity=3)[0]
+        if method == 'dichotomy':
+            mu = dichotomy.dichotomy(function=F,
+                                     x_init=self.chemical_potential, y_value=density,
+                                     precision_on_y=precision, delta_x=delta, max_loops=100,
+                                     x_name="Chemical Potential", y_name="Total Density",
+                                     verbosity=3)[0]
+        elif method == 'newton':
+            mu = self._calc_mu_newton(F, density, precision, delta)
+        elif method == 'brent':
+            mu = self._calc_mu_brent(F, density, precision, delta)
+        self.set_mu(mu)
 
         return self.chemical_potential
 
-    def calc_density_correction(self, filename=None, dm_type='wien2k'):
+    def _calc_mu_newton(self, F, density, precision, delta, max_loops=100):
+        """Safeguarded Newton search for F(mu) = density; F(mu, True) also returns dF/dmu."""
+        mu = self.chemical_potential
+        mu_low, mu_high = None, None
+        for it in range(max_loops):
+            dens, self.dens_mu = F(mu, with_compressibility=True)
+            mpi.report("calc_mu: Chemical Potential = %.10f, Total Density = %.10f, dN/dmu = %.6f"
+                       % (mu, dens, self.dens_mu))
+            if abs(dens - density) < precision:
+                return mu
+            # the total charge increases monotonically with mu
+            if dens < density:
+                mu_low = mu
+            else:
+                mu_high = mu
+            if self.dens_mu > 0.0:
+                mu_new = mu - (dens - density) / self.dens_mu
+            elif dens < density:
+                mu_new = mu + delta
+            else:
+                mu_new = mu - delta
+            if mu_low is not None and mu_high is not None and not (mu_low < mu_new < mu_high):
+                mu_new = 0.5 * (mu_low + mu_high)
+            mu = mu_new
+        mpi.report("calc_mu: Newton search did not converge in %s steps." % max_loops)
+        return mu
+
+    def _calc_mu_brent(self, F, density, precision, delta, max_loops=100):
+        """Brent search for F(mu) = density on a bracket estimated from the slope dF/dmu."""
+        values = {}
+
+        def residual(mu):
+            if mu not in values:
+                values[mu], self.dens_mu = F(mu, with_compressibility=True)
+                mpi.report("calc_mu: Chemical Potential = %.10f, Total Density = %.10f" % (mu, values[mu]))
+            return values[mu] - density
+
+        mu_0 = self.chemical_potential
+        res_0 = residual(mu_0)
+        if abs(res_0) < precision:
+            return mu_0
+        slope = self.dens_mu if self.dens_mu > 0.0 else 1.0 / delta
+        step = -res_0 / slope
+        # widen the bracket until the sign of the residual changes
+        mu_1 = mu_0 + 1.5 * step
+        for it in range(max_loops):
+            if residual(mu_1) * res_0 <= 0.0:
+                break
+            mu_0, res_0 = mu_1, values[mu_1] - density
+            step *= 2.0
+            mu_1 = mu_0 + step
+        else:
+            raise RuntimeError, "calc_mu: no bracket for the chemical potential found."
+        return brentq(residual, min(mu_0, mu_1), max(mu_0, mu_1), xtol=0.5 * precision / slope)
+
+    def calc_density_correction(self, filename=None, dm_type='wien2k', bcast_deltaN=False):
         r"""
         Calculates the charge density correction and stores it into a file.
 
@@ -1791,6 +2978,10 @@ class SumkDFT(object):
         ----------
         filename : string
                    Name of the file to store the charge density correction.
+        bcast_deltaN : boolean, optional
+                       If True, the density matrices of all `k`-points are broadcast to all nodes. Otherwise
+                       they are only collected on the master node, which writes the file, and the other nodes
+                       keep the matrices of their own `k`-points (None for the others).
 
         Returns
         -------
@@ -1812,8 +3003,6 @@ class SumkDFT(object):
 
         ntoi = self.spin_names_to_ind[self.SO]
         spn = self.spin_block_names[self.SO]
-        dens = {sp: 0.0 for sp in spn}
-        band_en_correction = 0.0
 
 # Fetch Fermi weights and energy window band indices
         if dm_type == 'vasp':
@@ -1832,41 +3021,62 @@ class SumkDFT(object):
                 dens_mat_dft[sp] = [fermi_weights[ik, ntoi[sp], :].astype(numpy.complex_) for ik in xrange(self.n_k)]
 
 
-        # Set up deltaN:
-        deltaN = {}
-        for sp in spn:
-            deltaN[sp] = [numpy.zeros([self.n_orbitals[ik, ntoi[sp]], self.n_orbitals[
-                                      ik, ntoi[sp]]], numpy.complex_) for ik in range(self.n_k)]
-
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-            G_latt_iw = self.lattice_gf(
-                ik=ik, mu=self.chemical_potential, iw_or_w="iw")
-            for bname, gf in G_latt_iw:
-                deltaN[bname][ik] = G_latt_iw[bname].density()
-
-                dens[bname] += self.bz_weights[ik] * G_latt_iw[bname].total_density()
-                if dm_type == 'vasp':
-# In 'vasp'-mode subtract the DFT density matrix
+        # deltaN is set up for the k-points of this process first
+        deltaN = {sp: [None] * self.n_k for sp in spn}
+
+        mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh(
+            "iw", 40, None, None, True)
+        basis = self._dlr_basis(mesh)
+        iw_index = None if basis is None else basis.iw_index
+        n_om = len(mesh) if basis is None else len(basis)
+        ik_local = self._k_points_local()
+        # charge per spin and band energy correction
+        sums = numpy.zeros(len(spn) + 1)
+
+        def add_block(ik_block, partial):
+            sums_part = partial[0]
+            G_latt = self._lattice_gf_data(ik_block, mu=self.chemical_potential, iw_or_w="iw", mesh=mesh,
+                                           broadening=broadening, with_Sigma=with_Sigma, with_dc=True,
+                                           iw_index=iw_index)
+            for isp_out, bname in enumerate(spn):
+                dm = self._bloch_density(ik_block, bname, G_latt[bname], mesh, basis=basis)
+                for i, ik in enumerate(ik_block):
                     nb = self.n_orbitals[ik, ntoi[bname]]
-                    diag_inds = numpy.diag_indices(nb)
-                    deltaN[bname][ik][diag_inds] -= dens_mat_dft[bname][ik][:nb]
-                    dens[bname] -= self.bz_weights[ik] * dens_mat_dft[bname][ik].sum().real
-                    isp = ntoi[bname]
-                    b1, b2 = band_window[isp][ik, :2]
-                    nb = b2 - b1 + 1
-                    assert nb == self.n_orbitals[ik, ntoi[bname]], "Number of bands is inconsistent at ik = %s"%(ik)
-                    band_en_correction += numpy.dot(deltaN[bname][ik], self.hopping[ik, isp, :nb, :nb]).trace().real * self.bz_weights[ik]
-
-        # mpi reduce:
-        for bname in deltaN:
-            for ik in range(self.n_k):
-                deltaN[bname][ik] = mpi.all_reduce(
-                    mpi.world, deltaN[bname][ik], lambda x, y: x + y)
-            dens[bname] = mpi.all_reduce(
-                mpi.world, dens[bname], lambda x, y: x + y)
-        mpi.barrier()
-        band_en_correction = mpi.all_reduce(mpi.world, band_en_correction, lambda x,y : x+y)
+                    deltaN[bname][ik] = dm[i, 0:nb, 0:nb]
+                    sums_part[isp_out] += self.bz_weights[ik] * deltaN[bname][ik].trace().real
+                    if dm_type == 'vasp':
+# In 'vasp'-mode subtract the DFT density matrix
+                        nb = self.n_orbitals[ik, ntoi[bname]]
+                        diag_inds = numpy.diag_indices(nb)
+                        deltaN[bname][ik][diag_inds] -= dens_mat_dft[bname][ik][:nb]
+                        sums_part[isp_out] -= self.bz_weights[ik] * dens_mat_dft[bname][ik].sum().real
+                        isp = ntoi[bname]
+                        b1, b2 = band_window[isp][ik, :2]
+                        nb = b2 - b1 + 1
+                        assert nb == self.n_orbitals[ik, ntoi[bname]], "Number of bands is inconsistent at ik = %s"%(ik)
+                        sums_part[-1] += numpy.dot(deltaN[bname][ik], self.hopping[ik, isp, :nb, :nb]).trace().real * self.bz_weights[ik]
+
+        self._k_sum(ik_local, n_om, add_block, [sums])
+
+        # mpi reduce of the scalars:
+        all_reduce_sum([sums])
+        dens = {sp: sums[i] for i, sp in enumerate(spn)}
+        band_en_correction = sums[-1]
+
+        # pack the local density matrices into one buffer and gather it on the master node:
+        ik_all = gather_arrays(numpy.array(ik_local, dtype=numpy.int_))
+        packed = [deltaN[sp][ik].ravel() for ik in ik_local for sp in spn]
+        packed = gather_arrays(numpy.concatenate(packed) if packed else numpy.zeros(0, numpy.complex_))
+        if bcast_deltaN:
+            ik_all = mpi.bcast(ik_all)
+            packed = mpi.bcast(packed)
+        if ik_all is not None:
+            offset = 0
+            for ik in ik_all:
+                for sp in spn:
+                    nb = self.n_orbitals[ik, ntoi[sp]]
+                    deltaN[sp][ik] = packed[offset:offset + nb * nb].reshape(nb, nb)
+                    offset += nb * nb
 
         # now save to file:
         if dm_type == 'wien2k':
@@ -1882,23 +3092,14 @@ class SumkDFT(object):
                     f1.write("%.14f\n" %
                              (self.chemical_potential / self.energy_unit))
                 # write beta in rydberg-1
-                f.write("%.14f\n" % (G_latt_iw.mesh.beta * self.energy_unit))
+                f.write("%.14f\n" % (mesh.beta * self.energy_unit))
                 if self.SP != 0:
-                    f1.write("%.14f\n" % (G_latt_iw.mesh.beta * self.energy_unit))
+                    f1.write("%.14f\n" % (mesh.beta * self.energy_unit))
 
                 if self.SP == 0:  # no spin-polarization
-
-                    for ik in range(self.n_k):
-                        f.write("%s\n" % self.n_orbitals[ik, 0])
-                        for inu in range(self.n_orbitals[ik, 0]):
-                            for imu in range(self.n_orbitals[ik, 0]):
-                                valre = (deltaN['up'][ik][
-                                         inu, imu].real + deltaN['down'][ik][inu, imu].real) / 2.0
-                                valim = (deltaN['up'][ik][
-                                         inu, imu].imag + deltaN['down'][ik][inu, imu].imag) / 2.0
-                                f.write("%.14f  %.14f " % (valre, valim))
-                            f.write("\n")
-                        f.write("\n")
+                    self._write_density_matrices(
+                        f, (0.5 * (deltaN['up'][ik] + deltaN['down'][ik]) for ik in range(self.n_k)),
+                        header=lambda ik, dm: "%s\n" % dm.shape[0], column="%.14f  %.14f ", trailer="\n")
                     f.close()
 
                 elif self.SP == 1:  # with spin-polarization
@@ -1910,14 +3111,9 @@ class SumkDFT(object):
                         to_write = {f: (0, 'ud'), f1: (0, 'ud')}
                     for fout in to_write.iterkeys():
                         isp, sp = to_write[fout]
-                        for ik in range(self.n_k):
-                            fout.write("%s\n" % self.n_orbitals[ik, isp])
-                            for inu in range(self.n_orbitals[ik, isp]):
-                                for imu in range(self.n_orbitals[ik, isp]):
-                                    fout.write("%.14f  %.14f " % (deltaN[sp][ik][
-                                               inu, imu].real, deltaN[sp][ik][inu, imu].imag))
-                                fout.write("\n")
-                            fout.write("\n")
+                        self._write_density_matrices(
+                            fout, (deltaN[sp][ik] for ik in range(self.n_k)),
+                            header=lambda ik, dm: "%s\n" % dm.shape[0], column="%.14f  %.14f ", trailer="\n")
                         fout.close()
         elif dm_type == 'vasp':
             assert self.SP == 0, "Spin-polarized density matrix is not implemented"
@@ -1925,16 +3121,10 @@ class SumkDFT(object):
             if mpi.is_master_node():
                 with open(filename, 'w') as f:
                     f.write(" %i  -1  ! Number of k-points, default number of bands\n"%(self.n_k))
-                    for ik in xrange(self.n_k):
-                        ib1 = band_window[0][ik, 0]
-                        ib2 = band_window[0][ik, 1]
-                        f.write(" %i  %i  %i\n"%(ik + 1, ib1, ib2))
-                        for inu in xrange(self.n_orbitals[ik, 0]):
-                            for imu in xrange(self.n_orbitals[ik, 0]):
-                                valre = (deltaN['up'][ik][inu, imu].real + deltaN['down'][ik][inu, imu].real) / 2.0
-                                valim = (deltaN['up'][ik][inu, imu].imag + deltaN['down'][ik][inu, imu].imag) / 2.0
-                                f.write(" %.14f  %.14f"%(valre, valim))
-                            f.write("\n")
+                    self._write_density_matrices(
+                        f, (0.5 * (deltaN['up'][ik] + deltaN['down'][ik]) for ik in range(self.n_k)),
+                        header=lambda ik, dm: " %i  %i  %i\n" % (ik + 1, band_window[0][ik, 0], band_window[0][ik, 1]),
+                        column=" %.14f  %.14f", trailer="")
         else:
             raise NotImplementedError("Unknown density matrix type: '%s'"%(dm_type))
 
@@ -1946,6 +3136,24 @@ class SumkDFT(object):
         return res
 
 
+    def _write_density_matrices(self, f, matrices, header, column, trailer, chunk_size=256):
+        """
+        Writes the density matrices of all k-points to the open file f, one row of the matrix per line.
+
+        Each matrix is formatted at once with the format `column` per element, after the line header(ik, matrix)
+        and before trailer. The text is written in chunks of chunk_size k-points.
+        """
+        chunk = []
+        for ik, dm in enumerate(matrices):
+            n = dm.shape[0]
+            row = column * n + "\n"
+            values = numpy.ascontiguousarray(dm, dtype=numpy.complex_).view(numpy.float_).ravel()
+            chunk.append(header(ik, dm) + (row * n) % tuple(values) + trailer)
+            if len(chunk) == chunk_size:
+                f.write("".join(chunk))
+                chunk = []
+        f.write("".join(chunk))
+
 ################
 # FIXME LEAVE UNDOCUMENTED
 ################
@@ -1980,13 +3188,16 @@ class SumkDFT(object):
         dens_mat = [numpy.zeros([self.corr_shells[icrsh]['dim'], self.corr_shells[icrsh]['dim']], numpy.complex_)
                     for icrsh in range(self.n_corr_shells)]
 
-        for ik in range(self.n_k):
+        # projectors of the first spin block
+        bname = self.spin_block_names[self.SO][0]
+        # with distribute_k, every process sums over its own k-points
+        ik_sum = self._k_points_local() if self.distribute_k else numpy.arange(self.n_k)
+        for ik_block in self._k_blocks(ik_sum, 1):
+            dm_block = self._downfold_shells(ik_block, bname, self._identity_block(ik_block, 0))
             for icrsh in range(self.n_corr_shells):
-                dim = self.corr_shells[icrsh]['dim']
-                n_orb = self.n_orbitals[ik, 0]
-                projmat = self.proj_mat[ik, 0, icrsh, 0:dim, 0:n_orb]
-                dens_mat[icrsh][
-                    :, :] += numpy.dot(projmat, projmat.transpose().conjugate()) * self.bz_weights[ik]
+                dens_mat[icrsh] += dm_block[icrsh]
+        if self.distribute_k:
+            all_reduce_sum(dens_mat)
 
         if self.symm_op != 0:
             dens_mat = self.symmcorr.symmetrize(dens_mat)
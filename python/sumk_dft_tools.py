@@ -19,14 +19,24 @@
 #
 ##########################################################################
 import sys
+import itertools
 from types import *
 import numpy
 from pytriqs.gf import *
 import pytriqs.utility.mpi as mpi
 from symmetry import *
 from sumk_dft import SumkDFT
+from mpi_buffers import all_reduce_sum, all_reduce_max, block_gf_arrays, gather_arrays
 from scipy.integrate import *
 from scipy.interpolate import *
+try:
+    import h5py
+except ImportError:
+    h5py = None
+try:
+    from converters.plovasp.atm import dos_tetra_weights_3d
+except ImportError:
+    dos_tetra_weights_3d = None
 
 if not hasattr(numpy, 'full'):
     # polyfill full for older numpy:
@@ -39,7 +49,8 @@ class SumkDFTTools(SumkDFT):
 
     def __init__(self, hdf_file, h_field=0.0, use_dft_blocks=False, dft_data='dft_input', symmcorr_data='dft_symmcorr_input',
                  parproj_data='dft_parproj_input', symmpar_data='dft_symmpar_input', bands_data='dft_bands_input',
-                 transp_data='dft_transp_input', misc_data='dft_misc_input'):
+                 transp_data='dft_transp_input', misc_data='dft_misc_input', distribute_k=False,
+                 shared_memory=False, diagonal_hopping=False):
         """
         Initialisation of the class. Parameters are exactly as for SumKDFT.
         """
@@ -47,10 +58,12 @@ class SumkDFTTools(SumkDFT):
         SumkDFT.__init__(self, hdf_file=hdf_file, h_field=h_field, use_dft_blocks=use_dft_blocks,
                          dft_data=dft_data, symmcorr_data=symmcorr_data, parproj_data=parproj_data,
                          symmpar_data=symmpar_data, bands_data=bands_data, transp_data=transp_data,
-                         misc_data=misc_data)
+                         misc_data=misc_data, distribute_k=distribute_k, shared_memory=shared_memory,
+                         diagonal_hopping=diagonal_hopping)
 
     # Uses .data of only GfReFreq objects.
-    def dos_wannier_basis(self, mu=None, broadening=None, mesh=None, with_Sigma=True, with_dc=True, save_to_file=True):
+    def dos_wannier_basis(self, mu=None, broadening=None, mesh=None, with_Sigma=True, with_dc=True, save_to_file=True, window=None,
+                          hdf_file=None):
         """
         Calculates the density of states in the basis of the Wannier functions.
 
@@ -68,6 +81,10 @@ class SumkDFTTools(SumkDFT):
                   If True the double counting correction is used.
         save_to_file : boolean, optional
                        If True, text files with the calculated data will be created.
+        window : list of double, optional
+                 (om_min, om_max): the DOS is only calculated (and returned) at the mesh points in this window.
+        hdf_file : string, optional
+                   If given, all DOS components are written to the group 'DOS_wann' of this HDF5 file. Needs h5py.
 
         Returns
         -------
@@ -90,6 +107,14 @@ class SumkDFTTools(SumkDFT):
         else:
             om_min, om_max, n_om = mesh
             om_mesh = numpy.linspace(om_min, om_max, n_om)
+        lattice_mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh(
+            "w", None, broadening, mesh, with_Sigma)
+        om_index = None
+        if window is not None:
+            # only the frequencies in the window are calculated
+            om_index, window_mesh = self._window_index("w", lattice_mesh, window)
+            om_mesh = [x.real for x in window_mesh]
+            om_min, om_max, n_om = window_mesh.omega_min, window_mesh.omega_max, len(window_mesh)
 
         G_loc = []
         for icrsh in range(self.n_corr_shells):
@@ -112,35 +137,25 @@ class SumkDFTTools(SumkDFT):
                 DOSproj_orb[ish][sp] = numpy.zeros(
                     [n_om, dim, dim], numpy.complex_)
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-
-            G_latt_w = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w="w", broadening=broadening, mesh=mesh, with_Sigma=with_Sigma, with_dc=with_dc)
-            G_latt_w *= self.bz_weights[ik]
+        spn = self.spin_block_names[self.SO]
+        keys = [(icrsh, bname) for icrsh in range(self.n_corr_shells) for bname, gf in G_loc[icrsh]]
 
+        def add_block(ik_block, partial):
+            G_latt = self._lattice_gf_data(ik_block, mu=mu, iw_or_w="w", mesh=lattice_mesh, broadening=broadening,
+                                           with_Sigma=with_Sigma, with_dc=with_dc, iw_index=om_index)
             # Non-projected DOS
-            for iom in range(n_om):
-                for bname, gf in G_latt_w:
-                    DOS[bname][iom] -= gf.data[iom, :, :].imag.trace() / \
-                        numpy.pi
-
+            for isp, bname in enumerate(spn):
+                partial[isp] -= numpy.einsum('k,kwii->w', self.bz_weights[ik_block], G_latt[bname].imag) / numpy.pi
             # Projected DOS:
-            for icrsh in range(self.n_corr_shells):
-                tmp = G_loc[icrsh].copy()
-                for bname, gf in tmp:
-                    tmp[bname] << self.downfold(ik, icrsh, bname, G_latt_w[
-                                                bname], gf)  # downfolding G
-                G_loc[icrsh] += tmp
+            G_down = {bname: self._downfold_shells(ik_block, bname, G_latt[bname]) for bname in G_latt}
+            for i, (icrsh, bname) in enumerate(keys):
+                partial[len(spn) + i] += G_down[bname][icrsh]
+
+        self._k_sum(self._k_points_local(), n_om, add_block,
+                    [DOS[sp] for sp in spn] + [G_loc[icrsh][bname].data for icrsh, bname in keys])
 
         # Collect data from mpi:
-        for bname in DOS:
-            DOS[bname] = mpi.all_reduce(
-                mpi.world, DOS[bname], lambda x, y: x + y)
-        for icrsh in range(self.n_corr_shells):
-            G_loc[icrsh] << mpi.all_reduce(
-                mpi.world, G_loc[icrsh], lambda x, y: x + y)
-        mpi.barrier()
+        all_reduce_sum([DOS[bname] for bname in DOS] + block_gf_arrays(G_loc))
 
         # Symmetrize and rotate to local coord. system if needed:
         if self.symm_op != 0:
@@ -154,42 +169,19 @@ class SumkDFTTools(SumkDFT):
         # G_loc can now also be used to look at orbitally-resolved quantities
         for ish in range(self.n_inequiv_shells):
             for bname, gf in G_loc[self.inequiv_to_corr[ish]]:  # loop over spins
-                for iom in range(n_om):
-                    DOSproj[ish][bname][iom] -= gf.data[iom,
-                                                        :, :].imag.trace() / numpy.pi
+                DOSproj[ish][bname] -= numpy.einsum('wii->w', gf.data.imag) / numpy.pi
                 DOSproj_orb[ish][bname][
                     :, :, :] += (1.0j*(gf-gf.conjugate().transpose())/2.0/numpy.pi).data[:,:,:]
 
         # Write to files
-        if save_to_file and mpi.is_master_node():
-            for sp in self.spin_block_names[self.SO]:
-                f = open('DOS_wann_%s.dat' % sp, 'w')
-                for iom in range(n_om):
-                    f.write("%s    %s\n" % (om_mesh[iom], DOS[sp][iom]))
-                f.close()
-
-                # Partial
-                for ish in range(self.n_inequiv_shells):
-                    f = open('DOS_wann_%s_proj%s.dat' % (sp, ish), 'w')
-                    for iom in range(n_om):
-                        f.write("%s    %s\n" %
-                                (om_mesh[iom], DOSproj[ish][sp][iom]))
-                    f.close()
-
-                    # Orbitally-resolved
-                    for i in range(self.corr_shells[self.inequiv_to_corr[ish]]['dim']):
-                        for j in range(i, self.corr_shells[self.inequiv_to_corr[ish]]['dim']):
-                            f = open('DOS_wann_' + sp + '_proj' + str(ish) +
-                                     '_' + str(i) + '_' + str(j) + '.dat', 'w')
-                            for iom in range(n_om):
-                                f.write("%s    %s    %s\n" % (
-                                    om_mesh[iom], DOSproj_orb[ish][sp][iom, i, j].real,DOSproj_orb[ish][sp][iom, i, j].imag))
-                            f.close()
+        if mpi.is_master_node():
+            self._write_dos('DOS_wann', om_mesh, DOS, DOSproj, DOSproj_orb, save_to_file, hdf_file)
 
         return DOS, DOSproj, DOSproj_orb
 
     # Uses .data of only GfReFreq objects.
-    def dos_parproj_basis(self, mu=None, broadening=None, mesh=None, with_Sigma=True, with_dc=True, save_to_file=True):
+    def dos_parproj_basis(self, mu=None, broadening=None, mesh=None, with_Sigma=True, with_dc=True, save_to_file=True, window=None,
+                          hdf_file=None):
         """
         Calculates the orbitally-resolved DOS.
         Different to dos_Wannier_basis is that here we calculate projections also to non-Wannier projectors, in the
@@ -209,6 +201,10 @@ class SumkDFTTools(SumkDFT):
                   If True the double counting correction is used.
         save_to_file : boolean, optional
                        If True, text files with the calculated data will be created.
+        window : list of double, optional
+                 (om_min, om_max): the DOS is only calculated (and returned) at the mesh points in this window.
+        hdf_file : string, optional
+                   If given, all DOS components are written to the group 'DOS_parproj' of this HDF5 file. Needs h5py.
 
         Returns
         -------
@@ -240,6 +236,14 @@ class SumkDFTTools(SumkDFT):
         else:
             om_min, om_max, n_om = mesh
             om_mesh = numpy.linspace(om_min, om_max, n_om)
+        lattice_mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh(
+            "w", None, broadening, mesh, with_Sigma)
+        om_index = None
+        if window is not None:
+            # only the frequencies in the window are calculated
+            om_index, window_mesh = self._window_index("w", lattice_mesh, window)
+            om_mesh = [x.real for x in window_mesh]
+            om_min, om_max, n_om = window_mesh.omega_min, window_mesh.omega_max, len(window_mesh)
 
         G_loc = []
         spn = self.spin_block_names[self.SO]
@@ -264,36 +268,26 @@ class SumkDFTTools(SumkDFT):
                 DOSproj_orb[ish][sp] = numpy.zeros(
                     [n_om, dim, dim], numpy.complex_)
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-
-            G_latt_w = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w="w", broadening=broadening, mesh=mesh, with_Sigma=with_Sigma, with_dc=with_dc)
-            G_latt_w *= self.bz_weights[ik]
+        keys = [(ish, bname) for ish in range(self.n_shells) for bname in spn]
 
+        def add_block(ik_block, partial):
+            G_latt = self._lattice_gf_data(ik_block, mu=mu, iw_or_w="w", mesh=lattice_mesh, broadening=broadening,
+                                           with_Sigma=with_Sigma, with_dc=with_dc, iw_index=om_index)
             # Non-projected DOS
-            for iom in range(n_om):
-                for bname, gf in G_latt_w:
-                    DOS[bname][iom] -= gf.data[iom, :, :].imag.trace() / \
-                        numpy.pi
-
+            for isp, bname in enumerate(spn):
+                partial[isp] -= numpy.einsum('k,kwii->w', self.bz_weights[ik_block], G_latt[bname].imag) / numpy.pi
             # Projected DOS:
-            for ish in range(self.n_shells):
-                tmp = G_loc[ish].copy()
-                for ir in range(self.n_parproj[ish]):
-                    for bname, gf in tmp:
-                        tmp[bname] << self.downfold(ik, ish, bname, G_latt_w[
-                                                    bname], gf, shells='all', ir=ir)
-                    G_loc[ish] += tmp
+            G_down = {bname: self._downfold_shells(ik_block, bname, G_latt[bname], shells='all')
+                      for bname in G_latt}
+            for i, (ish, bname) in enumerate(keys):
+                partial[len(spn) + i] += G_down[bname][ish]
+
+        key = repr((self.chemical_potential if mu is None else mu, broadening, mesh, with_Sigma, with_dc, window))
+        self._k_sum_checkpointed('dos_parproj_basis', key, self._k_points_local(), n_om, add_block,
+                                 [DOS[sp] for sp in spn] + [G_loc[ish][bname].data for ish, bname in keys])
 
         # Collect data from mpi:
-        for bname in DOS:
-            DOS[bname] = mpi.all_reduce(
-                mpi.world, DOS[bname], lambda x, y: x + y)
-        for ish in range(self.n_shells):
-            G_loc[ish] << mpi.all_reduce(
-                mpi.world, G_loc[ish], lambda x, y: x + y)
-        mpi.barrier()
+        all_reduce_sum([DOS[bname] for bname in DOS] + block_gf_arrays(G_loc))
 
         # Symmetrize and rotate to local coord. system if needed:
         if self.symm_op != 0:
@@ -307,42 +301,226 @@ class SumkDFTTools(SumkDFT):
         # G_loc can now also be used to look at orbitally-resolved quantities
         for ish in range(self.n_shells):
             for bname, gf in G_loc[ish]:
-                for iom in range(n_om):
-                    DOSproj[ish][bname][iom] -= gf.data[iom,
-                                                        :, :].imag.trace() / numpy.pi
+                DOSproj[ish][bname] -= numpy.einsum('wii->w', gf.data.imag) / numpy.pi
                 DOSproj_orb[ish][bname][
                     :, :, :] += (1.0j*(gf-gf.conjugate().transpose())/2.0/numpy.pi).data[:,:,:]
 
         # Write to files
-        if save_to_file and mpi.is_master_node():
+        if mpi.is_master_node():
+            self._write_dos('DOS_parproj', om_mesh, DOS, DOSproj, DOSproj_orb, save_to_file, hdf_file)
+
+        return DOS, DOSproj, DOSproj_orb
+
+    def dos_tetra(self, mesh, k_mesh=None, tetrahedra=None, mu=None, with_Sigma=False, with_dc=True, save_to_file=True,
+                  hdf_file=None):
+        r"""
+        Calculates the density of states in the basis of the Wannier functions by the analytical tetrahedron method.
+
+        The bands are linearly interpolated within the tetrahedra spanned by the k-points, which converges much faster
+        with the number of k-points than the Lorentzian broadening of dos_wannier_basis. With with_Sigma=True, the
+        quasiparticle bands of :math:`H(k) + P^{\dagger}(k) (\mathrm{Re}\Sigma(\omega=0) - \Sigma_{dc}) P(k)` are used,
+        with the hermitian part of the real-frequency self energy at the mesh point closest to zero.
+
+        Parameters
+        ----------
+        mesh : list of double
+               (om_min, om_max, n_om) of the frequency mesh.
+        k_mesh : list of integers, optional
+                 (n_1, n_2, n_3): the k-points are a regular grid of the whole Brillouin zone, ordered with the last index
+                 running fastest (as generated by the Wannier90 converter). Six tetrahedra per grid cell are used.
+        tetrahedra : list, optional
+                     (itet, volt): the tetrahedra, e.g. from the IBZKPT file of VASP, as an integer array itet[it, :]
+                     with the multiplicity and the four k-point indices (starting at 1), and the volume volt of a tetrahedron
+                     relative to the Brillouin zone. Has to be given if k_mesh is not.
+        mu : double, optional
+             Chemical potential, overrides the one stored in the hdf5 archive.
+        with_Sigma : boolean, optional
+                     If True, the static self energy is used for the calculation.
+        with_dc : boolean, optional
+                  If True the double counting correction is used.
+        save_to_file : boolean, optional
+                       If True, text files with the calculated data will be created.
+        hdf_file : string, optional
+                   If given, all DOS components are written to the group 'DOS_tetra' of this HDF5 file. Needs h5py.
+
+        Returns
+        -------
+        DOS : Dict of numpy arrays
+              Contains the full density of states.
+        DOSproj :  Dict of numpy arrays
+                   DOS projected to atoms.
+        DOSproj_orb : Dict of numpy arrays
+                      DOS projected to atoms and resolved into orbital contributions.
+        """
+
+        if dos_tetra_weights_3d is None:
+            raise ImportError, "dos_tetra: the atm module of the VASP converter is needed."
+        if tetrahedra is None:
+            if k_mesh is None:
+                raise ValueError, "dos_tetra: Give the k_mesh or the tetrahedra."
+            itt, volt = self._regular_tetrahedra(k_mesh)
+        else:
+            itt = numpy.array(tetrahedra[0], dtype=numpy.int_).transpose().copy()
+            # k-indices are starting from 0 in Python
+            itt[1:, :] -= 1
+            volt = tetrahedra[1]
+        if numpy.any(self.n_orbitals != self.n_orbitals[0, 0]):
+            raise ValueError, "dos_tetra: the number of bands has to be the same at all k-points."
+        if self.distribute_k:
+            raise ValueError, "dos_tetra: the bands of all k-points are needed, use distribute_k=False."
+        if with_Sigma and not hasattr(self, "Sigma_imp_w"):
+            raise ValueError, "dos_tetra: Set Sigma_imp_w first or use with_Sigma=False."
+        if mu is None:
+            mu = self.chemical_potential
+        om_min, om_max, n_om = mesh
+        om_mesh = numpy.linspace(om_min, om_max, n_om)
+        ntoi = self.spin_names_to_ind[self.SO]
+        spn = self.spin_block_names[self.SO]
+        ik_all = numpy.arange(self.n_k)
+
+        # G_loc holds the spectral function matrices, which are symmetrized and rotated like the Green's functions
+        G_loc = []
+        for icrsh in range(self.n_corr_shells):
+            glist = [GfReFreq(indices=inner, window=(om_min, om_max), n_points=n_om)
+                     for block, inner in self.gf_struct_sumk[icrsh]]
+            G_loc.append(
+                BlockGf(name_list=self.spin_block_names[self.corr_shells[icrsh]['SO']], block_list=glist,
+                        make_copies=False))
+            G_loc[icrsh].zero()
+
+        DOS = {sp: numpy.zeros([n_om], numpy.float_) for sp in spn}
+        DOSproj = [{} for ish in range(self.n_inequiv_shells)]
+        DOSproj_orb = [{} for ish in range(self.n_inequiv_shells)]
+
+        if with_Sigma:
+            sigma = self._sigma_data("w", with_dc)
+            iom_0 = numpy.argmin(abs(numpy.array([x.real for x in self.Sigma_imp_w[0].mesh])))
+
+        for ibl, bname in enumerate(spn):
+            isp = ntoi[bname]
+            projmat = [self._proj_mat_block(ik_all, isp, icrsh) for icrsh in range(self.n_corr_shells)]
+            if with_Sigma:
+                hamiltonian = self._hopping_block(ik_all, isp).copy()
+                for icrsh in range(self.n_corr_shells):
+                    sigma_0 = 0.5 * (sigma[icrsh][bname][iom_0] + sigma[icrsh][bname][iom_0].conjugate().transpose())
+                    hamiltonian += numpy.matmul(projmat[icrsh].conjugate().transpose(0, 2, 1),
+                                                numpy.matmul(sigma_0, projmat[icrsh]))
+                eps, evec = numpy.linalg.eigh(hamiltonian)
+            else:
+                eps, evec = self._eigensystem_block(ik_all, isp)
+            eps = eps - self.h_field * (1 - 2 * ibl) - mu
+            # projected eigenvectors proj_evec[icrsh][ik, m, nu]
+            proj_evec = [numpy.matmul(projmat[icrsh], evec) for icrsh in range(self.n_corr_shells)]
+
+            for iom in range(mpi.rank, n_om, mpi.size):
+                # weights of the k-points in the DOS of each band, summed over the corners of all tetrahedra
+                w_k = numpy.zeros([self.n_k, eps.shape[1]], numpy.float_)
+                for nu in range(eps.shape[1]):
+                    cti = dos_tetra_weights_3d(numpy.ascontiguousarray(eps[:, nu]), om_mesh[iom], itt)
+                    w_k[:, nu] = numpy.bincount(itt[1:, :].ravel(), weights=(cti * itt[0, :] * volt).ravel(),
+                                                minlength=self.n_k)
+                DOS[bname][iom] = w_k.sum()
+                for icrsh in range(self.n_corr_shells):
+                    G_loc[icrsh][bname].data[iom] = numpy.einsum('kv,kmv,knv->mn', w_k, proj_evec[icrsh],
+                                                                 proj_evec[icrsh].conjugate())
+
+        # Collect data from mpi:
+        all_reduce_sum([DOS[bname] for bname in DOS] + block_gf_arrays(G_loc))
+
+        # Symmetrize and rotate to local coord. system if needed:
+        if self.symm_op != 0:
+            G_loc = self.symmcorr.symmetrize(G_loc)
+        if self.use_rotations:
+            for icrsh in range(self.n_corr_shells):
+                for bname, gf in G_loc[icrsh]:
+                    G_loc[icrsh][bname] << self.rotloc(
+                        icrsh, gf, direction='toLocal')
+
+        for ish in range(self.n_inequiv_shells):
+            for bname, gf in G_loc[self.inequiv_to_corr[ish]]:  # loop over spins
+                DOSproj[ish][bname] = numpy.einsum('wii->w', gf.data).real
+                DOSproj_orb[ish][bname] = gf.data.copy()
+
+        # Write to files
+        if mpi.is_master_node():
+            self._write_dos('DOS_tetra', om_mesh, DOS, DOSproj, DOSproj_orb, save_to_file, hdf_file)
+
+        return DOS, DOSproj, DOSproj_orb
+
+    def _regular_tetrahedra(self, k_mesh):
+        """
+        Returns the tetrahedra itt[:, it] = (multiplicity, ik_1, ..., ik_4) of a regular k-mesh with periodic boundaries,
+        six per grid cell sharing its main diagonal, and their volume relative to the Brillouin zone.
+        """
+        n_1, n_2, n_3 = k_mesh
+        if n_1 * n_2 * n_3 != self.n_k:
+            raise ValueError, "dos_tetra: k_mesh does not match the number of k-points."
+        i_1, i_2, i_3 = [a.ravel() for a in numpy.meshgrid(range(n_1), range(n_2), range(n_3), indexing='ij')]
+
+        def index(shift):
+            return (((i_1 + shift[0]) % n_1) * n_2 + (i_2 + shift[1]) % n_2) * n_3 + (i_3 + shift[2]) % n_3
+
+        corners = []
+        for axes in itertools.permutations(range(3)):
+            shift = numpy.zeros(3, numpy.int_)
+            corners.append([index(shift)])
+            for axis in axes:
+                shift[axis] = 1
+                corners[-1].append(index(shift))
+        itt = numpy.concatenate([numpy.array(c) for c in corners], axis=1)
+        itt = numpy.concatenate((numpy.ones([1, itt.shape[1]], numpy.int_), itt))
+        return itt, 1.0 / itt.shape[1]
+
+    def _write_dos(self, name, om_mesh, DOS, DOSproj, DOSproj_orb, save_to_file, hdf_file):
+        """
+        Writes the DOS to the text files name_*.dat (if save_to_file) and to the group name of hdf_file,
+        with the datasets mesh, DOS/sp, DOSproj/ish/sp and DOSproj_orb/ish/sp (if hdf_file is given).
+        """
+        if save_to_file:
             for sp in self.spin_block_names[self.SO]:
-                f = open('DOS_parproj_%s.dat' % sp, 'w')
-                for iom in range(n_om):
+                f = open('%s_%s.dat' % (name, sp), 'w')
+                for iom in range(len(om_mesh)):
                     f.write("%s    %s\n" % (om_mesh[iom], DOS[sp][iom]))
                 f.close()
 
                 # Partial
-                for ish in range(self.n_shells):
-                    f = open('DOS_parproj_%s_proj%s.dat' % (sp, ish), 'w')
-                    for iom in range(n_om):
+                for ish in range(len(DOSproj)):
+                    f = open('%s_%s_proj%s.dat' % (name, sp, ish), 'w')
+                    for iom in range(len(om_mesh)):
                         f.write("%s    %s\n" %
                                 (om_mesh[iom], DOSproj[ish][sp][iom]))
                     f.close()
 
                     # Orbitally-resolved
-                    for i in range(self.shells[ish]['dim']):
-                        for j in range(i, self.shells[ish]['dim']):
-                            f = open('DOS_parproj_' + sp + '_proj' + str(ish) +
+                    dim = DOSproj_orb[ish][sp].shape[1]
+                    for i in range(dim):
+                        for j in range(i, dim):
+                            f = open(name + '_' + sp + '_proj' + str(ish) +
                                      '_' + str(i) + '_' + str(j) + '.dat', 'w')
-                            for iom in range(n_om):
+                            for iom in range(len(om_mesh)):
                                 f.write("%s    %s    %s\n" % (
                                     om_mesh[iom], DOSproj_orb[ish][sp][iom, i, j].real,DOSproj_orb[ish][sp][iom, i, j].imag))
                             f.close()
 
-        return DOS, DOSproj, DOSproj_orb
+        if hdf_file is not None:
+            if h5py is None:
+                raise ImportError, "%s: h5py is needed for the output to hdf_file." % name
+            ar = h5py.File(hdf_file, 'a')
+            if name in ar:
+                del ar[name]
+            grp = ar.create_group(name)
+            grp['mesh'] = numpy.array(om_mesh)
+            for sp in DOS:
+                grp['DOS/' + sp] = DOS[sp]
+            for ish in range(len(DOSproj)):
+                for sp in DOSproj[ish]:
+                    grp['DOSproj/%s/%s' % (ish, sp)] = DOSproj[ish][sp]
+                    grp['DOSproj_orb/%s/%s' % (ish, sp)] = DOSproj_orb[ish][sp]
+            ar.close()
 
     # Uses .data of only GfReFreq objects.
-    def spaghettis(self, broadening=None, plot_shift=0.0, plot_range=None, ishell=None, mu=None, save_to_file='Akw_'):
+    def spaghettis(self, broadening=None, plot_shift=0.0, plot_range=None, ishell=None, mu=None, save_to_file='Akw_',
+                   hdf_file=None, k_chunk=64):
         """
         Calculates the correlated band structure using a real-frequency self energy.
 
@@ -353,18 +531,27 @@ class SumkDFTTools(SumkDFT):
         broadening : double, optional
                      Lorentzian broadening of the spectra. If not given, standard value of lattice_gf is used.
         plot_shift : double, optional
-                     Offset for each A(k,w) for stacked plotting of spectra.
+                     Offset for each A(k,w) for stacked plotting of spectra. It is added to the frequencies in the
+                     plot range of all spin blocks.
         plot_range : list of double, optional
                      Sets the energy window for plotting to (plot_range[0],plot_range[1]). If not provided, the energy mesh of the self energy is used.
         ishell : integer, optional
                  Contains the index of the shell on which the spectral function is projected. If ishell=None, the total spectrum without projection is calculated.
         save_to_file : string, optional
-                       Filename where the spectra are stored.
+                       Filename where the spectra are stored. No text files are written if it is None or ''.
+        hdf_file : string, optional
+                   If given, the spectra in the plot range are written to the datasets hdf_file[sp] (and the
+                   frequencies to hdf_file['mesh']) of this HDF5 file, which is overwritten. The k-points are
+                   gathered to the master node and written chunk by chunk, so that the full spectra are never held
+                   in memory. Needs h5py.
+        k_chunk : integer, optional
+                  Number of k-points per process that are gathered and written at once if hdf_file is given.
 
         Returns
         -------
-        Akw : Dict of numpy arrays
-              Data as it is also written to the files.
+        Akw : Dict of numpy arrays or string
+              Data as it is also written to the files. If hdf_file is given, its name is returned instead, and
+              the spectra Akw[sp][ik, iom] (or Akw[sp][ish, ik, iom]) are read from the file as needed.
         """
 
         assert hasattr(
@@ -394,103 +581,171 @@ class SumkDFTTools(SumkDFT):
         else:
             om_minplot = plot_range[0]
             om_maxplot = plot_range[1]
+        # only the frequencies in the plot range are calculated
+        om_index = [iom for iom in range(n_om) if (mesh[iom] > om_minplot) and (mesh[iom] < om_maxplot)]
+        assert len(om_index) >= 2, "spaghettis: no frequencies of the mesh in plot_range."
+        window = (mesh[om_index[0]], mesh[om_index[-1]])
+        window_mesh = self._window_index("w", self.Sigma_imp_w[0].mesh, window)[1]
 
+        mesh_plot = [mesh[iom] for iom in om_index]
         if ishell is None:
-            Akw = {sp: numpy.zeros([self.n_k, n_om], numpy.float_)
-                   for sp in spn}
+            row_shape = (len(om_index),)
         else:
-            Akw = {sp: numpy.zeros(
-                [self.shells[ishell]['dim'], self.n_k, n_om], numpy.float_) for sp in spn}
-
-        if not ishell is None:
-            gf_struct_parproj = [
-                (sp, range(self.shells[ishell]['dim'])) for sp in spn]
-            G_loc = BlockGf(name_block_generator=[(block, GfReFreq(indices=inner, mesh=self.Sigma_imp_w[0].mesh))
-                                                  for block, inner in gf_struct_parproj], make_copies=False)
-            G_loc.zero()
-
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-
-            G_latt_w = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w="w", broadening=broadening)
-
-            if ishell is None:
-                # Non-projected A(k,w)
-                for iom in range(n_om):
-                    if (mesh[iom] > om_minplot) and (mesh[iom] < om_maxplot):
-                        for bname, gf in G_latt_w:
-                            Akw[bname][ik, iom] += gf.data[iom, :,
-                                                           :].imag.trace() / (-1.0 * numpy.pi)
+            row_shape = (self.shells[ishell]['dim'], len(om_index))
+
+        def akw_rows(ik_chunk):
+            """A(k,w) of the k-points ik_chunk in the plot range, rows[sp][i, ...] for ik_chunk[i]."""
+            rows = {sp: numpy.zeros((len(ik_chunk),) + row_shape, numpy.float_) for sp in spn}
+            if not ishell is None:
+                gf_struct_parproj = [
+                    (sp, range(self.shells[ishell]['dim'])) for sp in spn]
+                G_loc = BlockGf(name_block_generator=[(block, GfReFreq(indices=inner, mesh=window_mesh))
+                                                      for block, inner in gf_struct_parproj], make_copies=False)
+            for i, ik in enumerate(ik_chunk):
+
+                G_latt_w = self.lattice_gf(
+                    ik=ik, mu=mu, iw_or_w="w", broadening=broadening, window=window)
+
+                if ishell is None:
+                    # Non-projected A(k,w)
+                    for bname, gf in G_latt_w:
+                        rows[bname][i] += gf.data.imag.trace(axis1=1, axis2=2) / (-1.0 * numpy.pi)
                         # shift Akw for plotting stacked k-resolved eps(k)
-                        # curves
-                        Akw[bname][ik, iom] += ik * plot_shift
-
-            else:  # ishell not None
-                # Projected A(k,w):
-                G_loc.zero()
-                tmp = G_loc.copy()
-                for ir in range(self.n_parproj[ishell]):
-                    for bname, gf in tmp:
-                        tmp[bname] << self.downfold(ik, ishell, bname, G_latt_w[
-                                                    bname], gf, shells='all', ir=ir)
-                    G_loc += tmp
-
-                # Rotate to local frame
-                if self.use_rotations:
-                    for bname, gf in G_loc:
-                        G_loc[bname] << self.rotloc(
-                            ishell, gf, direction='toLocal', shells='all')
-
-                for iom in range(n_om):
-                    if (mesh[iom] > om_minplot) and (mesh[iom] < om_maxplot):
-                        for ish in range(self.shells[ishell]['dim']):
-                            for sp in spn:
-                                Akw[sp][ish, ik, iom] = G_loc[sp].data[
-                                    iom, ish, ish].imag / (-1.0 * numpy.pi)
-
-        # Collect data from mpi
-        for sp in spn:
-            Akw[sp] = mpi.all_reduce(mpi.world, Akw[sp], lambda x, y: x + y)
-        mpi.barrier()
+                        # curves, in the plot range
+                        rows[bname][i] += ik * plot_shift
+
+                else:  # ishell not None
+                    # Projected A(k,w):
+                    G_loc.zero()
+                    tmp = G_loc.copy()
+                    for ir in range(self.n_parproj[ishell]):
+                        for bname, gf in tmp:
+                            tmp[bname] << self.downfold(ik, ishell, bname, G_latt_w[
+                                                        bname], gf, shells='all', ir=ir)
+                        G_loc += tmp
+
+                    # Rotate to local frame
+                    if self.use_rotations:
+                        for bname, gf in G_loc:
+                            G_loc[bname] << self.rotloc(
+                                ishell, gf, direction='toLocal', shells='all')
+
+                    for sp in spn:
+                        rows[sp][i] = numpy.diagonal(
+                            G_loc[sp].data, axis1=1, axis2=2).imag.transpose() / (-1.0 * numpy.pi)
+            return rows
+
+        if hdf_file is None:
+            if ishell is None:
+                Akw = {sp: numpy.zeros([self.n_k, n_om], numpy.float_)
+                       for sp in spn}
+            else:
+                Akw = {sp: numpy.zeros(
+                    [self.shells[ishell]['dim'], self.n_k, n_om], numpy.float_) for sp in spn}
+
+            def add_block(ik_block, partial):
+                rows = akw_rows(ik_block)
+                for i, ik in enumerate(ik_block):
+                    for isp, sp in enumerate(spn):
+                        if ishell is None:
+                            partial[isp][ik, om_index] = rows[sp][i]
+                        else:
+                            partial[isp][:, ik, om_index] = rows[sp][i]
+
+            key = repr((self.chemical_potential if mu is None else mu, broadening, plot_shift, plot_range, ishell))
+            self._k_sum_checkpointed('spaghettis', key, self._k_points_local(), len(om_index), add_block,
+                                     [Akw[sp] for sp in spn])
+            # Collect data from mpi
+            all_reduce_sum([Akw[sp] for sp in spn])
+        else:
+            self._stream_spaghettis(hdf_file, akw_rows, spn, row_shape, mesh_plot, ishell, k_chunk)
 
         if save_to_file and mpi.is_master_node():
-            if ishell is None:
-                for sp in spn:  # loop over GF blocs:
+            if hdf_file is not None:
+                ar = h5py.File(hdf_file, 'r')
+                Akw_out = {sp: ar[sp] for sp in spn}
+            else:
+                Akw_out = {sp: Akw[sp][..., om_index] for sp in spn}
+            for sp in spn:
+                if ishell is None:
                     # Open file for storage:
                     f = open(save_to_file + sp + '.dat', 'w')
-                    for ik in range(self.n_k):
-                        for iom in range(n_om):
-                            if (mesh[iom] > om_minplot) and (mesh[iom] < om_maxplot):
-                                if plot_shift > 0.0001:
-                                    f.write('%s      %s\n' %
-                                            (mesh[iom], Akw[sp][ik, iom]))
-                                else:
-                                    f.write('%s     %s      %s\n' %
-                                            (ik, mesh[iom], Akw[sp][ik, iom]))
-                        f.write('\n')
+                    self._write_spaghettis(f, Akw_out[sp], mesh_plot, plot_shift, k_chunk)
                     f.close()
-
-            else:  # ishell is not None
-                for sp in spn:
+                else:
                     for ish in range(self.shells[ishell]['dim']):
                         # Open file for storage:
                         f = open(save_to_file + str(ishell) + '_' +
                                  sp + '_proj' + str(ish) + '.dat', 'w')
-                        for ik in range(self.n_k):
-                            for iom in range(n_om):
-                                if (mesh[iom] > om_minplot) and (mesh[iom] < om_maxplot):
-                                    if plot_shift > 0.0001:
-                                        f.write('%s      %s\n' % (
-                                            mesh[iom], Akw[sp][ish, ik, iom]))
-                                    else:
-                                        f.write('%s     %s      %s\n' % (
-                                            ik, mesh[iom], Akw[sp][ish, ik, iom]))
-                            f.write('\n')
+                        self._write_spaghettis(f, Akw_out[sp], mesh_plot, plot_shift, k_chunk, ish=ish)
                         f.close()
+            if hdf_file is not None:
+                ar.close()
 
+        if hdf_file is not None:
+            mpi.barrier()
+            return hdf_file
         return Akw
 
+    def _stream_spaghettis(self, hdf_file, akw_rows, spn, row_shape, mesh_plot, ishell, k_chunk):
+        """
+        Writes A(k,w) into the datasets hdf_file[sp] and the frequencies into hdf_file['mesh'].
+
+        In every round, each process evaluates akw_rows for (at most) k_chunk of its k-points, and the
+        master node gathers and writes them, so that no process holds more than one chunk of k-points.
+        """
+        if h5py is None:
+            raise ImportError, "spaghettis: h5py is needed for the output to hdf_file."
+        ik_local = self._k_points_local()
+        n_chunks = numpy.array([int(numpy.ceil(len(ik_local) / float(k_chunk)))])
+        all_reduce_max([n_chunks])
+        n_chunks = n_chunks[0]
+        if mpi.is_master_node():
+            ar = h5py.File(hdf_file, 'w')
+            ar['mesh'] = numpy.array(mesh_plot)
+            for sp in spn:
+                if ishell is None:
+                    shape, chunks = (self.n_k, row_shape[0]), (min(k_chunk, self.n_k), row_shape[0])
+                else:
+                    shape = (row_shape[0], self.n_k, row_shape[1])
+                    chunks = (1, min(k_chunk, self.n_k), row_shape[1])
+                ar.create_dataset(sp, shape, numpy.float_, chunks=chunks)
+        for ichunk in range(n_chunks):
+            ik_chunk = ik_local[ichunk * k_chunk:(ichunk + 1) * k_chunk]
+            rows = akw_rows(ik_chunk)
+            ik_all = gather_arrays(numpy.array(ik_chunk, int))
+            for sp in spn:
+                data = gather_arrays(rows[sp].ravel())
+                if not mpi.is_master_node() or len(ik_all) == 0:
+                    continue
+                # h5py writes only at increasing indices
+                order = numpy.argsort(ik_all)
+                data = data.reshape((len(ik_all),) + row_shape)[order]
+                if ishell is None:
+                    ar[sp][ik_all[order], :] = data
+                else:
+                    ar[sp][:, ik_all[order], :] = data.swapaxes(0, 1)
+        if mpi.is_master_node():
+            ar.close()
+
+    def _write_spaghettis(self, f, Akw, mesh, plot_shift, k_chunk, ish=None):
+        """
+        Writes Akw[ik, iom] (or Akw[ish, ik, iom]) at the frequencies mesh to the text file f,
+        reading k_chunk k-points at once.
+        """
+        for ik_start in range(0, Akw.shape[-2], k_chunk):
+            if ish is None:
+                rows = Akw[ik_start:ik_start + k_chunk]
+            else:
+                rows = Akw[ish, ik_start:ik_start + k_chunk]
+            for ik, row in enumerate(rows, ik_start):
+                for iom in range(len(mesh)):
+                    if plot_shift > 0.0001:
+                        f.write('%s      %s\n' % (mesh[iom], row[iom]))
+                    else:
+                        f.write('%s     %s      %s\n' % (ik, mesh[iom], row[iom]))
+                f.write('\n')
+
     def partial_charges(self, beta=40, mu=None, with_Sigma=True, with_dc=True):
         """
         Calculates the orbitally-resolved density matrix for all the orbitals considered in the input, consistent with
@@ -533,37 +788,30 @@ class SumkDFTTools(SumkDFT):
         # Set up G_loc
         gf_struct_parproj = [[(sp, range(self.shells[ish]['dim'])) for sp in spn]
                              for ish in range(self.n_shells)]
-        if with_Sigma:
-            G_loc = [BlockGf(name_block_generator=[(block, GfImFreq(indices=inner, mesh=self.Sigma_imp_iw[0].mesh))
-                                                   for block, inner in gf_struct_parproj[ish]], make_copies=False)
-                     for ish in range(self.n_shells)]
-            beta = self.Sigma_imp_iw[0].mesh.beta
-        else:
-            G_loc = [BlockGf(name_block_generator=[(block, GfImFreq(indices=inner, beta=beta))
-                                                   for block, inner in gf_struct_parproj[ish]], make_copies=False)
-                     for ish in range(self.n_shells)]
+        mesh, beta, broadening, with_Sigma = self._lattice_gf_mesh(
+            "iw", beta, None, None, with_Sigma)
+        G_loc = [BlockGf(name_block_generator=[(block, GfImFreq(indices=inner, mesh=mesh))
+                                               for block, inner in gf_struct_parproj[ish]], make_copies=False)
+                 for ish in range(self.n_shells)]
         for ish in range(self.n_shells):
             G_loc[ish].zero()
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
+        keys = [(ish, bname) for ish in range(self.n_shells) for bname in spn]
 
-            G_latt_iw = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w="iw", beta=beta, with_Sigma=with_Sigma, with_dc=with_dc)
-            G_latt_iw *= self.bz_weights[ik]
-            for ish in range(self.n_shells):
-                tmp = G_loc[ish].copy()
-                for ir in range(self.n_parproj[ish]):
-                    for bname, gf in tmp:
-                        tmp[bname] << self.downfold(ik, ish, bname, G_latt_iw[
-                                                    bname], gf, shells='all', ir=ir)
-                    G_loc[ish] += tmp
+        def add_block(ik_block, G_part):
+            G_latt = self._lattice_gf_data(ik_block, mu=mu, iw_or_w="iw", mesh=mesh, broadening=broadening,
+                                           with_Sigma=with_Sigma, with_dc=with_dc)
+            G_down = {bname: self._downfold_shells(ik_block, bname, G_latt[bname], shells='all')
+                      for bname in G_latt}
+            for i, (ish, bname) in enumerate(keys):
+                G_part[i] += G_down[bname][ish]
+
+        key = repr((self.chemical_potential if mu is None else mu, beta, len(mesh), with_Sigma, with_dc))
+        self._k_sum_checkpointed('partial_charges', key, self._k_points_local(), len(mesh), add_block,
+                                 [G_loc[ish][bname].data for ish, bname in keys])
 
         # Collect data from mpi:
-        for ish in range(self.n_shells):
-            G_loc[ish] << mpi.all_reduce(
-                mpi.world, G_loc[ish], lambda x, y: x + y)
-        mpi.barrier()
+        all_reduce_sum(block_gf_arrays(G_loc))
 
         # Symmetrize and rotate to local coord. system if needed:
         if self.symm_op != 0:
@@ -592,16 +840,27 @@ class SumkDFTTools(SumkDFT):
         Prints the Kohn-Sham Hamiltonian to the text files hamup.dat and hamdn.dat (no spin orbit-coupling), or to ham.dat (with spin-orbit coupling).
         """
 
+        if self.distribute_k:
+            raise ValueError, "print_hamiltonian: the Hamiltonian of all k-points is needed, use distribute_k=False."
+
+        def diagonal(ik, isp):
+            """The diagonal of H(k) of spin isp, without building the matrix of a DiagonalHopping."""
+            if self._diagonal_hopping():
+                return numpy.asarray(self.hopping.eps[ik, isp])
+            return self.hopping[ik, isp].diagonal().real
+
         if self.SP == 1 and self.SO == 0:
             f1 = open('hamup.dat', 'w')
             f2 = open('hamdn.dat', 'w')
             for ik in range(self.n_k):
+                eps = diagonal(ik, 0)
                 for i in range(self.n_orbitals[ik, 0]):
                     f1.write('%s    %s\n' %
-                             (ik, self.hopping[ik, 0, i, i].real))
+                             (ik, eps[i]))
+                eps = diagonal(ik, 1)
                 for i in range(self.n_orbitals[ik, 1]):
                     f2.write('%s    %s\n' %
-                             (ik, self.hopping[ik, 1, i, i].real))
+                             (ik, eps[i]))
                 f1.write('\n')
                 f2.write('\n')
             f1.close()
@@ -609,9 +868,10 @@ class SumkDFTTools(SumkDFT):
         else:
             f = open('ham.dat', 'w')
             for ik in range(self.n_k):
+                eps = diagonal(ik, 0)
                 for i in range(self.n_orbitals[ik, 0]):
                     f.write('%s    %s\n' %
-                            (ik, self.hopping[ik, 0, i, i].real))
+                            (ik, eps[i]))
                 f.write('\n')
             f.close()
 
@@ -721,18 +981,7 @@ class SumkDFTTools(SumkDFT):
                 Om >= 0.0 for Om in Om_mesh), "transport_distribution: Om_mesh should not contain negative values!"
 
         # Check if energy_window is sufficiently large and correct
-
-        if (energy_window[0] >= energy_window[1] or energy_window[0] >= 0 or energy_window[1] <= 0):
-            assert 0, "transport_distribution: energy_window wrong!"
-
-        if (abs(self.fermi_dis(energy_window[0], beta) * self.fermi_dis(-energy_window[0], beta)) > 1e-5
-                or abs(self.fermi_dis(energy_window[1], beta) * self.fermi_dis(-energy_window[1], beta)) > 1e-5):
-            mpi.report(
-                "\n####################################################################")
-            mpi.report(
-                "transport_distribution: WARNING - energy window might be too narrow!")
-            mpi.report(
-                "####################################################################\n")
+        self._check_energy_window(energy_window, beta, "transport_distribution")
 
         # up and down are equivalent if SP = 0
         n_inequiv_spin_blocks = self.SP + 1 - self.SO
@@ -775,6 +1024,8 @@ class SumkDFTTools(SumkDFT):
                                 for iom in xrange(n_om):
                                     g.data[iom, int(iL), int(iR)] = Sigma_save[
                                         i].data[ioffset + iom, int(iL), int(iR)]
+                # the cached lattice GFs belong to the untruncated self energy
+                self._sigma_changed()
         else:
             assert n_om is not None, "transport_distribution: Number of omega points (n_om) needed to calculate transport distribution!"
             assert energy_window is not None, "transport_distribution: Energy window needed to calculate transport distribution!"
@@ -801,59 +1052,83 @@ class SumkDFTTools(SumkDFT):
         self.Gamma_w = {direction: numpy.zeros(
             (len(self.Om_mesh), n_om), dtype=numpy.float_) for direction in self.directions}
 
-        # Sum over all k-points
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-            # Calculate G_w  for ik and initialize A_kw
-            G_w = self.lattice_gf(ik, mu, iw_or_w="w", beta=beta,
-                                  broadening=broadening, mesh=mesh, with_Sigma=with_Sigma)
-            A_kw = [numpy.zeros((self.n_orbitals[ik][isp], self.n_orbitals[ik][isp], n_om), dtype=numpy.complex_)
-                    for isp in range(n_inequiv_spin_blocks)]
-
-            for isp in range(n_inequiv_spin_blocks):
-                # copy data from G_w (swapaxes is used to have omega in the 3rd
-                # dimension)
-                A_kw[isp] = copy.deepcopy(G_w[self.spin_block_names[self.SO][
-                                          isp]].data.swapaxes(0, 1).swapaxes(1, 2))
-                # calculate A(k,w) for each frequency
-                for iw in xrange(n_om):
-                    A_kw[isp][:, :, iw] = -1.0 / (2.0 * numpy.pi * 1j) * (
-                        A_kw[isp][:, :, iw] - numpy.conjugate(numpy.transpose(A_kw[isp][:, :, iw])))
-
-                b_min = max(self.band_window[isp][
-                            ik, 0], self.band_window_optics[isp][ik, 0])
-                b_max = min(self.band_window[isp][
-                            ik, 1], self.band_window_optics[isp][ik, 1])
-                A_i = slice(
-                    b_min - self.band_window[isp][ik, 0], b_max - self.band_window[isp][ik, 0] + 1)
-                v_i = slice(b_min - self.band_window_optics[isp][
-                            ik, 0], b_max - self.band_window_optics[isp][ik, 0] + 1)
-
-                # loop over all symmetries
-                for R in self.rot_symmetries:
-                    # get transformed velocity under symmetry R
-                    vel_R = copy.deepcopy(self.velocities_k[isp][ik])
-                    for nu1 in range(self.band_window_optics[isp][ik, 1] - self.band_window_optics[isp][ik, 0] + 1):
-                        for nu2 in range(self.band_window_optics[isp][ik, 1] - self.band_window_optics[isp][ik, 0] + 1):
-                            vel_R[nu1][nu2][:] = numpy.dot(
-                                R, vel_R[nu1][nu2][:])
+        # frequencies omega[iw] contributing to Gamma_w[:, iq, iw], for each Omega
+        iw_valid = [numpy.nonzero((numpy.arange(n_om) + iOm_mesh[iq] < n_om)
+                                  & (self.omega >= -self.Om_mesh[iq] + energy_window[0])
+                                  & (self.omega <= self.Om_mesh[iq] + energy_window[1]))[0]
+                    for iq in range(len(self.Om_mesh))]
+        # The symmetrised velocities enter only through sum_R R[a, c] R[b, d], which is the same at all k-points:
+        # sum_R Tr[(R v)_a A(w+Om) (R v)_b A(w)] = sum_cd sym_tensor[ab][c, d] Tr[v_c A(w+Om) v_d A(w)]
+        rot = numpy.array(self.rot_symmetries, dtype=numpy.float_)
+        sym_tensor = {direction: numpy.einsum('rc,rd->cd', rot[:, dir_to_int[direction[0]], :],
+                                              rot[:, dir_to_int[direction[1]], :])
+                      for direction in self.directions}
+        pairs = sorted(set((c, d) for direction in self.directions for c in range(3) for d in range(3)
+                           if abs(sym_tensor[direction][c, d]) > 1e-12))
+        components = sorted(set(c for pair in pairs for c in pair))
+
+        def add_block(ik_block, partial):
+            for ik in ik_block:
+                # Calculate G_w for ik
+                G_w = self.lattice_gf_block([ik], mu, iw_or_w="w", beta=beta,
+                                            broadening=broadening, mesh=mesh, with_Sigma=with_Sigma)[1]
+
+                for isp in range(n_inequiv_spin_blocks):
+                    # calculate A(k,w) for all frequencies, A_kw[iw, :, :]
+                    G_kw = G_w[self.spin_block_names[self.SO][isp]][0]
+                    A_kw = -1.0 / (2.0 * numpy.pi * 1j) * (G_kw - G_kw.conjugate().swapaxes(1, 2))
+
+                    b_min = max(self.band_window[isp][
+                                ik, 0], self.band_window_optics[isp][ik, 0])
+                    b_max = min(self.band_window[isp][
+                                ik, 1], self.band_window_optics[isp][ik, 1])
+                    A_i = slice(
+                        b_min - self.band_window[isp][ik, 0], b_max - self.band_window[isp][ik, 0] + 1)
+                    v_i = slice(b_min - self.band_window_optics[isp][
+                                ik, 0], b_max - self.band_window_optics[isp][ik, 0] + 1)
+                    A_kw = A_kw[:, A_i, A_i]
+
+                    # v_c A(k,w) for all frequencies
+                    vel = numpy.asarray(self.velocities_k[isp][ik])
+                    vA = {c: numpy.matmul(vel[v_i, v_i, c], A_kw) for c in components}
 
                     # calculate Gamma_w for each direction from the velocities
-                    # vel_R and the spectral function A_kw
-                    for direction in self.directions:
-                        for iw in xrange(n_om):
-                            for iq in range(len(self.Om_mesh)):
-                                if(iw + iOm_mesh[iq] >= n_om or self.omega[iw] < -self.Om_mesh[iq] + energy_window[0] or self.omega[iw] > self.Om_mesh[iq] + energy_window[1]):
-                                    continue
+                    # and the spectral function A_kw:
+                    # Tr[v_c A(w+Om) v_d A(w)] for all w at once
+                    for iq in range(len(self.Om_mesh)):
+                        iw = iw_valid[iq]
+                        trace = {(c, d): numpy.einsum('wij,wji->w', vA[c][iw + int(iOm_mesh[iq])], vA[d][iw]).real
+                                 for c, d in pairs}
+                        for idir, direction in enumerate(self.directions):
+                            partial[idir][iq, iw] += sum(
+                                sym_tensor[direction][c, d] * trace[(c, d)] for c, d in pairs) * self.bz_weights[ik]
 
-                                self.Gamma_w[direction][iq, iw] += (numpy.dot(numpy.dot(numpy.dot(vel_R[v_i, v_i, dir_to_int[direction[0]]],
-                                                                                                  A_kw[isp][A_i, A_i, int(iw + iOm_mesh[iq])]), vel_R[v_i, v_i, dir_to_int[direction[1]]]),
-                                                                              A_kw[isp][A_i, A_i, iw]).trace().real * self.bz_weights[ik])
+        # Sum over all k-points
+        key = repr((mu, beta, list(self.directions), energy_window, list(self.Om_mesh), with_Sigma, n_om, broadening))
+        self._k_sum_checkpointed('transport_distribution', key, self._k_points_local(), n_om, add_block,
+                                 [self.Gamma_w[direction] for direction in self.directions])
 
+        all_reduce_sum([self.Gamma_w[direction] for direction in self.directions])
         for direction in self.directions:
-            self.Gamma_w[direction] = (mpi.all_reduce(mpi.world, self.Gamma_w[direction], lambda x, y: x + y)
+            self.Gamma_w[direction] = (self.Gamma_w[direction]
                                        / self.cellvolume(self.lattice_type, self.lattice_constants, self.lattice_angles)[1] / self.n_symmetries)
 
+    def _check_energy_window(self, energy_window, beta, name):
+        """
+        Checks that energy_window contains zero, and warns if the Fermi window at beta does not vanish at its edges.
+        """
+        if (energy_window[0] >= energy_window[1] or energy_window[0] >= 0 or energy_window[1] <= 0):
+            assert 0, "%s: energy_window wrong!" % name
+
+        if (abs(self.fermi_dis(energy_window[0], beta) * self.fermi_dis(-energy_window[0], beta)) > 1e-5
+                or abs(self.fermi_dis(energy_window[1], beta) * self.fermi_dis(-energy_window[1], beta)) > 1e-5):
+            mpi.report(
+                "\n####################################################################")
+            mpi.report(
+                "%s: WARNING - energy window might be too narrow for beta = %s!" % (name, beta))
+            mpi.report(
+                "####################################################################\n")
+
     def transport_coefficient(self, direction, iq, n, beta, method=None):
         r"""
         Calculates the transport coefficient A_n in a given direction for a given :math:`\Omega`. The required members (Gamma_w, directions, Om_mesh) have to be obtained first
@@ -988,6 +1263,120 @@ class SumkDFTTools(SumkDFT):
 
         return self.optic_cond, self.seebeck, self.kappa
 
+    def transport_temperature_sweep(self, betas, directions=['xx'], energy_window=None, Om_mesh=[0.0], n_om=None,
+                                    broadening=0.0, method=None, subgrp=None, recompute=False):
+        r"""
+        Calculates the optical conductivity, the Seebeck coefficient and the thermal conductivity without self energy
+        for several temperatures.
+
+        Without self energy, the transport distribution :math:`\Gamma_{\alpha\beta}(\omega)` does not depend on the
+        temperature, which enters only through the Fermi functions of the frequency integrals. Gamma_w is therefore
+        calculated once by :meth:`transport_distribution <dft.sumk_dft_tools.SumkDFTTools.transport_distribution>`,
+        and the frequency integrals are evaluated for all temperatures at once. The energy window is checked for
+        every beta.
+
+        If subgrp is given, Gamma_w is stored together with Om_mesh, omega and directions in this subgroup of the
+        hdf5 archive, and later calls with the same parameters read it from there and skip the k-sum.
+
+        Parameters
+        ----------
+        betas : list of double
+            Inverse temperatures :math:`\beta`.
+        directions, energy_window, Om_mesh, n_om, broadening :
+            Same as for :meth:`transport_distribution <dft.sumk_dft_tools.SumkDFTTools.transport_distribution>`
+            with with_Sigma=False.
+        method : string, optional
+            Integration method as for :meth:`transport_coefficient <dft.sumk_dft_tools.SumkDFTTools.transport_coefficient>`.
+        subgrp : string, optional
+            Name of the hdf5 file subgroup in which the transport distribution is stored, e.g. 'dft_transp_output'.
+            By default, nothing is read from or written to the archive.
+        recompute : boolean, optional
+            If True, the transport distribution is calculated even if it is found in the archive.
+
+        Returns
+        -------
+        optic_cond : dictionary of double arrays
+            optic_cond[direction][ibeta, iq] is the optical conductivity at betas[ibeta] and frequency Om_mesh[iq].
+        seebeck : dictionary of double arrays
+            seebeck[direction][ibeta] is the Seebeck coefficient. If zero is not present in Om_mesh it is set to NaN.
+        kappa : dictionary of double arrays
+            kappa[direction][ibeta] is the thermal conductivity. If zero is not present in Om_mesh it is set to NaN.
+        """
+
+        assert energy_window is not None, "transport_temperature_sweep: Energy window needed to calculate transport distribution!"
+        betas = numpy.array(betas, dtype=numpy.float_)
+        for beta in betas:
+            self._check_energy_window(energy_window, beta, "transport_temperature_sweep")
+        # Gamma_w is reused only if it was calculated for the same parameters
+        parameters = repr([list(directions), list(energy_window), list(Om_mesh), n_om, broadening])
+        found = False
+        if mpi.is_master_node() and subgrp is not None and not recompute:
+            with HDFArchive(self.hdf_file, 'r') as ar:
+                if subgrp in ar and 'transport_parameters' in ar[subgrp]:
+                    found = (ar[subgrp]['transport_parameters'] == parameters)
+        found = mpi.bcast(found)
+
+        if found:
+            mpi.report("Reading the transport distribution from the subgroup %s." % subgrp)
+            if mpi.is_master_node():
+                self.Gamma_w, self.Om_mesh, self.omega, self.directions = self.load(
+                    ['Gamma_w', 'Om_mesh', 'omega', 'directions'], subgrp)
+        else:
+            self.transport_distribution(beta=numpy.min(betas), directions=directions, energy_window=energy_window,
+                                        Om_mesh=Om_mesh, with_Sigma=False, n_om=n_om, broadening=broadening)
+            if subgrp is not None:
+                self.transport_parameters = parameters
+                self.save(['Gamma_w', 'Om_mesh', 'omega', 'directions', 'transport_parameters'], subgrp)
+
+        if not (mpi.is_master_node()):
+            return
+
+        omega = numpy.array(self.omega)
+        n_q = len(self.Om_mesh)
+        # Fermi window for Omega = 0, fermi_window[ibeta, iw]
+        fermi_window = (self.fermi_dis(omega[numpy.newaxis, :], betas[:, numpy.newaxis]) *
+                        self.fermi_dis(-omega[numpy.newaxis, :], betas[:, numpy.newaxis]))
+
+        def coefficient(direction, iq, n):
+            """Transport coefficient A_n for all betas, as in transport_coefficient."""
+            if method == 'quad':
+                return numpy.array([self.transport_coefficient(direction, iq, n, beta, method) for beta in betas])
+            if self.Om_mesh[iq] == 0.0:
+                A_int = self.Gamma_w[direction][iq] * fermi_window * (omega[numpy.newaxis, :] * betas[:, numpy.newaxis])**n
+            elif n == 0:
+                A_int = self.Gamma_w[direction][iq] * (
+                    self.fermi_dis(omega[numpy.newaxis, :], betas[:, numpy.newaxis]) -
+                    self.fermi_dis(omega[numpy.newaxis, :] + self.Om_mesh[iq], betas[:, numpy.newaxis])) / (
+                    self.Om_mesh[iq] * betas[:, numpy.newaxis])
+            else:
+                return numpy.full((len(betas),), numpy.nan)
+            # w-integration
+            if method == 'simps':
+                A = simps(A_int, omega, axis=-1)
+            elif method == 'trapz':
+                A = numpy.trapz(A_int, omega, axis=-1)
+            else:
+                A = A_int.sum(axis=-1) * (omega[1] - omega[0])
+            return A * numpy.pi * (2.0 - self.SP)
+
+        optic_cond = {}
+        seebeck = {}
+        kappa = {}
+        for direction in self.directions:
+            A0 = numpy.array([coefficient(direction, iq, 0) for iq in range(n_q)]).transpose()
+            optic_cond[direction] = betas[:, numpy.newaxis] * A0 * 10700.0 / numpy.pi
+            seebeck[direction] = numpy.full((len(betas),), numpy.nan)
+            kappa[direction] = numpy.full((len(betas),), numpy.nan)
+            # as in conductivity_and_seebeck, the last Omega = 0 in Om_mesh is used
+            for iq in range(n_q):
+                if self.Om_mesh[iq] == 0.0:
+                    A1 = coefficient(direction, iq, 1)
+                    A2 = coefficient(direction, iq, 2)
+                    seebeck[direction] = - A1 / A0[:, iq] * 86.17
+                    kappa[direction] = (A2 - A1 * A1 / A0[:, iq]) * 293178.0
+
+        return optic_cond, seebeck, kappa
+
 
     def fermi_dis(self, w, beta):
         r"""
@@ -113,11 +113,7 @@ class TransBasis:
         # transform the CTQMC blocks to the full matrix:
         # ish is the index of the inequivalent shell corresponding to icrsh
         ish = self.SK.corr_to_inequiv[0]
-        for block, inner in self.gf_struct_solver[ish].iteritems():
-            for ind1 in inner:
-                for ind2 in inner:
-                    gfrotated[self.SK.solver_to_sumk_block[ish][block]][
-                        ind1, ind2] << gf_to_rot[block][ind1, ind2]
+        self.SK.block_structure.copy_solver_to_sumk(gf_to_rot, gfrotated, ish, 0)
 
         # Rotate using the matrix w
         for bname, gf in gfrotated:
@@ -126,11 +122,7 @@ class TransBasis:
 
         gfreturn = gf_to_rot.copy()
         # Put back into CTQMC basis:
-        for block, inner in self.gf_struct_solver[ish].iteritems():
-            for ind1 in inner:
-                for ind2 in inner:
-                    gfreturn[block][ind1, ind2] << gfrotated[
-                        self.SK.solver_to_sumk_block[0][block]][ind1, ind2]
+        self.SK.block_structure.copy_sumk_to_solver(gfrotated, gfreturn, ish, 0)
 
         return gfreturn
 
@@ -0,0 +1,98 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.gf import *
+from pytriqs.utility.comparison_tests import assert_block_gfs_are_close
+from triqs_dft_tools.block_structure import BlockStructure
+
+SK = SumkDFT('blockstructure.in.h5',use_dft_blocks=True)
+
+def sumk_gf(bs, ish):
+    return BlockGf(name_block_generator=[(block, GfImFreq(indices=inner, beta=40, n_points=3))
+                                         for block, inner in bs.gf_struct_sumk[ish]], make_copies=False)
+
+def random_gf(G):
+    for block, gf in G:
+        gf.data[...] = numpy.random.rand(*gf.data.shape) + 1j * numpy.random.rand(*gf.data.shape)
+    return G
+
+# the element-wise loops of put_Sigma and extract_G_loc, which the copy helpers replace
+def loop_solver_to_sumk(bs, G_solver, G_sumk, ish):
+    for block, inner in bs.gf_struct_solver[ish].iteritems():
+        for ind1 in inner:
+            for ind2 in inner:
+                block_sumk, ind1_sumk = bs.solver_to_sumk[ish][(block, ind1)]
+                block_sumk, ind2_sumk = bs.solver_to_sumk[ish][(block, ind2)]
+                G_sumk[block_sumk][ind1_sumk, ind2_sumk] << G_solver[block][ind1, ind2]
+
+def loop_sumk_to_solver(bs, G_sumk, G_solver, ish):
+    for block, inner in bs.gf_struct_solver[ish].iteritems():
+        for ind1 in inner:
+            for ind2 in inner:
+                block_sumk, ind1_sumk = bs.solver_to_sumk[ish][(block, ind1)]
+                block_sumk, ind2_sumk = bs.solver_to_sumk[ish][(block, ind2)]
+                G_solver[block][ind1, ind2] << G_sumk[block_sumk][ind1_sumk, ind2_sumk]
+
+def check(bs):
+    for ish in range(len(bs.gf_struct_solver)):
+        G_solver = random_gf(bs.create_gf(ish=ish, beta=40, n_points=3))
+        G_sumk = random_gf(sumk_gf(bs, ish))
+        G_sumk_loop = G_sumk.copy()
+        bs.copy_solver_to_sumk(G_solver, G_sumk, ish)
+        loop_solver_to_sumk(bs, G_solver, G_sumk_loop, ish)
+        assert_block_gfs_are_close(G_sumk, G_sumk_loop, 1.e-14)
+
+        G_sumk = random_gf(sumk_gf(bs, ish))
+        G_solver = random_gf(bs.create_gf(ish=ish, beta=40, n_points=3))
+        G_solver_loop = G_solver.copy()
+        bs.copy_sumk_to_solver(G_sumk, G_solver, ish)
+        loop_sumk_to_solver(bs, G_sumk, G_solver_loop, ish)
+        assert_block_gfs_are_close(G_solver, G_solver_loop, 1.e-14)
+
+numpy.random.seed(1)
+original_bs = SK.block_structure
+check(original_bs)
+
+# the cached index maps are renewed when the structure is changed
+bs = original_bs.copy()
+maps = bs.index_maps(0)
+bs.pick_gf_struct_solver([{'up_0': [1], 'up_1': [0], 'down_1': [0]}])
+assert bs.index_maps(0) is not maps, 'index maps not renewed by pick_gf_struct_solver'
+check(bs)
+
+bs = original_bs.copy()
+maps = bs.index_maps(0)
+bs.pick_gf_struct_sumk([{'up': [1, 2], 'down': [0,1]}])
+assert bs.index_maps(0) is not maps, 'index maps not renewed by pick_gf_struct_sumk'
+check(bs)
+
+bs = original_bs.copy()
+maps = bs.index_maps(0)
+bs.approximate_as_diagonal()
+assert bs.index_maps(0) is not maps, 'index maps not renewed by approximate_as_diagonal'
+check(bs)
+
+# and when the structure of SumkDFT is replaced
+maps = SK.block_structure.index_maps(0)
+SK.analyse_block_structure()
+assert SK.block_structure.index_maps(0) is not maps, 'index maps not renewed by analyse_block_structure'
+check(SK.block_structure)
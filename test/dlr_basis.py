@@ -0,0 +1,50 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+import numpy
+from pytriqs.gf import MeshImFreq
+from triqs_dft_tools.dlr_basis import DLRBasis
+
+# Basic input parameters
+beta = 40
+omega_max = 10.0
+mesh = MeshImFreq(beta=beta, S='Fermion', n_max=1025)
+iw = numpy.array([x for x in mesh], numpy.complex_)
+
+# a model Green's function with random poles within [-omega_max, omega_max]
+numpy.random.seed(1)
+poles = omega_max * (2.0 * numpy.random.rand(20) - 1.0)
+weights = numpy.random.rand(20)
+weights /= weights.sum()
+G_iw = (weights[numpy.newaxis, :] / (iw[:, numpy.newaxis] - poles[numpy.newaxis, :])).sum(axis=1)
+dens = numpy.dot(weights, 0.5 * (1.0 - numpy.tanh(0.5 * beta * poles)))
+
+n_nodes = 0
+for eps in [1e-4, 1e-6, 1e-8, 1e-10, 1e-12]:
+    basis = DLRBasis(mesh, omega_max, eps)
+    # a higher accuracy needs more (but still few) nodes
+    assert n_nodes <= len(basis) < 100, "DLRBasis: unexpected number of nodes %s for eps=%s" % (len(basis), eps)
+    n_nodes = len(basis)
+    coeff = basis.fit(G_iw[basis.iw_index], axis=0)
+    error = numpy.max(abs(basis.evaluate(coeff, iw, axis=0) - G_iw)) / numpy.max(abs(G_iw))
+    assert error < 100 * eps, "DLRBasis: reconstruction error %s for eps=%s" % (error, eps)
+    assert abs(basis.density(coeff, axis=0) - dens) < 100 * eps, "DLRBasis: density differs for eps=%s" % eps
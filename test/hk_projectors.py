@@ -0,0 +1,89 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import shutil
+
+# H(k) input with the same projectors at all k-points
+if mpi.is_master_node():
+    shutil.copyfile('hk_convert.ref.h5', 'hk_projectors.h5')
+mpi.barrier()
+
+def sumk(hdf_file):
+    SK = SumkDFT(hdf_file=hdf_file, use_dft_blocks=False)
+    Sigma = SK.block_structure.create_gf(beta=40)
+    for block, gf in Sigma:
+        gf << 0.5 * inverse(iOmega_n + 1.0) + 0.1
+    SK.set_Sigma([Sigma])
+    return SK
+
+SK = sumk('hk_projectors.h5')
+assert SK.k_dep_projection == 0
+# the projectors are stored once for all k-points
+assert SK.proj_mat_k_independent is not None
+assert SK.proj_mat.strides[0] == 0
+
+# the reference: the projection at every k-point
+SK_ref = sumk('hk_projectors.h5')
+SK_ref.proj_mat = numpy.array(SK_ref.proj_mat)
+SK_ref.proj_mat_k_independent = None
+
+def check():
+    for G, G_r in zip(SK.extract_G_loc(), SK_ref.extract_G_loc()):
+        assert_block_gfs_are_close(G, G_r, 1.e-12)
+    assert abs(SK.total_density() - SK_ref.total_density()) < 1.e-10, \
+        "k-independent projectors: density differs from the per-k result"
+    for dm, dm_r in zip(SK.density_matrix(), SK_ref.density_matrix()):
+        for sp in dm:
+            assert_arrays_are_close(dm[sp], dm_r[sp], 1.e-10)
+
+check()
+
+# a new self energy is upfolded again
+for SK_i in [SK, SK_ref]:
+    Sigma = SK_i.block_structure.create_gf(beta=40)
+    for block, gf in Sigma:
+        gf << 0.2 * inverse(iOmega_n - 0.5)
+    SK_i.put_Sigma([Sigma])
+check()
+
+# the projectors stay writable: an assignment sets the projectors of all k-points
+projmat = SK.proj_mat[0].copy()
+projmat[:, :, 0:2, :] = projmat[:, :, 1::-1, :]
+SK.proj_mat[0] = projmat
+SK_ref.proj_mat[:] = projmat[numpy.newaxis]
+assert (SK.proj_mat[-1] == projmat).all()
+check()
+
+# with a varying number of orbitals, the projectors are kept for every k-point
+if mpi.is_master_node():
+    shutil.copyfile('hk_convert.ref.h5', 'hk_projectors_padded.h5')
+    with HDFArchive('hk_projectors_padded.h5', 'a') as ar:
+        n_orbitals = ar['dft_input']['n_orbitals']
+        n_orbitals[0, :] -= 1
+        ar['dft_input']['n_orbitals'] = n_orbitals
+mpi.barrier()
+SK = sumk('hk_projectors_padded.h5')
+assert SK.proj_mat_k_independent is None
@@ -0,0 +1,69 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+
+from triqs_dft_tools.mpi_buffers import all_reduce_sum, all_reduce_max, gather_arrays
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+
+# arrays of mixed dtypes, different on every process
+def local_arrays(rank):
+    x = numpy.linspace(0.0, 1.0, 12).reshape(3, 4) * (rank + 1)
+    return [x, x.astype(numpy.complex_) * (1.0 - 2.0j * rank), numpy.arange(5, dtype=numpy.int_) * (rank - 1),
+            numpy.zeros(0, numpy.float_), (x + 10.0 * rank).astype(numpy.complex_)[:, ::2]]
+
+def assert_same(a, b):
+    assert a.shape == b.shape and a.dtype == b.dtype, "mpi_buffers: result has the wrong shape or dtype"
+    if a.size > 0:
+        assert_arrays_are_close(a, b, 1.e-12)
+
+# sum, also of views: the last array is a strided view of a larger one
+arrays = local_arrays(mpi.rank)
+base = (numpy.linspace(0.0, 1.0, 12).reshape(3, 4) * (mpi.rank + 1) + 10.0 * mpi.rank).astype(numpy.complex_)
+arrays[-1] = base[:, ::2]
+expected = [mpi.all_reduce(mpi.world, a.copy(), lambda x, y: x + y) for a in arrays]
+all_reduce_sum(arrays)
+for a, a_ref in zip(arrays, expected):
+    assert_same(a, a_ref)
+assert_same(base[:, ::2], expected[-1])
+for a, a_ref in zip(arrays, [sum(local_arrays(r)[i] for r in range(mpi.size)) for i in range(len(arrays))]):
+    assert_same(a, a_ref.astype(a.dtype))
+
+# maximum of real arrays
+arrays = [a for a in local_arrays(mpi.rank) if a.dtype != numpy.complex_]
+expected = [mpi.all_reduce(mpi.world, a.copy(), lambda x, y: numpy.maximum(x, y)) for a in arrays]
+all_reduce_max(arrays)
+for a, a_ref in zip(arrays, expected):
+    assert_same(a, a_ref)
+
+# gather arrays of different lengths, empty on every second process
+for dtype in [numpy.float_, numpy.complex_, numpy.int_]:
+    def local(rank):
+        return (numpy.arange(rank % 2 * (rank + 2)) + 100 * rank).astype(dtype)
+    gathered = gather_arrays(local(mpi.rank))
+    parts = mpi.world.gather(local(mpi.rank), root=0)
+    if mpi.is_master_node():
+        assert_same(gathered, numpy.concatenate(parts))
+        assert_same(gathered, numpy.concatenate([local(r) for r in range(mpi.size)]))
+    else:
+        assert gathered is None, "gather_arrays: result on a process other than the root"
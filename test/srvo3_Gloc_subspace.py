@@ -0,0 +1,54 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+
+# Basic input parameters
+beta = 40
+
+# Init the SumK class
+SK=SumkDFT(hdf_file='SrVO3.h5',use_dft_blocks=True)
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+
+gf_struct = set_operator_structure(spin_names,orb_names,False)
+glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+# a simple frequency-dependent self-energy
+for block, gf in Sigma_iw:
+    gf << 0.5 * inverse(iOmega_n + 1.0)
+
+SK.set_Sigma([Sigma_iw])
+SK.set_dc([{sp: 0.3 * numpy.identity(num_orbitals) for sp in spin_names}], [0.0])
+
+# the correlated-subspace evaluation has to agree with the full inversion
+Gloc_full = SK.extract_G_loc(method='full')
+Gloc_subspace = SK.extract_G_loc(method='correlated_subspace')
+assert_block_gfs_are_close(Gloc_full[0], Gloc_subspace[0])
+
+Gloc_full = SK.extract_G_loc(method='full', with_Sigma=False)
+Gloc_subspace = SK.extract_G_loc(method='correlated_subspace', with_Sigma=False)
+assert_block_gfs_are_close(Gloc_full[0], Gloc_subspace[0])
@@ -0,0 +1,80 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+
+# Basic input parameters
+beta = 40
+
+# Init the SumK class
+SK=SumkDFT(hdf_file='SrVO3.h5',use_dft_blocks=True)
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+
+# a vanishing self-energy: the non-interacting system, evaluated with the lattice sums of the interacting one
+gf_struct = set_operator_structure(spin_names,orb_names,False)
+glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+Sigma_iw.zero()
+SK.set_Sigma([Sigma_iw])
+
+mu_0 = SK.chemical_potential
+mu_dichotomy = SK.calc_mu(precision=1e-6)
+
+# the total charge from the poles agrees with the lattice sums
+F = SK._spectral_total_density()
+for mu in [mu_dichotomy - 0.3, mu_dichotomy, mu_dichotomy + 0.3]:
+    assert abs(F(mu) - SK.total_density(mu=mu)) < 1e-8, "spectral total density differs from the lattice sum"
+
+SK.set_mu(mu_0)
+mu_spectral = SK.calc_mu(precision=1e-6, spectral=True)
+assert abs(mu_spectral - mu_dichotomy) < 1e-5, "calc_mu: spectral result differs from the lattice sums"
+
+# Newton and Brent searches with dN/dmu reach the same chemical potential
+SK.set_mu(mu_0)
+mu_newton = SK.calc_mu(precision=1e-6, method='newton')
+assert abs(mu_newton - mu_dichotomy) < 1e-5, "calc_mu: Newton result differs from the dichotomy"
+SK.set_mu(mu_0)
+mu_brent = SK.calc_mu(precision=1e-6, method='brent')
+assert abs(mu_brent - mu_dichotomy) < 1e-5, "calc_mu: Brent result differs from the dichotomy"
+SK.set_mu(mu_0)
+mu_newton_spectral = SK.calc_mu(precision=1e-6, method='newton', spectral=True)
+assert abs(mu_newton_spectral - mu_dichotomy) < 1e-5, "calc_mu: spectral Newton result differs from the dichotomy"
+
+# dN/dmu, including the contribution of the tail, against a finite difference,
+# without and with a frequency-dependent self-energy
+for block, gf in Sigma_iw:
+    gf << 0.5 * inverse(iOmega_n + 1.0)
+for Sigma in [None, Sigma_iw]:
+    if Sigma is not None:
+        SK.set_Sigma([Sigma])
+    h = 1e-4
+    dens, dens_mu = SK.total_density(mu=mu_dichotomy, with_compressibility=True)
+    dens_mu_fd = (SK.total_density(mu=mu_dichotomy + h) - SK.total_density(mu=mu_dichotomy - h)) / (2 * h)
+    assert abs(dens_mu - dens_mu_fd) < 1e-4 * abs(dens_mu_fd), "total_density: dN/dmu differs from the finite difference"
+    dens_spectral, dens_mu_spectral = SK._spectral_total_density()(mu_dichotomy, with_compressibility=True)
+    assert abs(dens_mu_spectral - dens_mu) < 1e-8, "spectral dN/dmu differs from the lattice sum"
@@ -0,0 +1,107 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft_tools import *
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+from pytriqs.archive import *
+import pytriqs.utility.mpi as mpi
+import os
+import shutil
+
+beta = 40
+
+if mpi.is_master_node():
+    shutil.copyfile('SrVO3.h5', 'srvo3_checkpoint.h5')
+mpi.barrier()
+checkpoint_file = 'srvo3_checkpoint_checkpoint.h5'
+
+SK = SumkDFTTools(hdf_file='srvo3_checkpoint.h5', use_dft_blocks=True)
+SK_ref = SumkDFTTools(hdf_file='srvo3_checkpoint.h5', use_dft_blocks=True)
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+
+def sigma(a):
+    gf_struct = set_operator_structure(spin_names,orb_names,False)
+    glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+    Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+    for block, gf in Sigma_iw:
+        gf << a * inverse(iOmega_n + 1.0)
+    return Sigma_iw
+
+class Interrupted(Exception):
+    pass
+
+def interrupted_partial_charges():
+    """partial_charges, interrupted after the second checkpoint."""
+    write_checkpoint = SK._write_checkpoint
+    n_written = [0]
+    def write_and_interrupt(*args):
+        write_checkpoint(*args)
+        n_written[0] += 1
+        if n_written[0] == 2:
+            raise Interrupted
+    SK._write_checkpoint = write_and_interrupt
+    try:
+        SK.partial_charges(beta=beta)
+    except Interrupted:
+        pass
+    else:
+        raise AssertionError, 'partial_charges was not interrupted'
+    finally:
+        del SK._write_checkpoint
+    if mpi.is_master_node():
+        assert os.path.exists(checkpoint_file), 'no checkpoint written'
+
+def check():
+    dens_mat = SK.partial_charges(beta=beta)
+    dens_mat_ref = SK_ref.partial_charges(beta=beta)
+    for dm, dm_ref in zip(dens_mat, dens_mat_ref):
+        for sp in dm_ref:
+            assert_arrays_are_close(dm[sp], dm_ref[sp], 1.e-12)
+    if mpi.is_master_node():
+        assert not os.path.exists(checkpoint_file), 'checkpoint file not removed'
+
+for S in [SK, SK_ref]:
+    S.set_Sigma([sigma(0.5)])
+
+# one k-point per block and a checkpoint after every block
+SK.k_block_memory = 1
+SK.set_checkpoint(0.0)
+
+# the resumed k-sum gives the same result as an uninterrupted one
+interrupted_partial_charges()
+check()
+
+# the checkpoint of another self energy is not used
+interrupted_partial_charges()
+for S in [SK, SK_ref]:
+    S.put_Sigma([sigma(0.3)])
+check()
+
+# the input archive is left alone
+if mpi.is_master_node():
+    with HDFArchive('srvo3_checkpoint.h5', 'r') as ar:
+        assert 'dft_checkpoint' not in ar, 'checkpoint written to the input archive'
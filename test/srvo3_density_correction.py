@@ -0,0 +1,113 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from pytriqs.archive import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import shutil
+
+# Basic input parameters
+beta = 40
+
+def write_wien2k(filename, SK, deltaN):
+    # the file format of calc_density_correction(dm_type='wien2k'), written element by element
+    with open(filename, 'w') as f:
+        f.write("%.14f\n" % (SK.chemical_potential / SK.energy_unit))
+        f.write("%.14f\n" % (beta * SK.energy_unit))
+        for ik in range(SK.n_k):
+            f.write("%s\n" % SK.n_orbitals[ik, 0])
+            for inu in range(SK.n_orbitals[ik, 0]):
+                for imu in range(SK.n_orbitals[ik, 0]):
+                    valre = (deltaN['up'][ik][inu, imu].real + deltaN['down'][ik][inu, imu].real) / 2.0
+                    valim = (deltaN['up'][ik][inu, imu].imag + deltaN['down'][ik][inu, imu].imag) / 2.0
+                    f.write("%.14f  %.14f " % (valre, valim))
+                f.write("\n")
+            f.write("\n")
+
+def write_vasp(filename, SK, deltaN, band_window):
+    # the file format of calc_density_correction(dm_type='vasp'), written element by element
+    with open(filename, 'w') as f:
+        f.write(" %i  -1  ! Number of k-points, default number of bands\n"%(SK.n_k))
+        for ik in xrange(SK.n_k):
+            f.write(" %i  %i  %i\n"%(ik + 1, band_window[0][ik, 0], band_window[0][ik, 1]))
+            for inu in xrange(SK.n_orbitals[ik, 0]):
+                for imu in xrange(SK.n_orbitals[ik, 0]):
+                    valre = (deltaN['up'][ik][inu, imu].real + deltaN['down'][ik][inu, imu].real) / 2.0
+                    valim = (deltaN['up'][ik][inu, imu].imag + deltaN['down'][ik][inu, imu].imag) / 2.0
+                    f.write(" %.14f  %.14f"%(valre, valim))
+                f.write("\n")
+
+def assert_same_on_all_nodes(deltaN, all_k=True):
+    # without all_k, the nodes only have to know the k-points they calculated
+    deltaN_master = mpi.bcast(deltaN)
+    for sp in deltaN:
+        for ik in range(len(deltaN[sp])):
+            assert deltaN_master[sp][ik] is not None, "deltaN is incomplete on the master node"
+            if deltaN[sp][ik] is None:
+                assert not all_k, "deltaN is incomplete on node %s" % mpi.rank
+                continue
+            assert numpy.array_equal(deltaN[sp][ik], deltaN_master[sp][ik]), "deltaN differs between the nodes"
+
+def assert_same_files(filename_1, filename_2):
+    if mpi.is_master_node():
+        assert open(filename_1).read() == open(filename_2).read(), "%s differs from %s" % (filename_1, filename_2)
+
+def set_Sigma(SK):
+    num_orbitals = SK.corr_shells[0]['dim']
+    gf_struct = set_operator_structure(['up','down'],['%s'%i for i in range(num_orbitals)],False)
+    glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+    Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+    for block, gf in Sigma_iw:
+        gf << 0.5 * inverse(iOmega_n + 1.0)
+    SK.set_Sigma([Sigma_iw])
+
+# Wien2k
+SK = SumkDFT(hdf_file='SrVO3.h5', use_dft_blocks=True)
+set_Sigma(SK)
+deltaN, dens = SK.calc_density_correction(filename='dens_mat.out.dat', dm_type='wien2k', bcast_deltaN=True)
+assert_same_on_all_nodes(deltaN)
+if mpi.is_master_node():
+    write_wien2k('dens_mat.ref.dat', SK, deltaN)
+assert_same_files('dens_mat.out.dat', 'dens_mat.ref.dat')
+
+# VASP, with made-up DFT occupations on a copy of the archive
+if mpi.is_master_node():
+    shutil.copyfile('SrVO3.h5', 'srvo3_density_correction.h5')
+    with HDFArchive('srvo3_density_correction.h5', 'a') as ar:
+        n_orbitals = ar['dft_input']['n_orbitals']
+        n_k, n_spin = n_orbitals.shape
+        band_window = [numpy.array([[3, 2 + n_orbitals[ik, isp]] for ik in range(n_k)]) for isp in range(n_spin)]
+        ar['dft_misc_input']['band_window'] = band_window
+        ar['dft_misc_input']['dft_fermi_weights'] = 0.5 * numpy.ones([n_k, n_spin, numpy.max(n_orbitals)])
+mpi.barrier()
+SK = SumkDFT(hdf_file='srvo3_density_correction.h5', use_dft_blocks=True)
+set_Sigma(SK)
+deltaN, dens, band_en_correction = SK.calc_density_correction(filename='GAMMA.out', dm_type='vasp')
+assert_same_on_all_nodes(deltaN, all_k=False)
+if mpi.is_master_node():
+    with HDFArchive('srvo3_density_correction.h5', 'r') as ar:
+        band_window = ar['dft_misc_input']['band_window']
+    write_vasp('GAMMA.ref', SK, deltaN, band_window)
+assert_same_files('GAMMA.out', 'GAMMA.ref')
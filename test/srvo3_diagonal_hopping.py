@@ -0,0 +1,95 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from pytriqs.archive import *
+from triqs_dft_tools.sumk_dft_tools import *
+from triqs_dft_tools.diagonal_hopping import DiagonalHopping, diagonal_part
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+import filecmp
+import os
+import shutil
+
+# the wrapper gives the same matrices as the dense array
+numpy.random.seed(1)
+eps = numpy.random.rand(4, 2, 3)
+dense = numpy.zeros([4, 2, 3, 3], numpy.complex_)
+for i in range(3):
+    dense[:, :, i, i] = eps[:, :, i]
+hopping = DiagonalHopping(eps)
+assert hopping.shape == dense.shape and hopping.ndim == 4 and hopping.dtype == dense.dtype
+assert_arrays_are_close(numpy.asarray(hopping), dense, 1.e-15)
+assert_arrays_are_close(hopping[2], dense[2], 1.e-15)
+assert_arrays_are_close(hopping[1, 0], dense[1, 0], 1.e-15)
+assert_arrays_are_close(hopping[[0, 3], 1, 0:2, 0:2], dense[[0, 3], 1, 0:2, 0:2], 1.e-15)
+assert_arrays_are_close(hopping[1:3, :, 1, :], dense[1:3, :, 1, :], 1.e-15)
+# only real diagonal Hamiltonians are recognised
+assert_arrays_are_close(diagonal_part(dense), eps, 1.e-15)
+off_diagonal = dense.copy()
+off_diagonal[0, 0, 0, 1] = 0.1
+assert diagonal_part(off_diagonal) is None
+complex_diagonal = dense.copy()
+complex_diagonal[0, 0, 0, 0] += 0.1j
+assert diagonal_part(complex_diagonal) is None
+
+if mpi.is_master_node():
+    shutil.copyfile('SrVO3.h5', 'srvo3_diagonal_hopping.h5')
+mpi.barrier()
+
+# the diagonal Hamiltonians of Wien2k are only used on request
+SK = SumkDFTTools(hdf_file='srvo3_diagonal_hopping.h5', use_dft_blocks=True, diagonal_hopping=True)
+SK_ref = SumkDFTTools(hdf_file='srvo3_diagonal_hopping.h5', use_dft_blocks=True)
+assert isinstance(SK.hopping, DiagonalHopping)
+assert isinstance(SK_ref.hopping, numpy.ndarray), 'hopping is not a dense array by default'
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+gf_struct = set_operator_structure(spin_names,orb_names,False)
+glist = [ GfImFreq(indices=inner,beta=40) for block,inner in gf_struct]
+Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+for block, gf in Sigma_iw:
+    gf << 0.5 * inverse(iOmega_n + 1.0)
+
+# the same k-sums with and without self energy
+for S in [SK, SK_ref]:
+    S.set_Sigma([Sigma_iw])
+assert abs(SK.total_density() - SK_ref.total_density()) < 1.e-12
+for with_Sigma in [True, False]:
+    for G, G_ref in zip(SK.extract_G_loc(with_Sigma=with_Sigma), SK_ref.extract_G_loc(with_Sigma=with_Sigma)):
+        assert_block_gfs_are_close(G, G_ref, 1.e-12)
+
+# the diagonal Hamiltonians are saved as dense arrays
+SK.save(['hopping'], 'diagonal_hopping_test')
+if mpi.is_master_node():
+    with HDFArchive('srvo3_diagonal_hopping.h5', 'r') as ar:
+        assert_arrays_are_close(ar['diagonal_hopping_test']['hopping'], SK_ref.hopping, 1.e-15)
+
+# and written like the dense ones
+if mpi.is_master_node():
+    SK_ref.print_hamiltonian()
+    os.rename('ham.dat', 'ham_ref.dat')
+    SK.print_hamiltonian()
+    assert filecmp.cmp('ham.dat', 'ham_ref.dat', shallow=False), 'print_hamiltonian: output differs'
@@ -0,0 +1,64 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.archive import *
+from triqs_dft_tools.sumk_dft import *
+from triqs_dft_tools.k_local_array import KLocalArray, read_k_slab
+from triqs_dft_tools.mpi_buffers import all_reduce_sum
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+
+# every process reads only its own k-points, compared to the data read by the master node and broadcast
+SK = SumkDFT(hdf_file='SrVO3.h5', use_dft_blocks=True, distribute_k=True)
+SK_ref = SumkDFT(hdf_file='SrVO3.h5', use_dft_blocks=True)
+for S in [SK, SK_ref]:
+    S.read_input_from_hdf(subgrp=S.parproj_data, things_to_read=['proj_mat_all'])
+
+# the hyperslabs, also at the ends and empty
+with HDFArchive('SrVO3.h5', 'r') as ar:
+    proj_mat = ar['dft_input']['proj_mat']
+n_k = proj_mat.shape[0]
+for ik_first, ik_last in [(0, n_k - 1), (0, 0), (n_k - 1, n_k - 1), (2, n_k // 2)]:
+    assert_arrays_are_close(read_k_slab('SrVO3.h5', 'dft_input', 'proj_mat', ik_first, ik_last),
+                            proj_mat[ik_first:ik_last + 1], 1.e-14)
+assert read_k_slab('SrVO3.h5', 'dft_input', 'proj_mat', 3, 2).shape == (0,) + proj_mat.shape[1:]
+
+ik_local = SK._k_points_local()
+# the k-points are distributed over all processes, a single process has all of them
+n_local = numpy.array([len(ik_local)])
+all_reduce_sum([n_local])
+assert n_local[0] == SK.n_k
+for name in ['proj_mat', 'proj_mat_all']:
+    assert isinstance(getattr(SK, name), KLocalArray), name + ' not read per process'
+for ik in ik_local:
+    assert_arrays_are_close(SK.proj_mat[ik], SK_ref.proj_mat[ik], 1.e-14)
+    assert_arrays_are_close(SK.proj_mat_all[ik], SK_ref.proj_mat_all[ik], 1.e-14)
+    assert_arrays_are_close(SK.hopping[ik], SK_ref.hopping[ik], 1.e-14)
+
+# and the k-sums over the local k-points give the same results
+assert abs(SK.total_density() - SK_ref.total_density()) < 1.e-12
+for G, G_ref in zip(SK.extract_G_loc(), SK_ref.extract_G_loc()):
+    assert_block_gfs_are_close(G, G_ref, 1.e-12)
+for dm, dm_ref in zip(SK.density_matrix(), SK_ref.density_matrix()):
+    for sp in dm_ref:
+        assert_arrays_are_close(dm[sp], dm_ref[sp], 1.e-12)
@@ -0,0 +1,70 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+
+# Basic input parameters
+beta = 40
+
+# Init the SumK class
+SK=SumkDFT(hdf_file='SrVO3.h5',use_dft_blocks=True)
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+
+gf_struct = set_operator_structure(spin_names,orb_names,False)
+glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+# a simple frequency-dependent self-energy
+for block, gf in Sigma_iw:
+    gf << 0.5 * inverse(iOmega_n + 1.0)
+
+SK.set_Sigma([Sigma_iw])
+SK.set_dc([{sp: 0.3 * numpy.identity(num_orbitals) for sp in spin_names}], [0.0])
+
+# reference on the full Matsubara mesh
+Gloc_ref = SK.extract_G_loc()
+dens_ref = SK.total_density()
+
+# compact (DLR) representation of the lattice GFs, the error decreases with eps
+dm_ref = SK.density_matrix(method='using_gf', beta=beta)
+for eps in [1e-6, 1e-8, 1e-10]:
+    SK.set_dlr(omega_max=20.0, eps=eps)
+    Gloc_dlr = SK.extract_G_loc()
+    dens_dlr = SK.total_density()
+    dm_dlr = SK.density_matrix(method='using_gf', beta=beta)
+
+    assert_block_gfs_are_close(Gloc_ref[0], Gloc_dlr[0], precision=max(1e-6, 100 * eps))
+    assert abs(dens_ref - dens_dlr) < max(1e-5, 100 * eps), "total_density: DLR result differs from the full mesh"
+    for sp in dm_ref[0]:
+        assert_arrays_are_close(dm_ref[0][sp], dm_dlr[0][sp], precision=max(1e-5, 100 * eps))
+
+# the same for the spectral search of the chemical potential
+SK.set_dlr(omega_max=None)
+mu_ref = SK.calc_mu(precision=1e-6, spectral=True)
+SK.set_dlr(omega_max=20.0, eps=1e-10)
+SK.set_mu(0.0)
+mu_dlr = SK.calc_mu(precision=1e-6, spectral=True)
+assert abs(mu_ref - mu_dlr) < 1e-4, "calc_mu: DLR result differs from the full mesh"
@@ -0,0 +1,114 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+
+from pytriqs.archive import *
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft_tools import *
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+import h5py
+
+SK = SumkDFTTools(hdf_file='SrVO3.h5', use_dft_blocks=True)
+
+with HDFArchive('SrVO3_Sigma.h5', 'r') as ar:
+    Sigma = ar['dmft_transp_input']['Sigma_w']
+    SK.set_Sigma([Sigma])
+    SK.chemical_potential = ar['dmft_transp_input']['chemical_potential']
+    SK.dc_imp = ar['dmft_transp_input']['dc_imp']
+
+broadening = 0.01
+spn = SK.spin_block_names[SK.SO]
+om_mesh = numpy.array([x.real for x in Sigma.mesh])
+
+def dos_reference(shells):
+    # the DOS summed one k-point at a time, with lattice_gf and downfold
+    if shells == 'corr':
+        n_shells = SK.n_corr_shells
+        gf_struct = [SK.gf_struct_sumk[icrsh] for icrsh in range(n_shells)]
+    else:
+        n_shells = SK.n_shells
+        gf_struct = [[(sp, range(SK.shells[ish]['dim'])) for sp in spn] for ish in range(n_shells)]
+    G_loc = [BlockGf(name_block_generator=[(sp, GfReFreq(indices=inner, mesh=Sigma.mesh)) for sp, inner in gf_struct[ish]],
+                     make_copies=False) for ish in range(n_shells)]
+    DOS = {sp: numpy.zeros(len(om_mesh)) for sp in spn}
+    for ik in range(SK.n_k):
+        G_latt_w = SK.lattice_gf(ik=ik, iw_or_w="w", broadening=broadening)
+        for sp, gf in G_latt_w:
+            DOS[sp] -= SK.bz_weights[ik] * numpy.einsum('wii->w', gf.data.imag) / numpy.pi
+        for ish in range(n_shells):
+            tmp = G_loc[ish].copy()
+            for ir in range(1 if shells == 'corr' else SK.n_parproj[ish]):
+                for sp, gf in tmp:
+                    gf << SK.downfold(ik, ish, sp, G_latt_w[sp], gf, shells=shells, ir=ir)
+                tmp *= SK.bz_weights[ik]
+                G_loc[ish] += tmp
+    if SK.symm_op != 0:
+        G_loc = (SK.symmcorr if shells == 'corr' else SK.symmpar).symmetrize(G_loc)
+    if SK.use_rotations:
+        for ish in range(n_shells):
+            for sp, gf in G_loc[ish]:
+                G_loc[ish][sp] << SK.rotloc(ish, gf, direction='toLocal', shells=shells)
+    if shells == 'corr':
+        G_loc = [G_loc[SK.inequiv_to_corr[ish]] for ish in range(SK.n_inequiv_shells)]
+    DOSproj = [{sp: -numpy.einsum('wii->w', gf.data.imag) / numpy.pi for sp, gf in G} for G in G_loc]
+    DOSproj_orb = [{sp: (1.0j * (gf - gf.conjugate().transpose()) / 2.0 / numpy.pi).data for sp, gf in G}
+                   for G in G_loc]
+    return DOS, DOSproj, DOSproj_orb
+
+if mpi.is_master_node():
+    with h5py.File('srvo3_dos.out.h5', 'w') as ar:
+        pass
+mpi.barrier()
+
+for name, shells, dos in [('DOS_wann', 'corr', SK.dos_wannier_basis), ('DOS_parproj', 'all', SK.dos_parproj_basis)]:
+    DOS, DOSproj, DOSproj_orb = dos(broadening=broadening, save_to_file=True, hdf_file='srvo3_dos.out.h5')
+    DOS_ref, DOSproj_ref, DOSproj_orb_ref = dos_reference(shells)
+    for sp in spn:
+        assert_arrays_are_close(DOS[sp], DOS_ref[sp], 1.e-10)
+    assert len(DOSproj) == len(DOSproj_ref)
+    for ish in range(len(DOSproj)):
+        for sp in spn:
+            assert_arrays_are_close(DOSproj[ish][sp], DOSproj_ref[ish][sp], 1.e-10)
+            assert_arrays_are_close(DOSproj_orb[ish][sp], DOSproj_orb_ref[ish][sp], 1.e-10)
+
+    if mpi.is_master_node():
+        # the group written to hdf_file
+        with h5py.File('srvo3_dos.out.h5', 'r') as ar:
+            assert_arrays_are_close(ar[name]['mesh'][...], om_mesh, 1.e-14)
+            for sp in spn:
+                assert_arrays_are_close(ar[name]['DOS'][sp][...], DOS[sp], 1.e-14)
+                for ish in range(len(DOSproj)):
+                    assert_arrays_are_close(ar[name]['DOSproj'][str(ish)][sp][...], DOSproj[ish][sp], 1.e-14)
+                    assert_arrays_are_close(ar[name]['DOSproj_orb'][str(ish)][sp][...], DOSproj_orb[ish][sp], 1.e-14)
+        # the text files
+        for sp in spn:
+            data = numpy.loadtxt('%s_%s.dat' % (name, sp))
+            assert_arrays_are_close(data[:, 0], om_mesh, 1.e-10)
+            assert_arrays_are_close(data[:, 1], DOS[sp], 1.e-10)
+            for ish in range(len(DOSproj)):
+                data = numpy.loadtxt('%s_%s_proj%s.dat' % (name, sp, ish))
+                assert_arrays_are_close(data[:, 1], DOSproj[ish][sp], 1.e-10)
+                data = numpy.loadtxt('%s_%s_proj%s_0_0.dat' % (name, sp, ish))
+                assert_arrays_are_close(data[:, 1] + 1j * data[:, 2], DOSproj_orb[ish][sp][:, 0, 0], 1.e-10)
+    mpi.barrier()
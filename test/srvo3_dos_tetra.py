@@ -0,0 +1,68 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from triqs_dft_tools.converters import *
+from triqs_dft_tools.sumk_dft_tools import *
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+
+# t2g tight-binding model of SrVO3 on a regular 20x20x20 k-mesh, the last index running fastest
+n = 20
+t, t_z, t_p = 0.26, 0.03, 0.08
+if mpi.is_master_node():
+    k = 2 * numpy.pi * numpy.arange(n) / n
+    cos = [numpy.cos(a.ravel()) for a in numpy.meshgrid(k, k, k, indexing='ij')]
+    f = open('srvo3_dos_tetra.hk', 'w')
+    f.write('%d\n1.0\n1\n0 0 2 3\n1\n0 0 2 3 0 1\n1 3\n' % n**3)
+    for ik in range(n**3):
+        # xy, yz and xz orbitals
+        eps = [-2 * t * (cos[a][ik] + cos[b][ik]) - 2 * t_z * cos[c][ik] - 4 * t_p * cos[a][ik] * cos[b][ik]
+               for a, b, c in [(0, 1, 2), (1, 2, 0), (0, 2, 1)]]
+        for part in [numpy.diag(eps), numpy.zeros([3, 3])]:
+            for row in part:
+                f.write(' '.join('%.12f' % x for x in row) + '\n')
+    f.close()
+Converter = HkConverter(filename='srvo3_dos_tetra.hk', hdf_filename='srvo3_dos_tetra.h5')
+Converter.convert_dft_input()
+mpi.barrier()
+
+SK = SumkDFTTools(hdf_file='srvo3_dos_tetra.h5', use_dft_blocks=False)
+
+mesh = (-2.0, 2.0, 801)
+om_mesh = numpy.linspace(*mesh)
+DOS, DOSproj, DOSproj_orb = SK.dos_tetra(mesh, k_mesh=(n, n, n), save_to_file=False)
+
+for sp in SK.spin_block_names[SK.SO]:
+    # the DOS of the three bands integrates to 3
+    assert abs(numpy.trapz(DOS[sp], om_mesh) - 3.0) < 1.e-4, "dos_tetra: DOS does not integrate to the number of bands"
+    # the Wannier functions are the bands
+    assert_arrays_are_close(DOSproj[0][sp], DOS[sp], 1.e-10)
+
+# with a Lorentzian broadening, the tetrahedron DOS agrees with the k-sum of dos_wannier_basis
+broadening = 0.1
+DOS_wann = SK.dos_wannier_basis(broadening=broadening, mesh=mesh, with_Sigma=False, save_to_file=False)[0]
+lorentz = broadening / numpy.pi / ((om_mesh[:, numpy.newaxis] - om_mesh[numpy.newaxis, :])**2 + broadening**2)
+for sp in SK.spin_block_names[SK.SO]:
+    DOS_broadened = numpy.trapz(lorentz * DOS[sp][numpy.newaxis, :], om_mesh, axis=1)
+    assert numpy.max(abs(DOS_broadened - DOS_wann[sp])) < 0.03 * numpy.max(DOS_wann[sp]), \
+        "dos_tetra: broadened DOS differs from dos_wannier_basis"
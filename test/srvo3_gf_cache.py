@@ -0,0 +1,96 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+from pytriqs.archive import *
+import pytriqs.utility.mpi as mpi
+import shutil
+
+# Basic input parameters
+beta = 40
+
+# Init the SumK classes, with and without cache
+SK=SumkDFT(hdf_file='SrVO3.h5',use_dft_blocks=True)
+SK.set_gf_cache(1024**3)
+SK_ref=SumkDFT(hdf_file='SrVO3.h5',use_dft_blocks=True)
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+
+def sigma(a):
+    gf_struct = set_operator_structure(spin_names,orb_names,False)
+    glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+    Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+    for block, gf in Sigma_iw:
+        gf << a * inverse(iOmega_n + 1.0)
+    return Sigma_iw
+
+def check(message):
+    assert abs(SK.total_density() - SK_ref.total_density()) < 1e-12, "total_density with cache: " + message
+    assert_block_gfs_are_close(SK.extract_G_loc()[0], SK_ref.extract_G_loc()[0])
+
+for S in [SK, SK_ref]:
+    S.set_Sigma([sigma(0.5)])
+
+# the first k-sum fills the cache, the second one only reads from it
+check("first k-sum")
+assert len(SK.gf_cache) > 0 and SK.gf_cache.misses > 0
+hits, misses = SK.gf_cache.hits, SK.gf_cache.misses
+check("cached k-sum")
+assert SK.gf_cache.misses == misses and SK.gf_cache.hits > hits, "gf_cache: cached GFs not used"
+
+# a new self energy
+for S in [SK, SK_ref]:
+    S.put_Sigma([sigma(0.3)])
+assert len(SK.gf_cache) == 0, "gf_cache: not cleared by put_Sigma"
+check("after put_Sigma")
+
+# a new double counting
+for S in [SK, SK_ref]:
+    S.set_dc([{sp: 0.2 * numpy.identity(num_orbitals) for sp in spin_names}], [0.0])
+assert len(SK.gf_cache) == 0, "gf_cache: not cleared by set_dc"
+check("after set_dc")
+
+# a new chemical potential
+for S in [SK, SK_ref]:
+    S.set_mu(S.chemical_potential + 0.1)
+assert len(SK.gf_cache) == 0, "gf_cache: GFs at other chemical potentials not dropped by set_mu"
+check("after set_mu")
+
+# a new Hamiltonian, shifted rigidly, from a copy of the archive
+check("before reading the Hamiltonian")
+if mpi.is_master_node():
+    shutil.copyfile('SrVO3.h5', 'srvo3_gf_cache.h5')
+    with HDFArchive('srvo3_gf_cache.h5', 'a') as ar:
+        hopping = ar['dft_input']['hopping']
+        hopping += 0.1 * numpy.identity(hopping.shape[-1])[numpy.newaxis, numpy.newaxis, :, :]
+        ar['dft_input']['hopping'] = hopping
+mpi.barrier()
+for S in [SK, SK_ref]:
+    S.hdf_file = 'srvo3_gf_cache.h5'
+    S.read_input_from_hdf(subgrp=S.dft_data, things_to_read=['hopping'])
+assert len(SK.gf_cache) == 0, "gf_cache: not cleared when reading the Hamiltonian"
+check("after reading the Hamiltonian")
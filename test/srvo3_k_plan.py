@@ -0,0 +1,80 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from triqs_dft_tools.mpi_buffers import gather_arrays
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+
+# Basic input parameters
+beta = 40
+
+# Init the SumK class
+SK=SumkDFT(hdf_file='SrVO3.h5',use_dft_blocks=True)
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+
+gf_struct = set_operator_structure(spin_names,orb_names,False)
+glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+for block, gf in Sigma_iw:
+    gf << 0.5 * inverse(iOmega_n + 1.0)
+SK.set_Sigma([Sigma_iw])
+
+def k_sums():
+    return SK.extract_G_loc(), SK.total_density(), SK.density_matrix(method='using_gf', beta=beta)
+
+def assert_k_sums_are_close(sums_1, sums_2):
+    assert_block_gfs_are_close(sums_1[0][0], sums_2[0][0])
+    assert abs(sums_1[1] - sums_2[1]) < 1e-10, "total_density depends on the distribution of the k-points"
+    for sp in sums_1[2][0]:
+        assert_arrays_are_close(sums_1[2][0][sp], sums_2[2][0][sp])
+
+# k-points distributed by their estimated cost
+sums_model = k_sums()
+
+# the old distribution of contiguous slices
+plan = SK._k_plan()
+ik_local = plan['ik_local']
+plan['ik_local'] = mpi.slice_array(numpy.arange(SK.n_k))
+sums_slice = k_sums()
+assert_k_sums_are_close(sums_model, sums_slice)
+
+# k-points distributed by the measured times
+plan['ik_local'] = ik_local
+assert SK.balance_k_points(), "balance_k_points: no times measured"
+sums_timing = k_sums()
+assert_k_sums_are_close(sums_model, sums_timing)
+
+# every k-point is treated by exactly one process
+ik_all = gather_arrays(numpy.array(SK._k_points_local(), dtype=numpy.int_))
+if mpi.is_master_node():
+    assert numpy.array_equal(numpy.sort(ik_all), numpy.arange(SK.n_k)), "balance_k_points: k-points lost or duplicated"
+
+# the plans belong to the instance
+SK2 = SumkDFT(hdf_file='SrVO3.h5')
+assert SK2.k_plans is not SK.k_plans
+assert numpy.array_equal(SK2._k_points_local(), ik_local)
@@ -0,0 +1,50 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+
+# the Matsubara sums with the fitted tail against the density of TRIQS
+SK = SumkDFT(hdf_file='SrVO3.h5', use_dft_blocks=True)
+Sigma = SK.block_structure.create_gf(beta=40)
+for block, gf in Sigma:
+    # a constant part shifts the second moment of the tail
+    gf << 0.5 * inverse(iOmega_n + 1.0) + 0.3
+SK.set_Sigma([Sigma])
+SK.calc_mu(precision=0.01)
+
+# density matrices of the correlated shells
+for dm, G in zip(SK.density_matrix(method='using_gf'), SK.extract_G_loc()):
+    dm_ref = G.density()
+    for sp in dm:
+        assert_arrays_are_close(dm[sp], dm_ref[sp], 1.e-6)
+
+# total density, from the lattice GFs of all k-points
+dens_ref = 0.0
+for ik in range(SK.n_k):
+    G_latt = SK.lattice_gf(ik=ik, mu=SK.chemical_potential, iw_or_w="iw").copy()
+    dens_ref += SK.bz_weights[ik] * G_latt.total_density().real
+assert abs(SK.total_density().real - dens_ref) < 1.e-5, "total_density differs from the density of the lattice GFs"
@@ -0,0 +1,62 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+
+# Basic input parameters
+beta = 40
+
+# Init the SumK class
+SK=SumkDFT(hdf_file='SrVO3.h5',use_dft_blocks=True)
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+
+# reference: Matsubara sums of the non-interacting lattice GF
+dens_ref, dens_mu_ref = SK.total_density(with_Sigma=False, with_compressibility=True)
+dm_ref = SK.density_matrix(method='using_gf', beta=beta)
+
+# exact Fermi function of the eigenvalues of H(k)
+SK.set_noninteracting_eigen()
+dens_eigen, dens_mu_eigen = SK.total_density(with_Sigma=False, with_compressibility=True)
+dm_eigen = SK.density_matrix(method='using_gf', beta=beta)
+
+assert abs(dens_ref - dens_eigen) < 1e-5, "total_density: eigenvalue result differs from the Matsubara sum"
+assert abs(dens_mu_ref - dens_mu_eigen) < 1e-3 * abs(dens_mu_ref), "total_density: dN/dmu differs from the Matsubara sum"
+for sp in dm_ref[0]:
+    assert_arrays_are_close(dm_ref[0][sp], dm_eigen[0][sp], precision=1e-5)
+
+# a vanishing self-energy, which only fixes the Matsubara mesh of extract_G_loc
+gf_struct = set_operator_structure(spin_names,orb_names,False)
+glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+Sigma_iw.zero()
+SK.set_Sigma([Sigma_iw])
+
+# the eigen-decomposition is used by default, an explicit method is respected
+Gloc_eigen = SK.extract_G_loc(with_Sigma=False)
+Gloc_full = SK.extract_G_loc(with_Sigma=False, method='full')
+assert_block_gfs_are_close(Gloc_full[0], Gloc_eigen[0])
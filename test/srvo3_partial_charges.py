@@ -0,0 +1,100 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft_tools import *
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+
+def check_projectors_reference(SK):
+    # sum_k w_k P(k) P^dagger(k), one k-point at a time
+    dens_mat = [numpy.zeros([shell['dim'], shell['dim']], numpy.complex_) for shell in SK.corr_shells]
+    for ik in range(SK.n_k):
+        for icrsh in range(SK.n_corr_shells):
+            projmat = SK.proj_mat[ik, 0, icrsh, 0:SK.corr_shells[icrsh]['dim'], 0:SK.n_orbitals[ik, 0]]
+            dens_mat[icrsh] += SK.bz_weights[ik] * numpy.dot(projmat, projmat.conjugate().transpose())
+    if SK.symm_op != 0:
+        dens_mat = SK.symmcorr.symmetrize(dens_mat)
+    if SK.use_rotations:
+        for icrsh in range(SK.n_corr_shells):
+            if SK.rot_mat_time_inv[icrsh] == 1:
+                dens_mat[icrsh] = dens_mat[icrsh].conjugate()
+            dens_mat[icrsh] = numpy.dot(numpy.dot(SK.rot_mat[icrsh].conjugate().transpose(), dens_mat[icrsh]),
+                                        SK.rot_mat[icrsh])
+    return dens_mat
+
+def partial_charges_reference(SK):
+    # the downfolding of all shells and partial projectors, one k-point at a time
+    spn = SK.spin_block_names[SK.SO]
+    mesh = SK.Sigma_imp_iw[0].mesh
+    G_loc = [BlockGf(name_block_generator=[(sp, GfImFreq(indices=range(SK.shells[ish]['dim']), mesh=mesh))
+                                           for sp in spn], make_copies=False) for ish in range(SK.n_shells)]
+    for ik in range(SK.n_k):
+        G_latt = SK.lattice_gf(ik=ik, iw_or_w="iw").copy()
+        for ish in range(SK.n_shells):
+            tmp = G_loc[ish].copy()
+            for ir in range(SK.n_parproj[ish]):
+                for sp, gf in tmp:
+                    gf << SK.downfold(ik, ish, sp, G_latt[sp], gf, shells='all', ir=ir)
+                tmp *= SK.bz_weights[ik]
+                G_loc[ish] += tmp
+    if SK.symm_op != 0:
+        G_loc = SK.symmpar.symmetrize(G_loc)
+    if SK.use_rotations:
+        for ish in range(SK.n_shells):
+            for sp, gf in G_loc[ish]:
+                G_loc[ish][sp] << SK.rotloc(ish, gf, direction='toLocal', shells='all')
+    ntoi = SK.spin_names_to_ind[SK.SO]
+    return [[SK.dens_mat_below[ntoi[sp]][ish] + G_loc[ish].density()[sp] for ish in range(SK.n_shells)]
+            for sp in spn]
+
+def set_Sigma(SK):
+    Sigma = SK.block_structure.create_gf(beta=40)
+    for block, gf in Sigma:
+        gf << 0.5 * inverse(iOmega_n + 1.0) + 0.1
+    SK.set_Sigma([Sigma])
+
+# Wien2k input: partial projectors of all shells, k-dependent projectors
+SK = SumkDFTTools(hdf_file='SrVO3.h5', use_dft_blocks=True)
+set_Sigma(SK)
+dens_mat = SK.partial_charges()
+dens_mat_ref = partial_charges_reference(SK)
+for isp in range(len(dens_mat)):
+    for ish in range(SK.n_shells):
+        assert_arrays_are_close(dens_mat[isp][ish], dens_mat_ref[isp][ish], 1.e-10)
+for dm, dm_ref in zip(SK.check_projectors(), check_projectors_reference(SK)):
+    assert_arrays_are_close(dm, dm_ref, 1.e-12)
+
+# H(k) input: the same projectors at all k-points
+SK = SumkDFTTools(hdf_file='hk_convert.ref.h5', use_dft_blocks=False)
+assert SK.proj_mat_k_independent is not None
+for dm, dm_ref in zip(SK.check_projectors(), check_projectors_reference(SK)):
+    assert_arrays_are_close(dm, dm_ref, 1.e-12)
+# projectors that mix the orbitals
+dim, n_orb = SK.corr_shells[0]['dim'], SK.n_orbitals[0, 0]
+phase = numpy.exp(0.3j * numpy.arange(n_orb))
+unitary = numpy.linalg.qr(numpy.arange(1.0, n_orb**2 + 1).reshape(n_orb, n_orb) + numpy.diag(phase))[0]
+SK.proj_mat[0, :, 0, 0:dim, 0:n_orb] = numpy.dot(SK.proj_mat[0, 0, 0, 0:dim, 0:n_orb], unitary)
+for dm, dm_ref in zip(SK.check_projectors(), check_projectors_reference(SK)):
+    assert_arrays_are_close(dm, dm_ref, 1.e-12)
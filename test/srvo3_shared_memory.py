@@ -0,0 +1,69 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.archive import *
+from triqs_dft_tools.sumk_dft_tools import *
+from triqs_dft_tools.mpi_buffers import shared_bcast
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+
+# shared_bcast gives the same arrays as mpi.bcast, read-only if they are shared
+arrays = None
+if mpi.is_master_node():
+    numpy.random.seed(1)
+    arrays = [numpy.random.rand(3, 4) + 1j * numpy.random.rand(3, 4), numpy.arange(7), numpy.zeros([0, 2])]
+shared, window = shared_bcast(arrays)
+replicated = mpi.bcast(arrays)
+assert len(shared) == len(replicated)
+for s, r in zip(shared, replicated):
+    assert s.shape == r.shape and s.dtype == r.dtype
+    assert numpy.array_equal(s, r)
+    if window is not None:
+        assert not s.flags.writeable, 'shared_bcast: shared arrays are writeable'
+if mpi.size == 1:
+    assert window is None, 'shared_bcast: window on a single process'
+if window is not None:
+    mpi.barrier()
+    window.Free()
+
+# the large datasets stored once per node, compared to the data read by the master node and broadcast
+SK = SumkDFTTools(hdf_file='SrVO3.h5', use_dft_blocks=True, shared_memory=True)
+SK_ref = SumkDFTTools(hdf_file='SrVO3.h5', use_dft_blocks=True)
+for S in [SK, SK_ref]:
+    S.read_input_from_hdf(subgrp=S.parproj_data, things_to_read=['proj_mat_all'])
+    S.read_input_from_hdf(subgrp=S.transp_data, things_to_read=['band_window_optics', 'velocities_k'])
+
+for ik in range(SK.n_k):
+    assert_arrays_are_close(SK.proj_mat[ik], SK_ref.proj_mat[ik], 1.e-14)
+    assert_arrays_are_close(SK.proj_mat_all[ik], SK_ref.proj_mat_all[ik], 1.e-14)
+    assert_arrays_are_close(SK.hopping[ik], SK_ref.hopping[ik], 1.e-14)
+assert len(SK.velocities_k) == len(SK_ref.velocities_k)
+for vs, vs_ref in zip(SK.velocities_k, SK_ref.velocities_k):
+    assert len(vs) == len(vs_ref)
+    for v, v_ref in zip(vs, vs_ref):
+        assert_arrays_are_close(numpy.asarray(v), numpy.asarray(v_ref), 1.e-14)
+
+# and the k-sums give the same results
+assert abs(SK.total_density() - SK_ref.total_density()) < 1.e-12
+for G, G_ref in zip(SK.extract_G_loc(), SK_ref.extract_G_loc()):
+    assert_block_gfs_are_close(G, G_ref, 1.e-12)
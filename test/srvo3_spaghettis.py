@@ -0,0 +1,91 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.archive import *
+from triqs_dft_tools.sumk_dft_tools import *
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+import filecmp
+import shutil
+import h5py
+
+# the k-points of the DFT input serve as the k-path
+if mpi.is_master_node():
+    shutil.copyfile('SrVO3.h5', 'srvo3_spaghettis.h5')
+    with HDFArchive('srvo3_spaghettis.h5', 'a') as ar:
+        ar.create_group('dft_bands_input')
+        for it in ['n_k', 'n_orbitals', 'proj_mat', 'hopping']:
+            ar['dft_bands_input'][it] = ar['dft_input'][it]
+        for it in ['n_parproj', 'proj_mat_all']:
+            ar['dft_bands_input'][it] = ar['dft_parproj_input'][it]
+mpi.barrier()
+
+SK = SumkDFTTools(hdf_file='srvo3_spaghettis.h5', use_dft_blocks=True)
+
+with HDFArchive('SrVO3_Sigma.h5', 'r') as ar:
+    Sigma = ar['dmft_transp_input']['Sigma_w']
+    SK.set_Sigma([Sigma])
+    SK.chemical_potential = ar['dmft_transp_input']['chemical_potential']
+    SK.dc_imp = ar['dmft_transp_input']['dc_imp']
+
+plot_range = (-0.5, 0.5)
+mesh = numpy.array([x.real for x in Sigma.mesh])
+om_index = numpy.nonzero((mesh > plot_range[0]) & (mesh < plot_range[1]))[0]
+
+for ishell in [None, 0]:
+    Akw = SK.spaghettis(broadening=0.01, plot_range=plot_range, ishell=ishell, save_to_file='srvo3_spaghettis_txt_')
+    hdf_file = SK.spaghettis(broadening=0.01, plot_range=plot_range, ishell=ishell,
+                             save_to_file='srvo3_spaghettis_hdf_', hdf_file='srvo3_spaghettis.akw.h5', k_chunk=7)
+    assert hdf_file == 'srvo3_spaghettis.akw.h5'
+
+    if mpi.is_master_node():
+        with h5py.File(hdf_file, 'r') as ar:
+            assert_arrays_are_close(ar['mesh'][...], mesh[om_index], 1.e-14)
+            for sp in SK.spin_block_names[SK.SO]:
+                assert_arrays_are_close(ar[sp][...], Akw[sp][..., om_index], 1.e-12)
+        if ishell is None:
+            names = [sp + '.dat' for sp in SK.spin_block_names[SK.SO]]
+        else:
+            names = [str(ishell) + '_' + sp + '_proj' + str(ish) + '.dat'
+                     for sp in SK.spin_block_names[SK.SO] for ish in range(SK.shells[ishell]['dim'])]
+        for name in names:
+            assert filecmp.cmp('srvo3_spaghettis_txt_' + name, 'srvo3_spaghettis_hdf_' + name, shallow=False), \
+                'spaghettis: text output from hdf_file differs in ' + name
+    mpi.barrier()
+
+# the plot shift is added to all spin blocks in the plot range
+Akw = SK.spaghettis(broadening=0.01, plot_range=plot_range, save_to_file=None)
+Akw_shifted = SK.spaghettis(broadening=0.01, plot_shift=0.5, plot_range=plot_range, save_to_file=None)
+for sp in SK.spin_block_names[SK.SO]:
+    shift = numpy.zeros(Akw[sp].shape)
+    shift[:, om_index] = 0.5 * numpy.arange(SK.n_k)[:, numpy.newaxis]
+    assert_arrays_are_close(Akw_shifted[sp], Akw[sp] + shift, 1.e-12)
+
+# plot ranges with less than two frequencies of the mesh
+for plot_range in [(mesh[-1] + 1.0, mesh[-1] + 2.0), (mesh[0] - 1.0, 0.5 * (mesh[0] + mesh[1]))]:
+    try:
+        SK.spaghettis(broadening=0.01, plot_range=plot_range, save_to_file=None)
+    except AssertionError:
+        pass
+    else:
+        raise AssertionError, 'spaghettis: plot range with less than two frequencies not detected'
@@ -0,0 +1,63 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from pytriqs.operators.util import set_operator_structure
+from pytriqs.utility.comparison_tests import *
+import threading
+
+# Basic input parameters
+beta = 40
+
+# Init the SumK class
+SK=SumkDFT(hdf_file='SrVO3.h5',use_dft_blocks=True)
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+orb_names = ['%s'%i for i in range(num_orbitals)]
+
+gf_struct = set_operator_structure(spin_names,orb_names,False)
+glist = [ GfImFreq(indices=inner,beta=beta) for block,inner in gf_struct]
+Sigma_iw = BlockGf(name_list = [block for block,inner in gf_struct], block_list = glist, make_copies = False)
+for block, gf in Sigma_iw:
+    gf << 0.5 * inverse(iOmega_n + 1.0)
+SK.set_Sigma([Sigma_iw])
+
+# small blocks of k-points, so that there are many blocks for the threads
+SK.k_block_memory = 4 * 1024**2
+assert len(SK._k_blocks(SK._k_points_local(), len(Sigma_iw.mesh))) > 4
+
+def k_sums():
+    return SK.extract_G_loc(), SK.total_density(), SK.density_matrix(method='using_gf', beta=beta)
+
+sums_serial = k_sums()
+n_threads_before = threading.active_count()
+SK.n_threads = 4
+sums_threads = k_sums()
+
+assert_block_gfs_are_close(sums_serial[0][0], sums_threads[0][0])
+assert abs(sums_serial[1] - sums_threads[1]) < 1e-10, "total_density: threaded result differs from the serial one"
+for sp in sums_serial[2][0]:
+    assert_arrays_are_close(sums_serial[2][0][sp], sums_threads[2][0][sp])
+# the pools of threads are closed after the k-sums
+assert threading.active_count() == n_threads_before, "threads of the k-sums are still running"
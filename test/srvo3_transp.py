@@ -40,7 +40,10 @@ with HDFArchive('SrVO3_Sigma.h5', 'a') as ar:
     SK.chemical_potential = ar['dmft_transp_input']['chemical_potential']
     SK.dc_imp = ar['dmft_transp_input']['dc_imp']
 
+sigma_version = SK.sigma_version
 SK.transport_distribution(directions=['xx'], broadening=0.0, energy_window=[-0.3,0.3], Om_mesh=[0.00, 0.02] , beta=beta, with_Sigma=True)
+# truncating Sigma to the energy window invalidates the cached lattice GFs
+assert SK.sigma_version > sigma_version
 #SK.save(['Gamma_w','Om_meshr','omega','directions'])
 #SK.load(['Gamma_w','Om_meshr','omega','directions'])
 SK.conductivity_and_seebeck(beta=beta)
@@ -0,0 +1,66 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+from pytriqs.archive import *
+from triqs_dft_tools.sumk_dft_tools import *
+import pytriqs.utility.mpi as mpi
+import numpy
+import shutil
+
+if mpi.is_master_node():
+    shutil.copyfile('SrVO3.h5', 'srvo3_transp_sweep.h5')
+mpi.barrier()
+
+SK = SumkDFTTools(hdf_file='srvo3_transp_sweep.h5', use_dft_blocks=True)
+with HDFArchive('SrVO3_Sigma.h5', 'r') as ar:
+    SK.chemical_potential = ar['dmft_transp_input']['chemical_potential']
+
+betas = [20.0, 40.0]
+parameters = dict(directions=['xx'], energy_window=[-0.3, 0.3], Om_mesh=[0.0, 0.02], n_om=301, broadening=0.01)
+
+def check_close(a, b, message):
+    assert numpy.all(abs(numpy.asarray(a) - numpy.asarray(b)) <= 1.e-8 * abs(numpy.asarray(b))), message
+
+sweep = SK.transport_temperature_sweep(betas, **parameters)
+
+# nothing is written to the archive unless a subgroup is given
+if mpi.is_master_node():
+    with HDFArchive('srvo3_transp_sweep.h5', 'r') as ar:
+        assert 'dft_transp_output' not in ar, 'transport_temperature_sweep: archive written without subgrp'
+
+# every point of the sweep is the result of transport_distribution and conductivity_and_seebeck at this beta
+for ibeta, beta in enumerate(betas):
+    SK.transport_distribution(beta=beta, with_Sigma=False, **parameters)
+    result = SK.conductivity_and_seebeck(beta=beta)
+    if mpi.is_master_node():
+        for quantity, name in zip(range(3), ['optic_cond', 'seebeck', 'kappa']):
+            check_close(sweep[quantity]['xx'][ibeta], result[quantity]['xx'],
+                        'transport_temperature_sweep: %s differs at beta = %s' % (name, beta))
+
+# with a subgroup, the transport distribution is stored and read again
+stored = SK.transport_temperature_sweep(betas, subgrp='dft_transp_output', **parameters)
+SK.Gamma_w = None
+read = SK.transport_temperature_sweep(betas, subgrp='dft_transp_output', **parameters)
+if mpi.is_master_node():
+    for quantity in range(3):
+        check_close(stored[quantity]['xx'], sweep[quantity]['xx'], 'transport_temperature_sweep: stored result differs')
+        check_close(read[quantity]['xx'], sweep[quantity]['xx'], 'transport_temperature_sweep: result read from archive differs')
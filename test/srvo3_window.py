@@ -0,0 +1,83 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+
+
+from pytriqs.archive import *
+from triqs_dft_tools.sumk_dft_tools import *
+from pytriqs.utility.comparison_tests import *
+import pytriqs.utility.mpi as mpi
+import numpy
+
+SK = SumkDFTTools(hdf_file='SrVO3.h5', use_dft_blocks=True)
+
+with HDFArchive('SrVO3_Sigma.h5', 'r') as ar:
+    Sigma = ar['dmft_transp_input']['Sigma_w']
+    SK.set_Sigma([Sigma])
+    SK.chemical_potential = ar['dmft_transp_input']['chemical_potential']
+    SK.dc_imp = ar['dmft_transp_input']['dc_imp']
+
+broadening = 0.01
+spn = SK.spin_block_names[SK.SO]
+om_mesh = numpy.array([x.real for x in Sigma.mesh])
+# the window contains its end points
+i_min, i_max = len(om_mesh) // 3, 2 * len(om_mesh) // 3
+window = (om_mesh[i_min], om_mesh[i_max])
+om_index = numpy.arange(i_min, i_max + 1)
+
+index, window_mesh = SK._window_index("w", Sigma.mesh, window)
+assert numpy.array_equal(index, om_index)
+assert_arrays_are_close(numpy.array([x.real for x in window_mesh]), om_mesh[om_index], 1.e-12)
+
+# lattice Green's functions
+ik_block = range(SK.n_k)
+mesh, G_block = SK.lattice_gf_block(ik_block, iw_or_w="w", broadening=broadening)
+mesh, G_block_window = SK.lattice_gf_block(ik_block, iw_or_w="w", broadening=broadening, window=window)
+assert len(mesh) == len(om_index)
+for sp in spn:
+    assert_arrays_are_close(G_block_window[sp], G_block[sp][:, om_index], 1.e-12)
+for ik in [0, SK.n_k - 1]:
+    G_full = SK.lattice_gf(ik=ik, iw_or_w="w", broadening=broadening).copy()
+    G_window = SK.lattice_gf(ik=ik, iw_or_w="w", broadening=broadening, window=window).copy()
+    for sp in spn:
+        assert_arrays_are_close(G_window[sp].data, G_full[sp].data[om_index], 1.e-12)
+
+# DOS
+for dos in [SK.dos_wannier_basis, SK.dos_parproj_basis]:
+    DOS, DOSproj, DOSproj_orb = dos(broadening=broadening, save_to_file=False)
+    DOS_w, DOSproj_w, DOSproj_orb_w = dos(broadening=broadening, save_to_file=False, window=window)
+    for sp in spn:
+        assert_arrays_are_close(DOS_w[sp], DOS[sp][om_index], 1.e-12)
+        for ish in range(len(DOSproj)):
+            assert_arrays_are_close(DOSproj_w[ish][sp], DOSproj[ish][sp][om_index], 1.e-12)
+            assert_arrays_are_close(DOSproj_orb_w[ish][sp], DOSproj_orb[ish][sp][om_index], 1.e-12)
+
+# windows with less than two mesh points
+for window in [(om_mesh[i_min], om_mesh[i_min]), (om_mesh[-1] + 1.0, om_mesh[-1] + 2.0)]:
+    for calc in [lambda: SK.lattice_gf(ik=0, iw_or_w="w", broadening=broadening, window=window),
+                 lambda: SK.lattice_gf_block([0], iw_or_w="w", broadening=broadening, window=window),
+                 lambda: SK.dos_wannier_basis(broadening=broadening, save_to_file=False, window=window)]:
+        try:
+            calc()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError, 'lattice_gf: window with less than two mesh points not detected'